@@ -1,16 +1,22 @@
 import os
+import asyncio
+import contextlib
 import logging
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from flask import Flask
 from io import BytesIO
 import datetime
+import tempfile
 from zoneinfo import ZoneInfo
 from services.google import drive_service as drive_utils
-from utils.bot_proxy import safe_command, DescriptionEmptyError, APIKeyMissingError, set_user_limit
+from utils.bot_proxy import safe_command, track_handler, DescriptionEmptyError, APIKeyMissingError, set_user_limit, QUOTA_NOT_USED
 
 from services.ai.context import AIContext
+from services.transcription import jobs as transcription_jobs
+from utils import metrics, tracing, outbound
+from utils.update_processor import PerUserUpdateProcessor
+import webhook_server
 
 # Cargar variables de entorno
 load_dotenv()
@@ -24,6 +30,9 @@ logging.basicConfig(
 
 ECUADOR_TZ = ZoneInfo("America/Guayaquil")
 
+# Cantidad de updates (de usuarios distintos) procesadas en paralelo. 1 = secuencial.
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '8'))
+
 # --- SETUP PARA RAILWAY (Crear archivos de credenciales desde ENV) ---
 def setup_google_credentials():
     # 1. token.json
@@ -46,12 +55,6 @@ def setup_google_credentials():
 
 setup_google_credentials()
 
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "VinculacionBot is running!"
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /start"""
     await update.message.reply_text("¡Hola! Envia mensajes cortos describiendo lo que hiciste en el dia. Y envia las fotos, el resto del reporte se llena solo :D. ENVIA /help para ver los comandos")
@@ -71,9 +74,70 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 """
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
+# Segundos sin actividad en el menú /remove antes de guardar los borrados en Sheets
+REMOVE_FLUSH_DELAY = 15
+
+async def load_remove_session(context: ContextTypes.DEFAULT_TYPE, user_id):
+    """
+    Lee una sola vez los mensajes del día y los guarda en user_data mientras el menú está abierto.
+    Cada mensaje se identifica por su id estable, así un doble click no borra otra línea.
+    """
+    entries = await asyncio.to_thread(drive_utils.get_day_entries, user_id)
+    session = {
+        'items': [(entry['id'], entry['text']) for entry in entries],
+        'removed': [],
+        'flush_task': None
+    }
+    context.user_data['rm_session'] = session
+    return session
+
+async def flush_remove_session(context: ContextTypes.DEFAULT_TYPE, user_id):
+    """Guarda en Sheets, en una sola escritura, los mensajes borrados en el menú."""
+    session = context.user_data.get('rm_session')
+    if not session or not session['removed']:
+        return True
+
+    removed = session['removed']
+    session['removed'] = []
+    try:
+        await asyncio.to_thread(drive_utils.delete_day_entries, user_id, removed)
+        return True
+    except Exception as e:
+        logging.error(f"Error guardando mensajes eliminados: {e}")
+        # Reintentar en el próximo guardado
+        session['removed'] = removed + session['removed']
+        return False
+
+@contextlib.asynccontextmanager
+async def user_turn(context: ContextTypes.DEFAULT_TYPE, user_id):
+    """
+    Turno del usuario para escrituras fuera de un handler (guardados diferidos, transcripciones):
+    no escribir C mientras se procesa otra update suya.
+    """
+    processor = context.application.update_processor
+    if isinstance(processor, PerUserUpdateProcessor):
+        async with processor.user_lock(user_id):
+            yield
+    else:
+        yield
+
+async def _delayed_flush(context: ContextTypes.DEFAULT_TYPE, user_id):
+    await asyncio.sleep(REMOVE_FLUSH_DELAY)
+    async with user_turn(context, user_id):
+        await flush_remove_session(context, user_id)
+
+def schedule_remove_flush(context: ContextTypes.DEFAULT_TYPE, user_id):
+    """Reprograma el guardado diferido (debounce) para no perder borrados si no se pulsa 'Listo'."""
+    session = context.user_data.get('rm_session')
+    if not session:
+        return
+    if session['flush_task'] and not session['flush_task'].done():
+        session['flush_task'].cancel()
+    session['flush_task'] = context.application.create_task(_delayed_flush(context, user_id))
+
 async def show_remove_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int):
-    user_id = update.effective_user.id
-    messages = drive_utils.get_day_messages(user_id)
+    session = context.user_data.get('rm_session')
+    messages = session['items'] if session else []
     
     if not messages:
         text = "📭 Ya no hay mensajes."
@@ -97,9 +161,8 @@ async def show_remove_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, p
     
     # Construir texto
     text = f"🗑 **Eliminar Mensajes (Página {page + 1}/{total_pages})**\n\n"
-    text += "Cuidado que si borras algo, no se puede recuperar :c"
-    text += "Solo clickea una vez y espera a que se borre NO TE APRESURES"
-    for i, msg in enumerate(current_items):
+    text += "Cuidado que si borras algo, no se puede recuperar :c\n"
+    for i, (_, msg) in enumerate(current_items):
         # Truncar mensaje muy largo
         display_msg = (msg[:50] + '...') if len(msg) > 50 else msg
         text += f"{i + 1}. {display_msg}\n"
@@ -109,10 +172,9 @@ async def show_remove_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, p
     # Construir botones
     keyboard = []
     row = []
-    for i in range(len(current_items)):
-        # El callback data tendrá el ÍNDICE REAL (global) de la lista
-        real_idx = start_idx + i
-        row.append(InlineKeyboardButton(str(i + 1), callback_data=f"rm_del_{real_idx}"))
+    for i, (msg_id, _) in enumerate(current_items):
+        # El callback data lleva el id estable del mensaje y la página actual
+        row.append(InlineKeyboardButton(str(i + 1), callback_data=f"rm_del_{msg_id}_{page}"))
         if len(row) == 5: # 5 por fila
             keyboard.append(row)
             row = []
@@ -124,7 +186,7 @@ async def show_remove_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, p
     if page > 0:
         nav_row.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"rm_page_{page-1}"))
     
-    nav_row.append(InlineKeyboardButton("❌ Cancelar", callback_data="rm_cancel"))
+    nav_row.append(InlineKeyboardButton("✅ Listo", callback_data="rm_done"))
     
     if page < total_pages - 1:
         nav_row.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"rm_page_{page+1}"))
@@ -138,28 +200,51 @@ async def show_remove_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, p
     else:
         await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+@track_handler
 @safe_command
 async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra el menú para eliminar mensajes."""
     user_id = update.effective_user.id
-    messages = drive_utils.get_day_messages(user_id)
+
+    # Si quedó un menú anterior con borrados pendientes, guardarlos antes de recargar
+    await flush_remove_session(context, user_id)
+    session = await load_remove_session(context, user_id)
     
-    if not messages:
+    if not session['items']:
         await update.message.reply_text("📭 No hay mensajes en la bitácora de hoy para eliminar.")
         return
 
     await show_remove_menu(update, context, page=0)
 
+@track_handler
 async def remove_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     data = query.data
     user_id = update.effective_user.id
-    
-    if data == "rm_cancel":
-        await query.delete_message()
+    session = context.user_data.get('rm_session')
+    
+    # "rm_cancel" viene de menús creados antes de tener "Listo"
+    if data in ("rm_done", "rm_cancel"):
+        if session and session['flush_task'] and not session['flush_task'].done():
+            session['flush_task'].cancel()
+        saved = await flush_remove_session(context, user_id)
+        context.user_data.pop('rm_session', None)
+        if saved:
+            await query.delete_message()
+        else:
+            await query.edit_message_text("❌ Error guardando los cambios. Intenta de nuevo con /remove.")
         return
+
+    if not session:
+        # El menú expiró (ej: reinicio del bot). Los ids son estables, así que basta con recargar.
+        session = await load_remove_session(context, user_id)
+        if data.startswith("rm_del_") and len(data.split("_")) < 4:
+            # Botón de un menú antiguo (borraba por posición): no borrar a ciegas
+            await query.message.reply_text("⚠️ El menú había expirado, aquí está actualizado.")
+            await show_remove_menu(update, context, page=0)
+            return
         
     if data.startswith("rm_page_"):
         new_page = int(data.split("_")[-1])
@@ -167,19 +252,25 @@ async def remove_callback_handler(update: Update, context: ContextTypes.DEFAULT_
         return
         
     if data.startswith("rm_del_"):
-        idx_to_del = int(data.split("_")[-1])
-        
-        # Eliminar
-        success = drive_utils.delete_message_line(user_id, idx_to_del)
+        parts = data.split("_")
+        msg_id = int(parts[2])
+        page = int(parts[3]) if len(parts) > 3 else 0
         
-        if success:
-            # Volver a cargar la página 0 (o intentar mantener estado, pero 0 es seguro)
-            await show_remove_menu(update, context, page=0)
-        else:
-            await query.message.reply_text("❌ Error eliminando o el mensaje ya no existe.")
-            await show_remove_menu(update, context, page=0)
+        # Borrado local inmediato; Sheets se actualiza en un solo guardado al final
+        item = next((it for it in session['items'] if it[0] == msg_id), None)
+        if item is None:
+            # Doble click sobre un mensaje ya borrado: no hay nada que hacer
+            return
+        session['items'].remove(item)
+        session['removed'].append(msg_id)
+        logging.info(f"Mensaje marcado para eliminar (id {msg_id}): {item[1]}")
+        schedule_remove_flush(context, user_id)
+
+        # Mantener la página actual (show_remove_menu la ajusta si quedó vacía)
+        await show_remove_menu(update, context, page=page)
 
 
+@track_handler
 @safe_command
 async def send_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /send para generar reporte con IA"""
@@ -188,7 +279,7 @@ async def send_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🤔 Analizando tus mensajes de hoy...")
     
     # 1. Obtener mensajes del día
-    descriptions = drive_utils.get_day_descriptions(user_id)
+    descriptions = await asyncio.to_thread(drive_utils.get_day_descriptions, user_id)
     
     if not descriptions:
         raise DescriptionEmptyError("No hay descripciones")
@@ -198,7 +289,7 @@ async def send_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 2. Generar respuesta con IA
     try:
         ai_context = AIContext()
-        ai_response = ai_context.generate_summary(descriptions)
+        ai_response = await asyncio.to_thread(ai_context.generate_summary, descriptions)
     except Exception as e:
         # Si es error de API Key, relanzar especificamente si podemos detectarlo, 
         # sino dejar que el proxy capture el genérico
@@ -207,17 +298,24 @@ async def send_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         raise e
     
     # 3. Guardar en Column F
-    drive_utils.update_ai_response(ai_response, user_id)
-    
+    await asyncio.to_thread(drive_utils.update_ai_response, ai_response, user_id)
+
+    if ai_context.last_usage['cached']:
+        # Mismos mensajes que el último /send: no se llamó a la IA, no gasta cupo
+        await update.message.reply_text(
+            f"♻️ Tus mensajes no cambiaron desde el último /send, este es el mismo reporte (no gasta tu cupo):\n\n{ai_response}")
+        return QUOTA_NOT_USED
+
     await update.message.reply_text(f"✨ Reporte generado y guardado:\n\n{ai_response}")
 
+@track_handler
 @safe_command
 async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /get para obtener el reporte generado."""
     user_id = update.effective_user.id
     
     # 1. Obtener respuesta AI de Drive (Texto)
-    ai_response = drive_utils.get_ai_response(user_id)
+    ai_response = await asyncio.to_thread(drive_utils.get_ai_response, user_id)
     
     if not ai_response:
         ai_response = "No se ha usado el comando /send para que la ia genere la descripcion"
@@ -226,8 +324,9 @@ async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 2. Generar y enviar Excel
     status_msg = await update.message.reply_text("📊 Generando archivo Excel con historial...")
+    excel_path = None
     try:
-        excel_path = drive_utils.generate_excel_report(user_id)
+        excel_path = await asyncio.to_thread(drive_utils.generate_excel_report, user_id)
         if excel_path and os.path.exists(excel_path):
             with open(excel_path, 'rb') as f:
                 await update.message.reply_document(
@@ -236,16 +335,20 @@ async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     caption="Aquí tienes tu reporte completo en Excel."
                 )
             
-            # Eliminar mensaje de "Generando..." y archivo
+            # Eliminar mensaje de "Generando..."
             await status_msg.delete()
-            os.remove(excel_path)
         else:
             await status_msg.edit_text("⚠️ No se encontraron datos suficientes para generar el Excel.")
     except Exception as e:
         logging.error(f"Error enviando Excel: {e}")
         await status_msg.edit_text("❌ Ocurrió un error al generar el archivo Excel.")
+    finally:
+        # El archivo temporal se borra también si el envío falló
+        if excel_path and os.path.exists(excel_path):
+            os.remove(excel_path)
 
 
+@track_handler
 @safe_command
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /status <clave> para modificar límites."""
@@ -274,61 +377,65 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- MÉTODOS PARA MANEJAR DIFERENTES TIPOS DE CONTENIDO ---
 
+@track_handler
 async def handle_image_with_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Método para manejar imágenes con descripción"""
     # Obtener el archivo de la foto (la última es la de mayor resolución)
     photo = update.message.photo[-1]
-    photo_file = await photo.get_file()
-    
     caption = update.message.caption
     user_id = update.effective_user.id
     
     # Log para depuración
     logging.info(f"Foto recibida. Caption: {caption}")
-    
-    # Notificar usuario
-    status_msg = await update.message.reply_text("⏳ Recibido. Subiendo a Google Drive...")
 
     try:
-        # Descargar imagen a memoria
-        file_stream = BytesIO()
-        await photo_file.download_to_memory(out=file_stream)
-        file_stream.seek(0)
-        
-        # Definir nombre base: DD-MM-YYYY.jpg
-        # drive_utils se encargará de los duplicados (ej: (1), (2))
-        filename = datetime.datetime.now(ECUADOR_TZ).strftime("%d-%m-%Y.jpg")
-        
-        
-        # Subir a Drive
-        # Nota: La imagen se sube a la carpeta del día de PROCESAMIENTO por ahora (para no complicar create_doc logic)
-        # pero el link se guardará en la fila correspondiente a la fecha del mensaje.
-        uploaded_file, daily_folder = drive_utils.upload_image_from_stream(file_stream, filename, user_id, description=caption)
+        # Foto reenviada o repetida: ya está en la carpeta del día, no se descarga ni se sube otra vez
+        duplicate = await asyncio.to_thread(drive_utils.find_uploaded_photo, user_id, file_unique_id=photo.file_unique_id)
+        if duplicate:
+            uploaded_file, daily_folder = duplicate
+        else:
+            with tracing.span('telegram.get_file'):
+                photo_file = await photo.get_file()
+
+            # Descargar imagen a memoria
+            file_stream = BytesIO()
+            with tracing.span('telegram.download'):
+                await photo_file.download_to_memory(out=file_stream)
+            file_stream.seek(0)
+            
+            # Definir nombre base: DD-MM-YYYY.jpg
+            # drive_utils se encargará de los duplicados (ej: (1), (2))
+            filename = datetime.datetime.now(ECUADOR_TZ).strftime("%d-%m-%Y.jpg")
+            
+            # Subir a Drive
+            # Nota: La imagen se sube a la carpeta del día de PROCESAMIENTO por ahora (para no complicar create_doc logic)
+            # pero el link se guardará en la fila correspondiente a la fecha del mensaje.
+            uploaded_file, daily_folder = await asyncio.to_thread(
+                drive_utils.upload_image_from_stream, file_stream, filename, user_id,
+                description=caption, file_unique_id=photo.file_unique_id)
         
         # Obtener fecha del mensaje
         message_date = update.message.date.astimezone(ECUADOR_TZ)
         
         # Actualizar Sheet con Link de la Carpeta
         if daily_folder and daily_folder.get('webViewLink'):
-             drive_utils.update_daily_folder_link(daily_folder.get('webViewLink'), user_id=user_id, message_date=message_date)
+             await asyncio.to_thread(drive_utils.update_daily_folder_link, daily_folder.get('webViewLink'), user_id=user_id, message_date=message_date)
              
         # Si hay caption, guardarlo como texto en el Sheet también?
         # El usuario dijo: "todos los mensajes de texto se guarden en la columna description"
         # Asumo que el caption cuenta como mensaje de texto asociado.
-        if caption:
-            drive_utils.append_text_log(f"{caption}", user_id=user_id, message_date=message_date)
+        # En una foto repetida con el mismo caption, el caption ya está en la bitácora
+        if caption and not (uploaded_file.get('duplicate') and uploaded_file.get('description') == caption):
+            await asyncio.to_thread(drive_utils.append_text_log, f"{caption}", user_id=user_id, message_date=message_date, source='caption')
         
-        response_text = f"✅ ¡Guardado en Drive!\n"
-        response_text += f"📂 Archivo: {uploaded_file.get('name')}\n"
-        if caption:
-            response_text += f"📝 Descripción: {caption}"
-            
-        await status_msg.edit_text(response_text)
+        # Las fotos seguidas (álbumes) se confirman en un solo mensaje
+        outbound.outbox.ack(context.bot, update.effective_chat.id, 'duplicate' if uploaded_file.get('duplicate') else 'photo')
         
     except Exception as e:
         logging.error(f"Error subiendo imagen: {e}")
-        await status_msg.edit_text(f"❌ Error al guardar en Drive: {str(e)}")
+        outbound.outbox.send(context.bot, update.effective_chat.id, f"❌ Error al guardar en Drive: {str(e)}")
 
+@track_handler
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Método para manejar mensajes de texto"""
     text = update.message.text
@@ -341,216 +448,69 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not text.startswith('/'):
         # Guardar en Sheets
         message_date = update.message.date.astimezone(ECUADOR_TZ)
-        drive_utils.append_text_log(text, user_id=user_id, message_date=message_date)
-        await update.message.reply_text(f"📝 Texto guardado en bitácora.")
-
-async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Método para manejar mensajes de audio"""
-    audio = update.message.audio
-    
-    # Log para depuración
-    logging.info(f"Audio recibido. Duración: {audio.duration} segundos")
-    
-    # AQUÍ PUEDES IMPLEMENTAR TU LÓGICA PARA AUDIOS
-    # Por ejemplo: procesar el audio, transcribir, guardar, etc.
-    
-    await update.message.reply_text("🎵 Audio recibido correctamente. Pero aun no se implementa la funcionalidad. :D")
-
-async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Método para manejar mensajes de voz (voice notes)"""
-    voice = update.message.voice
-    
-    # Log para depuración
-    logging.info(f"Mensaje de voz recibido. Duración: {voice.duration} segundos")
-    
-    # AQUÍ PUEDES IMPLEMENTAR TU LÓGICA PARA NOTAS DE VOZ
-    # Por ejemplo: transcribir, procesar, etc.
-    
-    await update.message.reply_text("🎤 Nota de voz recibida correctamente. Pero aun no se implementa la funcionalidad. :D")
-
-async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Maneja documentos (podría ser audio, imagen, etc.)"""
-    document = update.message.document
-    
-    # Log para depuración
-    logging.info(f"Documento recibido: {document.file_name}")
-    
-    # Verificar el tipo de documento
-    mime_type = document.mime_type or ""
-    
-    if 'audio' in mime_type:
-        # Es un archivo de audio
-        await handle_audio(update, context)
-    elif 'image' in mime_type:
-        # Es una imagen enviada como documento
-        await handle_image_with_description(update, context)
-    else:
-        await update.message.reply_text(f"📄 Documento recibido: {document.file_name}, pero aun no se implementa la funcionalidad. :D")
-
-# --- AUTHENTICATION HANDLER ---
-
-
-    
-    if not descriptions:
-        raise DescriptionEmptyError("No hay descripciones")
-        
-    await update.message.reply_text("🧠 Generando reporte con IA...")
-    
-    # 2. Generar respuesta con IA
-    try:
-        ai_context = AIContext()
-        ai_response = ai_context.generate_summary(descriptions)
-    except Exception as e:
-        # Si es error de API Key, relanzar especificamente si podemos detectarlo, 
-        # sino dejar que el proxy capture el genérico
-        if "API_KEY" in str(e).upper(): # Simple check
-             raise APIKeyMissingError()
-        raise e
-    
-    # 3. Guardar en Column F
-    drive_utils.update_ai_response(ai_response, user_id)
-    
-    await update.message.reply_text(f"✨ Reporte generado y guardado:\n\n{ai_response}")
-
-@safe_command
-async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Maneja el comando /get para obtener el reporte generado."""
+        await asyncio.to_thread(drive_utils.append_text_log, text, user_id=user_id, message_date=message_date)
+        outbound.outbox.ack(context.bot, update.effective_chat.id, 'text')
+
+# Máxima duración aceptada de un audio o nota de voz, en segundos (0 = sin límite)
+MAX_AUDIO_SECONDS = int(os.getenv('MAX_AUDIO_SECONDS', '900'))
+
+async def transcribe_to_log(update: Update, context: ContextTypes.DEFAULT_TYPE, media, icon):
+    """
+    Descarga el audio y lo deja en la cola de transcripción; el handler termina enseguida.
+    Cuando el texto está listo se guarda en la bitácora igual que un mensaje de texto
+    (con la fecha del mensaje original) y se le responde al usuario.
+    """
     user_id = update.effective_user.id
-    
-    # 1. Obtener respuesta AI de Drive (Texto)
-    ai_response = drive_utils.get_ai_response(user_id)
-    
-    if not ai_response:
-        ai_response = "No se ha usado el comando /send para que la ia genere la descripcion"
-    
-    await update.message.reply_text(f" Tu reporte de hoy:\n\n{ai_response}")
+    duration = getattr(media, 'duration', None)
+    if MAX_AUDIO_SECONDS and duration and duration > MAX_AUDIO_SECONDS:
+        await update.message.reply_text(f"{icon} El audio dura más de {MAX_AUDIO_SECONDS // 60} minutos, envíalo en partes más cortas.")
+        return
 
-    # 2. Generar y enviar Excel
-    status_msg = await update.message.reply_text("📊 Generando archivo Excel con historial...")
-    try:
-        excel_path = drive_utils.generate_excel_report(user_id)
-        if excel_path and os.path.exists(excel_path):
-            with open(excel_path, 'rb') as f:
-                await update.message.reply_document(
-                    document=f,
-                    filename=os.path.basename(excel_path),
-                    caption="Aquí tienes tu reporte completo en Excel."
-                )
-            
-            # Eliminar mensaje de "Generando..." y archivo
-            await status_msg.delete()
-            os.remove(excel_path)
+    message_date = update.message.date.astimezone(ECUADOR_TZ)
+    with tracing.span('telegram.get_file'):
+        media_file = await media.get_file()
+    suffix = os.path.splitext(media_file.file_path or '')[1] or '.ogg'
+    fd, audio_path = tempfile.mkstemp(prefix='audio_', suffix=suffix)
+    os.close(fd)
+    with tracing.span('telegram.download'):
+        await media_file.download_to_drive(audio_path)
+
+    chat_id = update.effective_chat.id
+
+    async def on_done(text, error):
+        if error:
+            outbound.outbox.send(context.bot, chat_id, f"❌ No se pudo transcribir el audio: {str(error)}")
+        elif not text:
+            outbound.outbox.send(context.bot, chat_id, "⚠️ No se reconoció voz en el audio.")
         else:
-            await status_msg.edit_text("⚠️ No se encontraron datos suficientes para generar el Excel.")
-    except Exception as e:
-        logging.error(f"Error enviando Excel: {e}")
-        await status_msg.edit_text("❌ Ocurrió un error al generar el archivo Excel.")
-
+            # Igual que un mensaje de texto: en el turno del usuario, no en paralelo con sus otras updates
+            async with user_turn(context, user_id):
+                await asyncio.to_thread(drive_utils.append_text_log, text, user_id=user_id, message_date=message_date, source='voice')
+            outbound.outbox.send(context.bot, chat_id, f"📝 Transcripción guardada en bitácora:\n\n{text}")
 
-@safe_command
-async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Maneja el comando /status <clave> para modificar límites."""
-    user_id = update.effective_user.id
-    
-    if not context.args:
-        await update.message.reply_text("❌ Uso: /status <clave>")
+    try:
+        ahead = transcription_jobs.get_queue().submit(user_id, audio_path, on_done)
+    except transcription_jobs.TranscriptionQueueFull:
+        os.remove(audio_path)
+        await update.message.reply_text("⏳ Hay muchos audios en espera, vuelve a enviarlo en unos minutos.")
         return
 
-    key = context.args[0]
-    limit = 1 # Default
-    msg = ""
-
-    if key == "dosLlamaditas":
-        limit = 2
-        msg = "🔓 Clave aceptada. Límite aumentado a 2 usos diarios."
-    elif key == "adminEnable11":
-        limit = 10
-        msg = "🔓 Clave de Admin aceptada. Límite aumentado a 10 usos diarios."
+    if ahead:
+        outbound.outbox.send(context.bot, chat_id, f"{icon} Audio recibido. Hay {ahead} audio(s) antes del tuyo, te aviso cuando esté transcrito.")
     else:
-        await update.message.reply_text("🔒 Clave incorrecta.")
-        return
-
-    set_user_limit(user_id, limit)
-    await update.message.reply_text(msg)
-
-# --- MÉTODOS PARA MANEJAR DIFERENTES TIPOS DE CONTENIDO ---
-
-async def handle_image_with_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Método para manejar imágenes con descripción"""
-    # Obtener el archivo de la foto (la última es la de mayor resolución)
-    photo = update.message.photo[-1]
-    photo_file = await photo.get_file()
-    
-    caption = update.message.caption
-    user_id = update.effective_user.id
-    
-    # Log para depuración
-    logging.info(f"Foto recibida. Caption: {caption}")
-    
-    # Notificar usuario
-    status_msg = await update.message.reply_text("⏳ Recibido. Subiendo a Google Drive...")
-
-    try:
-        # Descargar imagen a memoria
-        file_stream = BytesIO()
-        await photo_file.download_to_memory(out=file_stream)
-        file_stream.seek(0)
-        
-        # Definir nombre base: DD-MM-YYYY.jpg
-        # drive_utils se encargará de los duplicados (ej: (1), (2))
-        filename = datetime.datetime.now().strftime("%d-%m-%Y.jpg")
-        
-        
-        # Subir a Drive
-        uploaded_file, daily_folder = drive_utils.upload_image_from_stream(file_stream, filename, user_id, description=caption)
-        
-        # Actualizar Sheet con Link de la Carpeta
-        if daily_folder and daily_folder.get('webViewLink'):
-             drive_utils.update_daily_folder_link(daily_folder.get('webViewLink'), user_id=user_id)
-             
-        # Si hay caption, guardarlo como texto en el Sheet también?
-        # El usuario dijo: "todos los mensajes de texto se guarden en la columna description"
-        # Asumo que el caption cuenta como mensaje de texto asociado.
-        if caption:
-            drive_utils.append_text_log(f"{caption}", user_id=user_id)
-        
-        response_text = f"✅ ¡Guardado en Drive!\n"
-        response_text += f"📂 Archivo: {uploaded_file.get('name')}\n"
-        if caption:
-            response_text += f"📝 Descripción: {caption}"
-            
-        await status_msg.edit_text(response_text)
-        
-    except Exception as e:
-        logging.error(f"Error subiendo imagen: {e}")
-        await status_msg.edit_text(f"❌ Error al guardar en Drive: {str(e)}")
-
-async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Método para manejar mensajes de texto"""
-    text = update.message.text
-    user_id = update.effective_user.id
-    
-    # Log para depuración
-    logging.info(f"Mensaje de texto recibido: {text}")
-    
-    # Evitar procesar comandos como texto normal
-    if not text.startswith('/'):
-        # Guardar en Sheets
-        drive_utils.append_text_log(text, user_id=user_id)
-        await update.message.reply_text(f"📝 Texto guardado en bitácora.")
+        outbound.outbox.send(context.bot, chat_id, f"{icon} Audio recibido. Transcribiendo...")
 
+@track_handler
 async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Método para manejar mensajes de audio"""
-    audio = update.message.audio
+    """Método para manejar mensajes de audio (o documentos de audio, ver handle_document)"""
+    audio = update.message.audio or update.message.document
     
     # Log para depuración
-    logging.info(f"Audio recibido. Duración: {audio.duration} segundos")
+    logging.info(f"Audio recibido. Duración: {getattr(audio, 'duration', None)} segundos")
     
-    # AQUÍ PUEDES IMPLEMENTAR TU LÓGICA PARA AUDIOS
-    # Por ejemplo: procesar el audio, transcribir, guardar, etc.
-    
-    await update.message.reply_text("🎵 Audio recibido correctamente. Pero aun no se implementa la funcionalidad. :D")
+    await transcribe_to_log(update, context, audio, "🎵")
 
+@track_handler
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Método para manejar mensajes de voz (voice notes)"""
     voice = update.message.voice
@@ -558,10 +518,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Log para depuración
     logging.info(f"Mensaje de voz recibido. Duración: {voice.duration} segundos")
     
-    # AQUÍ PUEDES IMPLEMENTAR TU LÓGICA PARA NOTAS DE VOZ
-    # Por ejemplo: transcribir, procesar, etc.
-    
-    await update.message.reply_text("🎤 Nota de voz recibida correctamente. Pero aun no se implementa la funcionalidad. :D")
+    await transcribe_to_log(update, context, voice, "🎤")
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja documentos (podría ser audio, imagen, etc.)"""
@@ -586,13 +543,32 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
-def create_application():
-    """Configura y retorna la aplicación del bot con todos los handlers."""
+async def stop_background_jobs(application):
+    """Se ejecuta después de application.stop(), antes de shutdown(), con lo que quede del plazo de apagado."""
+    await transcription_jobs.get_queue().stop(timeout=webhook_server.shutdown_remaining())
+    await outbound.outbox.drain(timeout=webhook_server.shutdown_remaining())
+
+def create_application(request=None):
+    """
+    Configura y retorna la aplicación del bot con todos los handlers.
+    request permite inyectar un BaseRequest propio (ej: el falso de benchmarks/).
+    """
     if not TOKEN:
         print("Error: TELEGRAM_TOKEN no encontrado en .env")
         return None
 
-    application = ApplicationBuilder().token(TOKEN).build()
+    builder = ApplicationBuilder().token(TOKEN)
+    # Usuarios distintos en paralelo, las updates de un mismo usuario en orden;
+    # comandos y botones antes que textos y fotos (ej: cron_bot poniéndose al día)
+    if UPDATE_WORKERS > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_WORKERS))
+    if request is not None:
+        builder = builder.request(request)
+    # Todo envío respeta los límites de Telegram y se reintenta tras RetryAfter
+    builder = builder.rate_limiter(outbound.OutboundRateLimiter())
+    # Al detener: esperar las transcripciones y envíos en curso (el bot aún puede responder)
+    builder = builder.post_stop(stop_background_jobs)
+    application = builder.build()
     
     # Handlers de comandos
     application.add_handler(CommandHandler('start', start))
@@ -627,13 +603,12 @@ if __name__ == '__main__':
         if webhook_url:
             port = int(os.environ.get("PORT", 8443))
             print(f"Iniciando Bot en modo Webhook en puerto {port}...")
-            
-            application.run_webhook(
-                listen="0.0.0.0",
-                port=port,
-                url_path=TOKEN,
-                webhook_url=f"{webhook_url}/{TOKEN}"
-            )
+
+            # Webhook, health check (/) y métricas (/metrics) en un solo servidor ASGI
+            webhook_server.run(application, webhook_url, url_path=TOKEN, port=port,
+                               processes=int(os.getenv('WORKER_PROCESSES', '1')))
         else:
             print("Iniciando Bot en modo Polling...")
-            application.run_polling()
\ No newline at end of file
+            application.run_polling()
+
+            metrics.dump_snapshot()
\ No newline at end of file
@@ -0,0 +1,552 @@
+"""
+Implementaciones falsas en memoria de las APIs externas que usa el bot:
+- Drive v3 y Sheets v4 (la parte de la API que usa services/google/drive_service.py)
+- Endpoint de chat compatible con OpenAI (DeepSeek / Groq)
+- Bot API de Telegram (como BaseRequest de python-telegram-bot)
+
+Todas tienen latencia configurable y pueden devolver errores de cuota (429).
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+import datetime
+
+import httplib2
+from googleapiclient.errors import HttpError
+from telegram.request import BaseRequest
+
+from services.ai.prompt_budget import estimate_tokens
+
+# JPEG mínimo para las descargas de fotos
+FAKE_JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 2048 + b'\xff\xd9'
+
+
+def fake_jpeg(key):
+    """Mismo tamaño que FAKE_JPEG, contenido distinto por archivo (para la detección de repetidas)."""
+    return b'\xff\xd8\xff\xe0' + key.encode()[:2048].ljust(2048, b'\x00') + b'\xff\xd9'
+
+
+def _col_to_index(col):
+    idx = 0
+    for ch in col:
+        idx = idx * 26 + (ord(ch.upper()) - ord('A') + 1)
+    return idx - 1
+
+
+def _index_to_col(idx):
+    col = ""
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        col = chr(ord('A') + rem) + col
+    return col
+
+
+_CELL_RE = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+
+def parse_a1(range_name, default_tab):
+    """
+    Convierte un rango A1 en (tab, col_ini, fila_ini, col_fin, fila_fin), 0-based.
+    Filas o columnas abiertas quedan en None (ej: 'A:B' o 'A5:H').
+    """
+    tab = default_tab
+    if '!' in range_name:
+        tab, range_name = range_name.rsplit('!', 1)
+        tab = tab.strip("'")
+    parts = range_name.split(':')
+    start = _CELL_RE.match(parts[0])
+    end = _CELL_RE.match(parts[1]) if len(parts) > 1 else start
+    c1 = _col_to_index(start.group(1)) if start.group(1) else 0
+    r1 = int(start.group(2)) - 1 if start.group(2) else None
+    c2 = _col_to_index(end.group(1)) if end.group(1) else None
+    r2 = int(end.group(2)) - 1 if end.group(2) else None
+    if len(parts) == 1 and r1 is not None:
+        c2, r2 = c1, r1
+    return tab, c1, r1, c2, r2
+
+
+class FakeRequest:
+    """Equivalente a googleapiclient.http.HttpRequest: methodId + execute()."""
+
+    def __init__(self, backend, method_id, fn):
+        self.backend = backend
+        self.methodId = method_id
+        self._fn = fn
+
+    def execute(self, num_retries=0, http=None):
+        self.backend.before_call(self.methodId)
+        with self.backend.lock:
+            result = self._fn()
+            self.backend.after_call(self.methodId)
+            return result
+
+
+class FakeBatchRequest:
+    """Equivalente a BatchHttpRequest: una sola latencia (y un solo posible 429) para todas las peticiones."""
+
+    def __init__(self, backend, api, callback=None):
+        self.backend = backend
+        self.api = api
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request, callback or self.callback, request_id))
+
+    def execute(self, http=None):
+        self.backend.before_call(f"{self.api}.batch")
+        for request, callback, request_id in self._requests:
+            with self.backend.lock:
+                self.backend.calls[request.methodId] = self.backend.calls.get(request.methodId, 0) + 1
+                try:
+                    response, exception = request._fn(), None
+                    self.backend.after_call(request.methodId)
+                except HttpError as e:
+                    response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+# Métodos de Sheets que no cambian la versión del archivo
+_SHEET_READS = {
+    'sheets.spreadsheets.get', 'sheets.spreadsheets.values.get',
+    'sheets.spreadsheets.values.batchGet', 'sheets.spreadsheets.developerMetadata.search'
+}
+
+
+class FakeGoogleBackend:
+    """Estado compartido (archivos de Drive y hojas) + latencia y errores de cuota simulados."""
+
+    def __init__(self, latency_ms=60, jitter_ms=20, quota_error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.quota_error_rate = quota_error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.files = {}
+        self.sheets = {}
+        self.default_tab = 'Hoja 1'
+        self.sheets[self.default_tab] = []
+        self.sheet_ids = {self.default_tab: 0}
+        # Developer metadata: {'metadataId', 'metadataKey', 'metadataValue', 'location'}
+        self.metadata = []
+        self.calls = {}
+        # Peticiones HTTP reales (un batch cuenta una vez)
+        self.round_trips = 0
+        self.quota_errors = 0
+        self._next_id = 0
+        # Versión del Spreadsheet en Drive (files.get con su id); install_fakes fija el id
+        self.spreadsheet_id = None
+        self.sheet_version = 1
+        # Modificado "hace mucho": la primera consulta no lo toma como un cambio externo
+        self.sheet_modified = 0.0
+        self.sheet_modified_by_me = True
+
+    def before_call(self, method_id):
+        with self.lock:
+            self.calls[method_id] = self.calls.get(method_id, 0) + 1
+            self.round_trips += 1
+            fail = self.quota_error_rate and self.random.random() < self.quota_error_rate
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)
+        if fail:
+            with self.lock:
+                self.quota_errors += 1
+            content = json.dumps({'error': {'code': 429, 'message': 'Quota exceeded (fake)'}}).encode()
+            raise HttpError(httplib2.Response({'status': '429'}), content)
+
+    def after_call(self, method_id):
+        """Las escrituras a Sheets cambian la versión del archivo, como en Drive."""
+        if method_id.startswith('sheets.') and method_id not in _SHEET_READS:
+            self.touch_sheet(by_me=True)
+
+    def touch_sheet(self, by_me):
+        with self.lock:
+            self.sheet_version += 1
+            self.sheet_modified = time.time()
+            self.sheet_modified_by_me = by_me
+
+    def new_id(self):
+        self._next_id += 1
+        return f"fake{self._next_id:08d}"
+
+    # --- Helpers para preparar escenarios ---
+
+    def seed_rows(self, rows, tab=None):
+        with self.lock:
+            tab = tab or self.default_tab
+            if tab not in self.sheets:
+                self.sheet_ids[tab] = max(self.sheet_ids.values()) + 1
+            self.sheets.setdefault(tab, []).extend([list(r) for r in rows])
+
+    def rows(self, tab=None):
+        return self.sheets.get(tab or self.default_tab, [])
+
+    def edit_by_hand(self, tab, row, col, value):
+        """Simula una edición del personal en el Sheet (fila y columna 0-based)."""
+        with self.lock:
+            rows = self.sheets.setdefault(tab or self.default_tab, [])
+            while len(rows) <= row:
+                rows.append([])
+            while len(rows[row]) <= col:
+                rows[row].append("")
+            rows[row][col] = value
+            self.touch_sheet(by_me=False)
+
+
+# --- DRIVE v3 ---
+
+_Q_EQ_RE = re.compile(r"(\w+)\s*=\s*'((?:[^'\\]|\\.)*)'")
+_Q_PARENT_RE = re.compile(r"'([^']+)'\s+in\s+parents")
+
+
+class _FakeFiles:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def list(self, q=None, spaces=None, fields=None, pageSize=None, pageToken=None):
+        def run():
+            conditions = dict(_Q_EQ_RE.findall(q or ""))
+            parent = _Q_PARENT_RE.search(q or "")
+            items = []
+            for f in self.backend.files.values():
+                if f.get('trashed'):
+                    continue
+                if 'name' in conditions and f['name'] != conditions['name']:
+                    continue
+                if 'mimeType' in conditions and f['mimeType'] != conditions['mimeType']:
+                    continue
+                if parent and parent.group(1) not in f['parents']:
+                    continue
+                items.append(dict(f))
+            return {'files': items}
+        return FakeRequest(self.backend, 'drive.files.list', run)
+
+    def create(self, body=None, media_body=None, fields=None):
+        def run():
+            file_id = self.backend.new_id()
+            f = {
+                'id': file_id,
+                'name': body.get('name'),
+                'mimeType': body.get('mimeType', 'image/jpeg' if media_body else 'application/octet-stream'),
+                'parents': list(body.get('parents', [])),
+                'description': body.get('description'),
+                'webViewLink': f"https://drive.fake/{file_id}",
+                'size': media_body.size() if media_body is not None else 0
+            }
+            self.backend.files[file_id] = f
+            return dict(f)
+        return FakeRequest(self.backend, 'drive.files.create', run)
+
+    def get(self, fileId=None, fields=None):
+        def run():
+            if fileId is not None and fileId == self.backend.spreadsheet_id:
+                modified = datetime.datetime.fromtimestamp(self.backend.sheet_modified, datetime.timezone.utc)
+                return {'version': str(self.backend.sheet_version),
+                        'modifiedTime': modified.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+                        'lastModifyingUser': {'me': self.backend.sheet_modified_by_me}}
+            f = self.backend.files.get(fileId)
+            if f is None:
+                raise HttpError(httplib2.Response({'status': '404'}), b'{"error": {"code": 404}}')
+            return dict(f)
+        return FakeRequest(self.backend, 'drive.files.get', run)
+
+
+class FakeDriveService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def files(self):
+        return _FakeFiles(self.backend)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self.backend, 'drive', callback)
+
+
+# --- SHEETS v4 ---
+
+class _FakeValues:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _read(self, range_name):
+        tab, c1, r1, c2, r2 = parse_a1(range_name, self.backend.default_tab)
+        if tab not in self.backend.sheets:
+            raise HttpError(httplib2.Response({'status': '400'}),
+                            json.dumps({'error': {'code': 400, 'message': f"Unable to parse range: {range_name}"}}).encode())
+        rows = self.backend.sheets[tab]
+        r1 = r1 or 0
+        r2 = len(rows) - 1 if r2 is None else min(r2, len(rows) - 1)
+        values = []
+        for r in range(r1, r2 + 1):
+            row = rows[r]
+            end = len(row) if c2 is None else c2 + 1
+            cells = [("" if v is None else v) for v in row[c1:end]]
+            while cells and cells[-1] == "":
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        result = {'range': range_name, 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def _write(self, range_name, values, value_input_option='RAW'):
+        tab, c1, r1, _, _ = parse_a1(range_name, self.backend.default_tab)
+        if value_input_option == 'USER_ENTERED':
+            # Como en Sheets: el apóstrofo inicial fuerza texto y no se guarda
+            values = [[v[1:] if isinstance(v, str) and v.startswith("'") else v for v in row] for row in values]
+        rows = self.backend.sheets.setdefault(tab, [])
+        r1 = r1 or 0
+        for i, new_row in enumerate(values):
+            while len(rows) <= r1 + i:
+                rows.append([])
+            row = rows[r1 + i]
+            while len(row) < c1 + len(new_row):
+                row.append("")
+            for j, v in enumerate(new_row):
+                row[c1 + j] = v
+        return {'updatedRange': range_name, 'updatedRows': len(values)}
+
+    def get(self, spreadsheetId=None, range=None, **kwargs):
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.get', lambda: self._read(range))
+
+    def batchGet(self, spreadsheetId=None, ranges=None, **kwargs):
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.batchGet',
+                           lambda: {'valueRanges': [self._read(r) for r in ranges or []]})
+
+    def update(self, spreadsheetId=None, range=None, valueInputOption=None, body=None):
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.update',
+                           lambda: self._write(range, body.get('values', []), valueInputOption))
+
+    def append(self, spreadsheetId=None, range=None, valueInputOption=None, insertDataOption=None, body=None):
+        def run():
+            tab, _, _, _, _ = parse_a1(range, self.backend.default_tab)
+            rows = self.backend.sheets.setdefault(tab, [])
+            start = len(rows)
+            new_rows = body.get('values', [])
+            for row in new_rows:
+                if valueInputOption == 'USER_ENTERED':
+                    row = [v[1:] if isinstance(v, str) and v.startswith("'") else v for v in row]
+                rows.append(list(row))
+            last_col = _index_to_col(max((len(r) for r in new_rows), default=1) - 1)
+            return {
+                'spreadsheetId': spreadsheetId,
+                'updates': {
+                    'updatedRange': f"'{tab}'!A{start + 1}:{last_col}{start + len(new_rows)}",
+                    'updatedRows': len(new_rows)
+                }
+            }
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.append', run)
+
+    def batchUpdate(self, spreadsheetId=None, body=None):
+        def run():
+            for item in body.get('data', []):
+                self._write(item['range'], item.get('values', []), body.get('valueInputOption', 'RAW'))
+            return {'totalUpdatedRanges': len(body.get('data', []))}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.values.batchUpdate', run)
+
+
+class _FakeSpreadsheets:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def values(self):
+        return _FakeValues(self.backend)
+
+    def developerMetadata(self):
+        return _FakeDeveloperMetadata(self.backend)
+
+    def get(self, spreadsheetId=None, fields=None, **kwargs):
+        def run():
+            sheets = []
+            for title in self.backend.sheets:
+                sheet_id = self.backend.sheet_ids[title]
+                sheets.append({
+                    'properties': {'sheetId': sheet_id, 'title': title},
+                    'developerMetadata': [dict(m) for m in self.backend.metadata
+                                          if m['location'].get('sheetId') == sheet_id]
+                })
+            return {'sheets': sheets}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.get', run)
+
+    def batchUpdate(self, spreadsheetId=None, body=None):
+        def run():
+            replies = []
+            for req in body.get('requests', []):
+                if 'addSheet' in req:
+                    properties = req['addSheet']['properties']
+                    title = properties['title']
+                    if title in self.backend.sheets:
+                        raise HttpError(httplib2.Response({'status': '400'}), json.dumps(
+                            {'error': {'code': 400, 'message': f"A sheet with the name \"{title}\" already exists."}}).encode())
+                    sheet_id = properties.get('sheetId', max(self.backend.sheet_ids.values()) + 1)
+                    self.backend.sheets[title] = []
+                    self.backend.sheet_ids[title] = sheet_id
+                    replies.append({'addSheet': {'properties': {'title': title, 'sheetId': sheet_id}}})
+                elif 'createDeveloperMetadata' in req:
+                    metadata = dict(req['createDeveloperMetadata']['developerMetadata'])
+                    metadata['metadataId'] = max((m['metadataId'] for m in self.backend.metadata), default=0) + 1
+                    self.backend.metadata.append(metadata)
+                    replies.append({'createDeveloperMetadata': {'developerMetadata': metadata}})
+                elif 'deleteDeveloperMetadata' in req:
+                    lookup = req['deleteDeveloperMetadata']['dataFilter'].get('developerMetadataLookup', {})
+                    self.backend.metadata = [m for m in self.backend.metadata
+                                             if m.get('metadataId') != lookup.get('metadataId')]
+                    replies.append({'deleteDeveloperMetadata': {}})
+                else:
+                    replies.append({})
+            return {'spreadsheetId': spreadsheetId, 'replies': replies}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.batchUpdate', run)
+
+
+class _FakeDeveloperMetadata:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def search(self, spreadsheetId=None, body=None):
+        def run():
+            matched = []
+            for data_filter in body.get('dataFilters', []):
+                lookup = data_filter.get('developerMetadataLookup', {})
+                for m in self.backend.metadata:
+                    if 'metadataKey' in lookup and m['metadataKey'] != lookup['metadataKey']:
+                        continue
+                    if 'metadataValue' in lookup and m.get('metadataValue') != lookup['metadataValue']:
+                        continue
+                    matched.append({'developerMetadata': dict(m), 'dataFilters': [data_filter]})
+            return {'matchedDeveloperMetadata': matched} if matched else {}
+        return FakeRequest(self.backend, 'sheets.spreadsheets.developerMetadata.search', run)
+
+
+class FakeSheetsService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def spreadsheets(self):
+        return _FakeSpreadsheets(self.backend)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self.backend, 'sheets', callback)
+
+
+# --- CHAT COMPLETIONS (OpenAI compatible) ---
+
+class FakeChatResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeChatCompletions:
+    """Reemplazo de requests.post para /chat/completions con latencia y errores 429."""
+
+    def __init__(self, latency_ms=700, jitter_ms=200, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def post(self, url, headers=None, json=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+            fail = self.error_rate and self.random.random() < self.error_rate
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)
+        if fail:
+            with self.lock:
+                self.errors += 1
+            return FakeChatResponse(429, {'error': {'message': 'Rate limit reached (fake)'}})
+
+        prompt = json['messages'][-1]['content']
+        content = "Durante la jornada se realizaron las actividades descritas en la bitácora."
+        return FakeChatResponse(200, {
+            'choices': [{'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': estimate_tokens(prompt), 'completion_tokens': estimate_tokens(content)}
+        })
+
+
+# --- TELEGRAM BOT API ---
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    BaseRequest que responde localmente a los métodos de la Bot API que usa el bot.
+    flood_rate: probabilidad de responder 429 (RetryAfter) a los envíos a un chat.
+    """
+
+    def __init__(self, latency_ms=30, jitter_ms=10, seed=None, flood_rate=0.0, retry_after=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.random = random.Random(seed)
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.flood_errors = 0
+        self.calls = {}
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params, **extra):
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(datetime.datetime.now(datetime.timezone.utc).timestamp()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'}
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, method, params):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                    'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendDocument':
+            return self._message(params, document={'file_id': 'doc', 'file_unique_id': 'doc'})
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            return {'file_id': file_id, 'file_unique_id': f"u{file_id}", 'file_size': len(FAKE_JPEG),
+                    'file_path': f"photos/{file_id}.jpg"}
+        # deleteMessage, answerCallbackQuery, editMessageReplyMarkup, ...
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+        if '/file/bot' in url:
+            self.calls['download'] = self.calls.get('download', 0) + 1
+            return 200, fake_jpeg(url.rsplit('/', 1)[-1])
+
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if 'chat_id' in params and self.flood_rate and self.random.random() < self.flood_rate:
+            self.flood_errors += 1
+            body = {'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after}}
+            return 429, json.dumps(body).encode()
+        body = {'ok': True, 'result': self._result(api_method, params)}
+        return 200, json.dumps(body).encode()
@@ -0,0 +1,305 @@
+"""
+Benchmark offline del bot: reproduce flujos sintéticos de updates de Telegram a través
+de los handlers de create_application(), con Drive/Sheets/IA/Telegram falsos (benchmarks/fakes.py).
+
+Uso:
+    python -m benchmarks.run --scenario all --users 20 --per-user 10
+    python -m benchmarks.run --scenario text_burst --google-latency-ms 120 --quota-error-rate 0.02
+
+Escenarios: text_burst, album, resend, send_storm, get_history, catch_up.
+"""
+import os
+import sys
+import time
+import types
+import asyncio
+import logging
+import argparse
+import datetime
+import tempfile
+
+# Configurar el entorno ANTES de importar app (TOKEN y DB se leen al importar)
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:BENCHMARK')
+os.environ['AI_PROVIDER'] = 'groq'
+os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+os.environ.pop('GOOGLE_TOKEN_JSON', None)
+os.environ.pop('GOOGLE_CREDENTIALS_JSON', None)
+
+from services import storage_service
+storage_service.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='bench_'), 'bench.db')
+
+from telegram import Update
+
+import app
+from services.google import drive_service, sheet_layout
+from services.ai import groq_strategy
+from utils import cache, metrics
+from utils.update_processor import PRIORITY_NAMES, get_update_priority
+from benchmarks.fakes import (
+    FakeGoogleBackend, FakeDriveService, FakeSheetsService, FakeChatCompletions, FakeTelegramRequest
+)
+
+SCENARIOS = ('text_burst', 'album', 'resend', 'send_storm', 'get_history', 'catch_up')
+BASE_USER_ID = 100000
+
+
+# --- Generación de updates sintéticas ---
+
+class _UpdateFactory:
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def _base(self, user_id, **message):
+        self.update_id += 1
+        self.message_id += 1
+        msg = {
+            'message_id': self.message_id,
+            'date': int(datetime.datetime.now(datetime.timezone.utc).timestamp()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Estudiante {user_id}"}
+        }
+        msg.update(message)
+        return {'update_id': self.update_id, 'message': msg}
+
+    def text(self, user_id, text):
+        return self._base(user_id, text=text)
+
+    def command(self, user_id, command):
+        return self._base(user_id, text=command, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])
+
+    def photo(self, user_id, caption=None, media_group_id=None, file_id=None, file_unique_id=None):
+        file_id = file_id or f"p{self.update_id + 1}"
+        file_unique_id = file_unique_id or f"u{file_id}"
+        message = {'photo': [{'file_id': file_id, 'file_unique_id': file_unique_id, 'width': 1280, 'height': 960, 'file_size': 2056}]}
+        if caption:
+            message['caption'] = caption
+        if media_group_id:
+            message['media_group_id'] = media_group_id
+        return self._base(user_id, **message)
+
+
+def _seed_rows(backend, rows):
+    """Precarga filas en la pestaña que les corresponde según el layout activo."""
+    for row in rows:
+        date_obj = datetime.datetime.strptime(row[1], "%d-%m-%Y")
+        tab = sheet_layout.shard_for(row[0], date_obj)
+        if tab and tab not in backend.sheets:
+            backend.seed_rows([sheet_layout.HEADER_ROW], tab)
+        backend.seed_rows([row], tab)
+
+
+def build_scenario(name, backend, users, per_user):
+    """Retorna la lista de updates (dicts) del escenario y precarga la hoja si hace falta."""
+    factory = _UpdateFactory()
+    # Usuarios distintos por escenario: el registro local de la bitácora (SQLite) se comparte entre escenarios
+    base = BASE_USER_ID * (SCENARIOS.index(name) + 1)
+    user_ids = [base + i for i in range(users)]
+    updates = []
+    today = datetime.datetime.now(drive_service.ECUADOR_TZ)
+    formula = '=INDIRECT("H"&ROW())-INDIRECT("G"&ROW())'
+
+    if name == 'text_burst':
+        # Todos los usuarios escriben a la vez, mensajes intercalados
+        for n in range(per_user):
+            for uid in user_ids:
+                updates.append(factory.text(uid, f"Actividad {n} del estudiante {uid}: revisión de avances"))
+
+    elif name == 'album':
+        # Cada usuario manda un álbum (caption solo en la primera foto, como hace Telegram)
+        for uid in user_ids:
+            for n in range(per_user):
+                caption = f"Evidencia del estudiante {uid}" if n == 0 else None
+                updates.append(factory.photo(uid, caption=caption, media_group_id=f"album{uid}"))
+
+    elif name == 'resend':
+        # Fotos reenviadas: cada una llega dos veces (mismo file_unique_id) y una tercera
+        # con el mismo contenido pero otro file_unique_id (se reconoce por hash)
+        for uid in user_ids:
+            for n in range(per_user):
+                file_id = f"r{uid}_{n}"
+                updates.append(factory.photo(uid, file_id=file_id))
+                updates.append(factory.photo(uid, file_id=file_id))
+                updates.append(factory.photo(uid, file_id=file_id, file_unique_id=f"x{file_id}"))
+
+    elif name == 'send_storm':
+        rows = []
+        for uid in user_ids:
+            desc = "\n".join(f"Actividad {n}: trabajo de campo" for n in range(per_user))
+            rows.append([str(uid), today.strftime("%d-%m-%Y"), desc, "No se han guardaron fotos", formula, "", "08:00:00", "12:00:00"])
+        _seed_rows(backend, rows)
+        updates = [factory.command(uid, '/send') for uid in user_ids]
+
+    elif name == 'get_history':
+        rows = []
+        for day in range(per_user * 10, 0, -1):
+            date_str = (today - datetime.timedelta(days=day)).strftime("%d-%m-%Y")
+            for uid in user_ids:
+                rows.append([str(uid), date_str, "Actividad registrada", "https://drive.fake/x", formula,
+                             "Resumen generado por IA", "08:00:00", "12:00:00"])
+        _seed_rows(backend, rows)
+        updates = [factory.command(uid, '/get') for uid in user_ids]
+
+    elif name == 'catch_up':
+        # Cola acumulada (cron_bot al arrancar): fotos y textos de casi todos, y al final
+        # un /get de cada cuarto usuario, que no debería esperar a que se suban las fotos
+        rows = []
+        for i, uid in enumerate(user_ids):
+            if i % 4 == 0:
+                rows.append([str(uid), (today - datetime.timedelta(days=1)).strftime("%d-%m-%Y"), "Actividad registrada",
+                             "https://drive.fake/x", formula, "Resumen generado por IA", "08:00:00", "12:00:00"])
+                continue
+            for n in range(per_user):
+                updates.append(factory.photo(uid))
+                updates.append(factory.text(uid, f"Actividad {n} del estudiante {uid}"))
+        _seed_rows(backend, rows)
+        updates += [factory.command(uid, '/get') for i, uid in enumerate(user_ids) if i % 4 == 0]
+
+    else:
+        raise ValueError(f"Escenario desconocido: {name}")
+
+    return updates
+
+
+# --- Ejecución ---
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def install_fakes(backend, llm):
+    drive_service.get_drive_service = lambda: FakeDriveService(backend)
+    drive_service.get_sheets_service = lambda: FakeSheetsService(backend)
+    groq_strategy.requests = types.SimpleNamespace(post=llm.post)
+    sheet_layout.catalog.reset()
+    backend.spreadsheet_id = drive_service.SPREADSHEET_ID
+    drive_service.sheet_changes.reset()
+    cache.reset()
+
+
+async def run_scenario(name, args):
+    backend = FakeGoogleBackend(args.google_latency_ms, args.google_jitter_ms, args.quota_error_rate, seed=args.seed)
+    llm = FakeChatCompletions(args.llm_latency_ms, args.llm_jitter_ms, args.llm_error_rate, seed=args.seed)
+    telegram_request = FakeTelegramRequest(args.telegram_latency_ms, seed=args.seed, flood_rate=args.telegram_flood_rate)
+    install_fakes(backend, llm)
+
+    updates = build_scenario(name, backend, args.users, args.per_user)
+
+    application = app.create_application(request=telegram_request)
+    await application.initialize()
+
+    latencies = []
+    # prioridad -> latencias (ms), para ver si los comandos pasan adelante de las fotos
+    by_priority = {}
+
+    async def process(update):
+        start = time.perf_counter()
+        # Igual que el fetcher de la Application: pasa por su update_processor
+        await application.update_processor.process_update(update, application.process_update(update))
+        latency = (time.perf_counter() - start) * 1000
+        latencies.append(latency)
+        by_priority.setdefault(PRIORITY_NAMES[get_update_priority(update)], []).append(latency)
+
+    wall_start = time.perf_counter()
+    tasks = []
+    for data in updates:
+        update = Update.de_json(data, application.bot)
+        tasks.append(asyncio.create_task(process(update)))
+        if args.arrival_interval_ms:
+            await asyncio.sleep(args.arrival_interval_ms / 1000)
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - wall_start
+
+    # Envíos que quedaron en segundo plano (confirmaciones agrupadas, respuestas de audios)
+    await application.post_stop(application)
+    await application.shutdown()
+
+    latencies.sort()
+    for values in by_priority.values():
+        values.sort()
+    return {
+        'scenario': name,
+        'updates': len(updates),
+        'wall_s': wall,
+        'throughput': len(updates) / wall if wall else 0.0,
+        'p50': _percentile(latencies, 0.50),
+        'p95': _percentile(latencies, 0.95),
+        'p99': _percentile(latencies, 0.99),
+        'by_priority': {name: (len(values), _percentile(values, 0.50), _percentile(values, 0.95))
+                        for name, values in sorted(by_priority.items())},
+        'google_calls': sum(count for method, count in backend.calls.items() if not method.endswith('.batch')),
+        'google_round_trips': backend.round_trips,
+        'google_by_endpoint': dict(sorted(backend.calls.items())),
+        'quota_errors': backend.quota_errors,
+        'telegram_calls': sum(telegram_request.calls.values()),
+        'telegram_by_method': dict(sorted(telegram_request.calls.items())),
+        'flood_errors': telegram_request.flood_errors,
+        'llm_calls': llm.calls,
+        'caches': {name: c for name, c in cache.stats().items() if c['hits'] or c['misses']}
+    }
+
+
+def print_report(results):
+    print(f"\n{'escenario':<13} {'updates':>7} {'wall s':>8} {'upd/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'google':>7} {'http':>6} {'429':>5} {'tg':>5} {'llm':>5}")
+    for r in results:
+        print(f"{r['scenario']:<13} {r['updates']:>7} {r['wall_s']:>8.2f} {r['throughput']:>8.2f} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['p99']:>9.1f} "
+              f"{r['google_calls']:>7} {r['google_round_trips']:>6} {r['quota_errors']:>5} {r['telegram_calls']:>5} {r['llm_calls']:>5}")
+    print("\nLlamadas a Google por endpoint:")
+    for r in results:
+        detail = ", ".join(f"{k}={v}" for k, v in r['google_by_endpoint'].items())
+        print(f"  {r['scenario']}: {detail}")
+    print("\nLlamadas a Telegram por método (429 simulados entre paréntesis):")
+    for r in results:
+        detail = ", ".join(f"{k}={v}" for k, v in r['telegram_by_method'].items())
+        print(f"  {r['scenario']}: {detail} ({r['flood_errors']})")
+    print("\nLatencia por prioridad (updates, p50/p95 ms):")
+    for r in results:
+        detail = ", ".join(f"{name}={count} {p50:.0f}/{p95:.0f}" for name, (count, p50, p95) in r['by_priority'].items())
+        print(f"  {r['scenario']}: {detail}")
+    print("\nCachés (aciertos/consultas):")
+    for r in results:
+        detail = ", ".join(f"{name}={c['hits']}/{c['hits'] + c['misses']}" for name, c in sorted(r['caches'].items()))
+        print(f"  {r['scenario']}: {detail}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline de VinculacionBot")
+    parser.add_argument('--scenario', default='all', choices=('all',) + SCENARIOS)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--per-user', type=int, default=5)
+    parser.add_argument('--arrival-interval-ms', type=float, default=0.0, help="Separación entre updates (0 = ráfaga)")
+    parser.add_argument('--google-latency-ms', type=float, default=60)
+    parser.add_argument('--google-jitter-ms', type=float, default=20)
+    parser.add_argument('--quota-error-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-latency-ms', type=float, default=30)
+    parser.add_argument('--telegram-flood-rate', type=float, default=0.0, help="Probabilidad de 429 RetryAfter en envíos")
+    parser.add_argument('--llm-latency-ms', type=float, default=700)
+    parser.add_argument('--llm-jitter-ms', type=float, default=200)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--sheet-layout', choices=sheet_layout.LAYOUTS, default=None, help="Por defecto SHEET_LAYOUT")
+    parser.add_argument('--user-groups', type=int, default=None, help="Por defecto SHEET_USER_GROUPS")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    sheet_layout.configure(args.sheet_layout, args.user_groups)
+
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    results = []
+    for name in scenarios:
+        metrics.reset()
+        results.append(asyncio.run(run_scenario(name, args)))
+    print_report(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,7 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_application
+from utils import metrics
 
 # Configuración de logging para ver qué pasa
 logging.basicConfig(
@@ -51,7 +52,13 @@ async def run_cron_job():
     print("🛑 Tiempo cumplido. Deteniendo bot...")
     await application.updater.stop()
     await application.stop()
+    # Igual que run_polling: esperar transcripciones y mensajes en segundo plano
+    if application.post_stop:
+        await application.post_stop(application)
     await application.shutdown()
+
+    # 5. Guardar métricas de esta ejecución (ver con: python -m utils.metrics)
+    metrics.dump_snapshot()
     print("✅ Proceso Cron Job finalizado exitosamente.")
 
 if __name__ == "__main__":
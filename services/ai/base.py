@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
 
 class AIStrategy(ABC):
+    # Uso de tokens reportado por el proveedor en la última llamada:
+    # {'input_tokens': int, 'output_tokens': int} o None si el proveedor no lo informa
+    last_usage = None
+
     @abstractmethod
     def generate_summary(self, text_content: str) -> str:
         pass
@@ -1,19 +1,39 @@
 import os
+import hashlib
+import logging
+from utils import cache
 from .gemini_strategy import GeminiStrategy
 from .deepseek_strategy import DeepSeekStrategy
 from .groq_strategy import GroqStrategy
 from .base import AIStrategy
+from .instrumentation import InstrumentedStrategy
+from .prompt_budget import prepare_input, MAX_INPUT_TOKENS, CHARS_PER_TOKEN
+
+# Resúmenes ya generados por proveedor y texto: un /send repetido sobre el mismo día
+# (o el cron reintentando) no vuelve a llamar al modelo. En bot_data.db, compartido entre procesos.
+AI_SUMMARY_CACHE_SECONDS = float(os.getenv('AI_SUMMARY_CACHE_SECONDS', str(7 * 24 * 3600)))
+_summary_cache = cache.sqlite('ai_summaries', ttl=AI_SUMMARY_CACHE_SECONDS, max_entries=5000)
 
 class AIContext:
     def __init__(self):
         self._strategy: AIStrategy = None
+        # Resumen de tokens de la última llamada a generate_summary
+        # {'provider': str, 'calls': int, 'input_tokens': int, 'output_tokens': int, 'cached': bool}
+        # cached: el resumen salió de la caché, sin llamar al modelo
+        self.last_usage = None
 
     def set_strategy(self, strategy: AIStrategy):
         self._strategy = strategy
 
     def get_strategy(self) -> AIStrategy:
+        strategy = self._strategy or self._build_strategy()
+        if not isinstance(strategy, InstrumentedStrategy):
+            strategy = InstrumentedStrategy(strategy)
+        return strategy
+
+    def _build_strategy(self) -> AIStrategy:
         provider = os.getenv('AI_PROVIDER', 'gemini').lower()
-        
+
         if provider == 'deepseek':
             return DeepSeekStrategy()
         elif provider == 'groq':
@@ -21,6 +41,34 @@ class AIContext:
         else:
             return GeminiStrategy()
 
+    def _call(self, strategy: InstrumentedStrategy, text_content: str) -> str:
+        """Llama al proveedor y acumula el uso de tokens de la petición."""
+        response = strategy.generate_summary(text_content)
+        self.last_usage['calls'] += 1
+        self.last_usage['input_tokens'] += strategy.last_usage['input_tokens']
+        self.last_usage['output_tokens'] += strategy.last_usage['output_tokens']
+        return response
+
     def generate_summary(self, text_content: str) -> str:
         strategy = self.get_strategy()
-        return strategy.generate_summary(text_content)
+        self.last_usage = {'provider': strategy.provider, 'calls': 0, 'input_tokens': 0, 'output_tokens': 0}
+        key = f"{strategy.provider}:{hashlib.sha256(text_content.encode()).hexdigest()}"
+        summary = _summary_cache.get_or_load(key, lambda: self._summarize(strategy, text_content))
+        self.last_usage['cached'] = self.last_usage['calls'] == 0
+        return summary
+
+    def _summarize(self, strategy: InstrumentedStrategy, text_content: str) -> str:
+        chunks = prepare_input(text_content)
+
+        # Map-reduce: resumir cada bloque y luego resumir los resúmenes
+        # hasta que el texto quepa en el presupuesto
+        while len(chunks) > 1:
+            partials = [self._call(strategy, chunk) for chunk in chunks]
+            chunks = prepare_input("\n".join(partials))
+            if len(chunks) > 1 and len(chunks) >= len(partials):
+                # Los resúmenes no se reducen; forzar un único bloque recortado
+                chunks = ["\n".join(partials)[:MAX_INPUT_TOKENS * CHARS_PER_TOKEN]]
+
+        summary = self._call(strategy, chunks[0])
+        logging.info(f"IA {self.last_usage['provider']}: {self.last_usage['calls']} llamadas, tokens entrada={self.last_usage['input_tokens']}, salida={self.last_usage['output_tokens']}")
+        return summary
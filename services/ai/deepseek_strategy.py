@@ -31,7 +31,13 @@ class DeepSeekStrategy(AIStrategy):
             response = requests.post(url, headers=headers, json=data)
             
             if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
+                payload = response.json()
+                usage = payload.get('usage') or {}
+                self.last_usage = {
+                    'input_tokens': usage.get('prompt_tokens'),
+                    'output_tokens': usage.get('completion_tokens')
+                } if usage else None
+                return payload['choices'][0]['message']['content']
             else:
                 raise AIServiceError(f"Error DeepSeek API: {response.text}")
         except Exception as e:
@@ -18,6 +18,11 @@ class GeminiStrategy(AIStrategy):
             prompt = SUMMARY_PROMPT_TEMPLATE.format(text_content=text_content)
             
             response = model.generate_content(prompt)
+            usage = getattr(response, 'usage_metadata', None)
+            self.last_usage = {
+                'input_tokens': usage.prompt_token_count,
+                'output_tokens': usage.candidates_token_count
+            } if usage else None
             return response.text
         except Exception as e:
             raise AIServiceError(f"Error Gemini API: {str(e)}")
@@ -0,0 +1,57 @@
+import time
+import logging
+from .base import AIStrategy
+from .prompts import SUMMARY_PROMPT_TEMPLATE
+from .prompt_budget import estimate_tokens
+from utils import metrics, tracing
+
+AI_LATENCY = metrics.histogram(
+    'ai_request_duration_seconds', 'Latencia de generate_summary por proveedor', ('provider',))
+AI_REQUESTS = metrics.counter(
+    'ai_requests_total', 'Llamadas a generate_summary por proveedor y resultado', ('provider', 'status'))
+AI_ERRORS = metrics.counter(
+    'ai_errors_total', 'Errores de generate_summary por proveedor y tipo de excepción', ('provider', 'error'))
+AI_TOKENS = metrics.counter(
+    'ai_tokens_total', 'Tokens consumidos por proveedor (input/output)', ('provider', 'direction'))
+
+
+class InstrumentedStrategy(AIStrategy):
+    """
+    Envoltura de una estrategia de IA que mide latencia, éxitos/errores y tokens.
+    Deja en last_usage el uso reportado por el proveedor o, si no lo reporta, una estimación.
+    """
+
+    def __init__(self, strategy: AIStrategy):
+        self._strategy = strategy
+        self.provider = type(strategy).__name__
+
+    def generate_summary(self, text_content: str) -> str:
+        self._strategy.last_usage = None
+        start = time.perf_counter()
+        try:
+            with tracing.span('ai.generate_summary', provider=self.provider):
+                response = self._strategy.generate_summary(text_content)
+        except Exception as e:
+            AI_REQUESTS.inc(provider=self.provider, status='error')
+            AI_ERRORS.inc(provider=self.provider, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            AI_LATENCY.observe(elapsed, provider=self.provider)
+
+        AI_REQUESTS.inc(provider=self.provider, status='ok')
+
+        usage = self._strategy.last_usage or {}
+        input_tokens = usage.get('input_tokens')
+        if input_tokens is None:
+            input_tokens = estimate_tokens(SUMMARY_PROMPT_TEMPLATE.format(text_content=text_content))
+        output_tokens = usage.get('output_tokens')
+        if output_tokens is None:
+            output_tokens = estimate_tokens(response)
+
+        AI_TOKENS.inc(input_tokens, provider=self.provider, direction='input')
+        AI_TOKENS.inc(output_tokens, provider=self.provider, direction='output')
+        self.last_usage = {'input_tokens': input_tokens, 'output_tokens': output_tokens}
+
+        logging.info(f"IA {self.provider}: {elapsed:.2f}s, tokens entrada={input_tokens}, salida={output_tokens}")
+        return response
@@ -0,0 +1,83 @@
+import os
+import math
+import logging
+
+# Presupuesto de tokens para el texto del día (sin contar la plantilla del prompt)
+MAX_INPUT_TOKENS = int(os.getenv('AI_MAX_INPUT_TOKENS', '3000'))
+# Tamaño de cada bloque cuando el texto no cabe y se resume por partes (map-reduce)
+CHUNK_TOKENS = int(os.getenv('AI_CHUNK_TOKENS', '1500'))
+# Límite para una sola línea (texto pegado muy largo)
+MAX_LINE_TOKENS = int(os.getenv('AI_MAX_LINE_TOKENS', '400'))
+
+# Aproximación: ~4 caracteres por token en español/inglés
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estima la cantidad de tokens de un texto sin depender de un tokenizer."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def dedupe_lines(text_content: str) -> list:
+    """
+    Separa el texto en líneas, quita vacías y repetidas (ignorando mayúsculas y espacios).
+    Mantiene el orden de la primera aparición.
+    """
+    seen = set()
+    lines = []
+    for raw in (text_content or "").split('\n'):
+        line = raw.strip()
+        if not line:
+            continue
+        key = " ".join(line.lower().split())
+        if key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+    return lines
+
+
+def trim_line(line: str, max_tokens: int = MAX_LINE_TOKENS) -> str:
+    """Recorta una línea que supera el máximo de tokens."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(line) <= max_chars:
+        return line
+    return line[:max_chars].rstrip() + "..."
+
+
+def split_into_chunks(lines: list, max_tokens: int = CHUNK_TOKENS) -> list:
+    """Agrupa líneas en bloques de texto que no superan max_tokens cada uno."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for line in lines:
+        line_tokens = estimate_tokens(line) + 1  # +1 por el salto de línea
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def prepare_input(text_content: str) -> list:
+    """
+    Etapa de presupuesto previa a generate_summary.
+    Retorna una lista de bloques: uno solo si el texto cabe en MAX_INPUT_TOKENS,
+    varios si hay que resumir por partes.
+    """
+    lines = [trim_line(line) for line in dedupe_lines(text_content)]
+    text = "\n".join(lines)
+    tokens = estimate_tokens(text)
+
+    if tokens <= MAX_INPUT_TOKENS:
+        return [text]
+
+    chunks = split_into_chunks(lines, CHUNK_TOKENS)
+    logging.info(f"Texto del día excede el presupuesto ({tokens} > {MAX_INPUT_TOKENS} tokens). Se resume en {len(chunks)} bloques.")
+    return chunks
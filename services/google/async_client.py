@@ -0,0 +1,186 @@
+"""
+Cliente asyncio para la parte de Drive v3, Sheets v4 y Docs v1 que usa el bot.
+
+googleapiclient usa httplib2: sus clientes no son thread-safe (un servicio por hilo) y
+cada llamada abre su propia conexión. Este cliente usa un solo httpx.AsyncClient con
+conexiones keep-alive reutilizadas (y HTTP/2 si está instalado h2), así cientos de
+llamadas concurrentes caben en un event loop sin un hilo por llamada.
+
+El token OAuth se comparte: cuando vence, una sola corrutina lo refresca y las demás esperan.
+Los errores se lanzan como googleapiclient.errors.HttpError, igual que con el cliente síncrono,
+y las llamadas cuentan en las mismas métricas google_api_* por endpoint.
+
+Uso:
+    async with AsyncGoogleClient() as client:
+        result = await client.values_get(SPREADSHEET_ID, "A:B")
+"""
+import json
+import time
+import asyncio
+import importlib.util
+from urllib.parse import quote
+
+import httpx
+import httplib2
+from googleapiclient.errors import HttpError
+from google.auth.transport.requests import Request
+
+from utils import tracing
+from services.google.drive_service import (
+    GOOGLE_API_LATENCY, GOOGLE_API_REQUESTS, SHEET_READ_ENDPOINTS, get_credentials, sheet_changes)
+
+DRIVE_URL = "https://www.googleapis.com/drive/v3"
+DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3"
+SHEETS_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+DOCS_URL = "https://docs.googleapis.com/v1/documents"
+# Conexiones abiertas a la vez (con HTTP/2 varias llamadas comparten una)
+GOOGLE_MAX_CONNECTIONS = 100
+GOOGLE_TIMEOUT_SECONDS = 60
+
+
+class _SharedCredentials:
+    """Credenciales compartidas por todas las corrutinas; el refresco se hace una sola vez."""
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self._lock = asyncio.Lock()
+
+    async def token(self, rejected=None):
+        """rejected: token que Google rechazó (401), se refresca aunque no haya vencido."""
+        if self.credentials.valid and self.credentials.token != rejected:
+            return self.credentials.token
+        async with self._lock:
+            # Otra corrutina pudo refrescarlo mientras se esperaba el lock
+            if not self.credentials.valid or self.credentials.token == rejected:
+                await asyncio.to_thread(self.credentials.refresh, Request())
+            return self.credentials.token
+
+
+class AsyncGoogleClient:
+    """
+    credentials: google.oauth2.credentials.Credentials (por defecto las de get_credentials()).
+    transport permite inyectar un httpx.AsyncBaseTransport (ej: httpx.MockTransport en pruebas).
+    """
+
+    def __init__(self, credentials=None, max_connections=GOOGLE_MAX_CONNECTIONS, http2=None, transport=None):
+        if credentials is None:
+            credentials = get_credentials()
+        self._credentials = _SharedCredentials(credentials)
+        if http2 is None:
+            http2 = importlib.util.find_spec('h2') is not None
+        self._client = httpx.AsyncClient(
+            http2=http2 and transport is None,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=GOOGLE_TIMEOUT_SECONDS,
+            transport=transport)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _request(self, endpoint, method, url, params=None, body=None, content=None, headers=None):
+        """Hace la llamada con el token vigente (si responde 401, refresca y reintenta una vez)."""
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            with tracing.span(endpoint):
+                rejected = None
+                for _ in range(2):
+                    token = await self._credentials.token(rejected)
+                    request_headers = dict(headers or {}, Authorization=f"Bearer {token}")
+                    response = await self._client.request(
+                        method, url, params=params, json=body, content=content, headers=request_headers)
+                    if response.status_code != 401:
+                        break
+                    rejected = token
+                if response.status_code >= 400:
+                    raise HttpError(httplib2.Response({'status': str(response.status_code), 'reason': response.reason_phrase}),
+                                    response.content, uri=str(response.url))
+                if endpoint.startswith('sheets.') and endpoint not in SHEET_READ_ENDPOINTS:
+                    sheet_changes.record_own_write()
+                return response.json() if response.content else {}
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            GOOGLE_API_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+            GOOGLE_API_REQUESTS.inc(endpoint=endpoint, status=status)
+
+    # --- DRIVE ---
+
+    async def files_list(self, q, fields='files(id, name)', page_size=None, page_token=None):
+        params = {'q': q, 'spaces': 'drive', 'fields': fields}
+        if page_size:
+            params['pageSize'] = page_size
+        if page_token:
+            params['pageToken'] = page_token
+        return await self._request('drive.files.list', 'GET', f"{DRIVE_URL}/files", params=params)
+
+    async def files_create(self, body, fields='id, name, webViewLink'):
+        """Crea un archivo sin contenido (ej: carpeta)."""
+        return await self._request('drive.files.create', 'POST', f"{DRIVE_URL}/files", params={'fields': fields}, body=body)
+
+    async def files_upload(self, body, data, mimetype, fields='id, name, webViewLink'):
+        """Crea un archivo con contenido en una sola llamada (uploadType=multipart)."""
+        boundary = f"bitacora{time.time_ns()}"
+        content = b"".join([
+            f"--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n".encode(),
+            json.dumps(body).encode(),
+            f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n\r\n".encode(),
+            data,
+            f"\r\n--{boundary}--".encode()
+        ])
+        return await self._request(
+            'drive.files.create', 'POST', f"{DRIVE_UPLOAD_URL}/files",
+            params={'uploadType': 'multipart', 'fields': fields}, content=content,
+            headers={'Content-Type': f"multipart/related; boundary={boundary}"})
+
+    async def files_copy(self, file_id, body, fields='id, name, webViewLink'):
+        return await self._request('drive.files.copy', 'POST', f"{DRIVE_URL}/files/{file_id}/copy",
+                                   params={'fields': fields}, body=body)
+
+    async def files_update(self, file_id, body, fields='id'):
+        """Cambia metadatos (nombre, trashed...), sin contenido."""
+        return await self._request('drive.files.update', 'PATCH', f"{DRIVE_URL}/files/{file_id}",
+                                   params={'fields': fields}, body=body)
+
+    # --- DOCS ---
+
+    async def documents_batch_update(self, document_id, requests):
+        """requests: lista de peticiones de documents.batchUpdate (replaceAllText, insertText...)."""
+        return await self._request('docs.documents.batchUpdate', 'POST', f"{DOCS_URL}/{document_id}:batchUpdate",
+                                   body={'requests': requests})
+
+    # --- SHEETS ---
+
+    def _values_url(self, spreadsheet_id, range_name, suffix=""):
+        return f"{SHEETS_URL}/{spreadsheet_id}/values/{quote(range_name, safe='')}{suffix}"
+
+    async def values_get(self, spreadsheet_id, range_name):
+        return await self._request('sheets.spreadsheets.values.get', 'GET', self._values_url(spreadsheet_id, range_name))
+
+    async def values_batch_get(self, spreadsheet_id, ranges):
+        return await self._request(
+            'sheets.spreadsheets.values.batchGet', 'GET', f"{SHEETS_URL}/{spreadsheet_id}/values:batchGet",
+            params=[('ranges', range_name) for range_name in ranges])
+
+    async def values_update(self, spreadsheet_id, range_name, values, value_input_option='RAW'):
+        return await self._request(
+            'sheets.spreadsheets.values.update', 'PUT', self._values_url(spreadsheet_id, range_name),
+            params={'valueInputOption': value_input_option}, body={'values': values})
+
+    async def values_append(self, spreadsheet_id, range_name, values, value_input_option='RAW', insert_data_option='INSERT_ROWS'):
+        return await self._request(
+            'sheets.spreadsheets.values.append', 'POST', self._values_url(spreadsheet_id, range_name, ':append'),
+            params={'valueInputOption': value_input_option, 'insertDataOption': insert_data_option}, body={'values': values})
+
+    async def values_batch_update(self, spreadsheet_id, data, value_input_option='RAW'):
+        """data: [{'range': A1, 'values': [[...]]}] como en values().batchUpdate."""
+        return await self._request(
+            'sheets.spreadsheets.values.batchUpdate', 'POST', f"{SHEETS_URL}/{spreadsheet_id}/values:batchUpdate",
+            body={'valueInputOption': value_input_option, 'data': data})
@@ -0,0 +1,108 @@
+"""
+Agrupa peticiones independientes a Google en una sola petición HTTP (batch).
+
+Cuando varios handlers (usuarios distintos en paralelo, o el cron procesando la cola
+acumulada) hacen a la vez búsquedas de carpetas, lecturas de celdas o búsquedas en el
+índice de filas, cada una es un viaje de ida y vuelta. Con RequestBatcher el primer hilo
+que llega espera GOOGLE_BATCH_WINDOW_MS; lo que otros hilos piden a la misma API en ese
+tiempo sale en el mismo batch y cada uno recibe su respuesta (o su excepción).
+
+Solo para peticiones que no dependen unas de otras. Con GOOGLE_BATCH_WINDOW_MS=0 cada
+petición se ejecuta sola, como antes.
+"""
+import os
+import time
+import threading
+
+from utils import metrics, tracing
+
+GOOGLE_BATCH_WINDOW_MS = float(os.getenv('GOOGLE_BATCH_WINDOW_MS', '15'))
+# Drive acepta hasta 100 peticiones por batch
+GOOGLE_BATCH_MAX_SIZE = 100
+
+GOOGLE_BATCH_SIZE = metrics.histogram(
+    'google_batch_size', 'Peticiones por batch HTTP enviado a Google por API', ('api',),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+
+
+class _Call:
+    def __init__(self, service, request):
+        self.service = service
+        self.request = request
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class RequestBatcher:
+    """
+    execute(service, request) bloquea hasta tener la respuesta, como request.execute().
+    Las peticiones se agrupan por API (drive, sheets): cada una tiene su endpoint de batch.
+    """
+
+    def __init__(self, window_ms=GOOGLE_BATCH_WINDOW_MS, max_size=GOOGLE_BATCH_MAX_SIZE):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # api -> lista de _Call que todavía no salieron
+        self._pending = {}
+
+    def execute(self, service, request):
+        if self.window <= 0:
+            return request.execute()
+
+        api = (getattr(request, 'methodId', None) or 'unknown').split('.')[0]
+        call = _Call(service, request)
+        with self._lock:
+            calls = self._pending.setdefault(api, [])
+            calls.append(call)
+            leader = len(calls) == 1
+            if len(calls) >= self.max_size:
+                # Lleno: lo envía quien lo completó, sin esperar la ventana
+                del self._pending[api]
+                leader, full = False, calls
+            else:
+                full = None
+
+        if full:
+            self._run(api, full)
+        elif leader:
+            time.sleep(self.window)
+            with self._lock:
+                # Si se llenó mientras tanto, ya lo envió otro hilo
+                batch = self._pending.pop(api) if self._pending.get(api) is calls else None
+            if batch:
+                self._run(api, batch)
+
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _run(self, api, calls):
+        GOOGLE_BATCH_SIZE.observe(len(calls), api=api)
+        try:
+            if len(calls) == 1:
+                calls[0].result = calls[0].request.execute()
+                return
+
+            def callback(request_id, response, exception):
+                call = calls[int(request_id)]
+                call.result, call.error = response, exception
+
+            batch = calls[0].service.new_batch_http_request(callback=callback)
+            for i, call in enumerate(calls):
+                batch.add(call.request, request_id=str(i))
+            with tracing.span(f'{api}.batch', size=len(calls)):
+                batch.execute()
+        except Exception as e:
+            # Falló el batch completo (red, auth): todos reciben el error
+            for call in calls:
+                if call.result is None and call.error is None:
+                    call.error = e
+        finally:
+            for call in calls:
+                call.done.set()
+
+
+batcher = RequestBatcher()
@@ -0,0 +1,161 @@
+"""
+Detección de cambios hechos a mano en el Sheet de la bitácora.
+
+El bot guarda copias de lo que hay en el Sheet: el catálogo de pestañas, el registro local
+de cada día (entradas de C, tiempos de G/H, carpeta) y el índice de filas. Si alguien edita
+la hoja, esas copias quedan viejas, pero releer A:H "por si acaso" anula el ahorro.
+
+ChangeWatcher pide a Drive solo la versión del archivo (files.get con version, modifiedTime
+y lastModifyingUser), como mucho cada SHEET_CHANGE_CHECK_SECONDS y sin bloquear a nadie
+si otro hilo ya está consultando. Cuando la versión cambió, sube epoch y avisa a los
+suscriptores, que invalidan solo lo que depende del Sheet (las carpetas de Drive o las
+fotos subidas no se tocan).
+
+Drive solo informa quién hizo la última modificación: si el personal edita y el bot escribe
+dentro de un mismo intervalo, la versión nueva aparece como del bot. Por eso ningún cambio
+de versión se da por propio. Los suscriptores reciben external:
+- external=True: la última modificación no es del bot, o es posterior a su última escritura
+  (con OWN_WRITE_SLACK_SECONDS de margen por relojes). Pudieron cambiar pestañas y filas,
+  así que se invalida todo (también external_epoch).
+- external=False: el bot escribió en el intervalo. Una edición a mano queda mezclada con sus
+  escrituras, así que cada día se vuelve a comparar con sus celdas antes de escribirlo.
+  Es una lectura pequeña por día activo y por intervalo, y no se vuelve a leer el catálogo
+  ni A:B completo.
+
+La última versión vista se guarda en bot_data.db, así también se detectan los cambios
+hechos con el bot apagado. Con SHEET_CHANGE_CHECK_SECONDS=0 no se consulta nada.
+"""
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+
+from utils import metrics
+from services import storage_service as storage
+
+SHEET_CHANGE_CHECK_SECONDS = float(os.getenv('SHEET_CHANGE_CHECK_SECONDS', '30'))
+# Diferencia tolerada entre el reloj local y el de Google al comparar modifiedTime
+OWN_WRITE_SLACK_SECONDS = 5
+# Cada cuánto se guarda en bot_data.db la hora de la última escritura propia (para los otros procesos)
+OWN_WRITE_PERSIST_SECONDS = 1
+
+SHEET_CHANGES = metrics.counter(
+    'sheet_changes_total', 'Cambios de versión del Sheet por origen (own = el bot escribió en el intervalo, puede incluir ediciones a mano)', ('source',))
+SHEET_CHANGE_CHECKS = metrics.counter(
+    'sheet_change_checks_total', 'Consultas de la versión del Sheet a Drive por resultado', ('status',))
+
+
+def _parse_time(value):
+    """RFC 3339 de Drive ('2026-10-19T15:04:05.123Z') -> timestamp."""
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class ChangeWatcher:
+    """
+    service_factory: retorna un servicio de Drive v3 (se usa solo al consultar).
+    execute: función que ejecuta la petición (drive_service._execute, para métricas y batching).
+    """
+
+    def __init__(self, file_id, service_factory, execute, interval=SHEET_CHANGE_CHECK_SECONDS):
+        self.file_id = file_id
+        self.service_factory = service_factory
+        self.execute = execute
+        self.interval = interval
+        # Sube con cada cambio de versión: lo verificado con un epoch anterior está viejo
+        self.epoch = 0
+        # Sube solo con los cambios que no pueden venir de una escritura del bot
+        self.external_epoch = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._version = None
+        self._own_write = 0.0
+        self._own_persisted = 0.0
+
+    def reset(self):
+        """Olvida la versión vista en este proceso (benchmarks, cambio de Spreadsheet)."""
+        with self._lock:
+            self.epoch = 0
+            self.external_epoch = 0
+            self._checked_at = None
+            self._version = None
+
+    @property
+    def _key(self):
+        return f"drive_version:{self.file_id}"
+
+    def subscribe(self, callback):
+        """callback(external) se llama en el hilo que detectó el cambio (ver el docstring del módulo)."""
+        self._listeners.append(callback)
+
+    def record_own_write(self):
+        """Llamar después de cada escritura del bot al archivo."""
+        now = time.time()
+        self._own_write = now
+        if now - self._own_persisted >= OWN_WRITE_PERSIST_SECONDS:
+            self._own_persisted = now
+            try:
+                storage.set_sync_state(f"{self._key}:own_write", str(now))
+            except Exception as e:
+                logging.warning(f"No se pudo guardar la última escritura al Sheet: {e}")
+
+    def check(self, force=False):
+        """
+        Consulta la versión si pasó el intervalo (o force). Retorna True si detectó un cambio.
+        Si otro hilo está consultando, retorna False enseguida.
+        """
+        if self.interval <= 0 and not force:
+            return False
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.interval:
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked_at = now
+            service = self.service_factory()
+            meta = self.execute(service.files().get(
+                fileId=self.file_id, fields='version, modifiedTime, lastModifyingUser(me)'), batch_service=service)
+            SHEET_CHANGE_CHECKS.inc(status='ok')
+            return self._observe(meta)
+        except Exception as e:
+            SHEET_CHANGE_CHECKS.inc(status='error')
+            logging.warning(f"No se pudo consultar la versión del Sheet: {e}")
+            return False
+        finally:
+            self._lock.release()
+
+    def _observe(self, meta):
+        version = str(meta.get('version'))
+        previous = self._version
+        if previous is None:
+            stored = storage.get_sync_state(self._key)
+            previous = json.loads(stored).get('version') if stored else None
+        if version == previous:
+            return False
+
+        self._version = version
+        storage.set_sync_state(self._key, json.dumps({'version': version, 'modified_time': meta.get('modifiedTime')}))
+        if previous is None:
+            # Primera vez: no hay nada copiado de una versión anterior que invalidar
+            return False
+
+        stored_own = storage.get_sync_state(f"{self._key}:own_write")
+        own_write = max(self._own_write, float(stored_own) if stored_own else 0.0)
+        by_bot = meta.get('lastModifyingUser', {}).get('me', False)
+        modified = _parse_time(meta['modifiedTime']) if meta.get('modifiedTime') else float('inf')
+        external = not (by_bot and modified <= own_write + OWN_WRITE_SLACK_SECONDS)
+
+        SHEET_CHANGES.inc(source='external' if external else 'own')
+        self.epoch += 1
+        if external:
+            self.external_epoch += 1
+            logging.info(f"El Sheet cambió fuera del bot (versión {previous} -> {version}), se invalidan las copias locales")
+        for callback in self._listeners:
+            try:
+                callback(external)
+            except Exception as e:
+                logging.error(f"Error invalidando caché tras un cambio en el Sheet: {e}")
+        return True
@@ -1,32 +1,19 @@
-import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
+"""
+Crea un documento vacío de Google Docs (prueba de acceso a la API de Docs).
+
+Usa las mismas credenciales que el bot (token.json, scope de Drive completo): con scopes
+propios, este script reescribía token.json y el bot perdía acceso a la hoja.
+Para los reportes de los estudiantes ver doc_report.py.
+
+Uso:
+    python -m services.google.create_doc
+"""
 from googleapiclient.discovery import build
 
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive.file']
+from services.google.drive_service import get_credentials
 
 def main():
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    service = build('docs', 'v1', credentials=creds)
+    service = build('docs', 'v1', credentials=get_credentials())
 
     title = 'Mi Nuevo Documento'
     body = {
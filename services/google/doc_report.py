@@ -0,0 +1,263 @@
+"""
+Reportes de la bitácora en Google Docs (semana, mes o semestre), uno por estudiante.
+
+Cada reporte es una copia de la plantilla (un files.copy) llenada con un solo
+documents.batchUpdate de replaceAllText, en lugar de insertar el texto párrafo por párrafo.
+La plantilla se busca una vez por ejecución: DOC_TEMPLATE_ID, o el documento
+DOC_TEMPLATE_NAME en la carpeta principal (si no existe se crea). Su formato se puede
+editar en Drive mientras conserve los marcadores ({{ESTUDIANTE}}, {{DETALLE}}...).
+
+Las filas de toda la cohorte se leen con una sola llamada a Sheets y los reportes se
+generan con DOC_REPORT_WORKERS a la vez sobre el cliente asyncio. El reporte queda en la
+carpeta del estudiante; si ya hay uno del mismo período se deja, salvo con --replace.
+
+Uso:
+    python -m services.google.doc_report --period week
+    python -m services.google.doc_report --period semester --date 15-03-2026 --user 123456
+    python -m services.google.doc_report --period month --dry-run
+"""
+import os
+import sys
+import asyncio
+import logging
+import argparse
+import datetime
+
+from utils import tracing
+from services.google import drive_service
+from services.google.drive_service import ECUADOR_TZ, PARENT_FOLDER_ID
+
+DOC_TEMPLATE_ID = os.getenv('DOC_TEMPLATE_ID')
+DOC_TEMPLATE_NAME = "Plantilla reporte bitácora"
+# Reportes que se generan a la vez (cada uno: carpeta, copia y batchUpdate)
+DOC_REPORT_WORKERS = int(os.getenv('DOC_REPORT_WORKERS', '8'))
+
+PERIODS = ('week', 'month', 'semester')
+DOC_MIMETYPE = 'application/vnd.google-apps.document'
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+MONTHS = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+          "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
+
+# Contenido de la plantilla que se crea si no hay una: (texto, estilo del párrafo)
+TEMPLATE_PARAGRAPHS = [
+    ("Reporte de bitácora", 'TITLE'),
+    ("Estudiante: {{ESTUDIANTE}}", None),
+    ("Período: {{PERIODO}}", None),
+    ("Días registrados: {{DIAS}}", None),
+    ("Horas registradas: {{HORAS}}", None),
+    ("Detalle por día", 'HEADING_2'),
+    ("{{DETALLE}}", None),
+    ("Generado el {{GENERADO}}", None),
+]
+
+NO_SUMMARY = "Sin descripción registrada."
+
+# Id de la plantilla encontrada o creada en esta ejecución
+_template_id = DOC_TEMPLATE_ID
+
+
+def period_range(period, ref_date):
+    """(inicio, fin, nombre) del período que contiene ref_date."""
+    if period == 'week':
+        start = ref_date - datetime.timedelta(days=ref_date.weekday())
+        end = start + datetime.timedelta(days=6)
+        return start, end, f"Semana del {start:%d-%m-%Y} al {end:%d-%m-%Y}"
+    if period == 'month':
+        start = ref_date.replace(day=1)
+        next_month = (start + datetime.timedelta(days=32)).replace(day=1)
+        return start, next_month - datetime.timedelta(days=1), f"{MONTHS[start.month - 1].capitalize()} {start.year}"
+    if period == 'semester':
+        if ref_date.month <= 6:
+            return datetime.date(ref_date.year, 1, 1), datetime.date(ref_date.year, 6, 30), f"Semestre 1 {ref_date.year} (enero a junio)"
+        return datetime.date(ref_date.year, 7, 1), datetime.date(ref_date.year, 12, 31), f"Semestre 2 {ref_date.year} (julio a diciembre)"
+    raise ValueError(f"Período desconocido: {period}")
+
+
+def _cell(row, index):
+    return row[index].strip() if len(row) > index and isinstance(row[index], str) else ""
+
+
+def _parse_clock(value):
+    """'4:30:00' o '4:30' -> horas. None si no es una hora."""
+    parts = value.split(":")
+    if len(parts) not in (2, 3) or not all(part.isdigit() for part in parts):
+        return None
+    hours, minutes, seconds = (int(part) for part in parts + ["0"] * (3 - len(parts)))
+    return hours + minutes / 60 + seconds / 3600
+
+
+def _row_hours(row):
+    """Horas del día: la columna Duración o, si no se puede leer, Fin - Inicio."""
+    hours = _parse_clock(_cell(row, 4))
+    if hours is None:
+        start, end = _parse_clock(_cell(row, 6)), _parse_clock(_cell(row, 7))
+        if start is not None and end is not None and end >= start:
+            hours = end - start
+    return hours or 0.0
+
+
+def _format_hours(hours):
+    total_minutes = round(hours * 60)
+    return f"{total_minutes // 60}:{total_minutes % 60:02d} h"
+
+
+def report_values(user_id, rows, label):
+    """Texto de cada marcador de la plantilla para el reporte de un estudiante."""
+    rows = sorted(rows, key=lambda row: datetime.datetime.strptime(row[1], "%d-%m-%Y"))
+    blocks = []
+    total = 0.0
+    for row in rows:
+        hours = _row_hours(row)
+        total += hours
+        # Columna F (resumen de /send) o, si no se generó, la descripción del día
+        lines = [f"{row[1]} — {_format_hours(hours)}", _cell(row, 5) or _cell(row, 2) or NO_SUMMARY]
+        if _cell(row, 3):
+            lines.append(f"Fotos: {_cell(row, 3)}")
+        blocks.append("\n".join(lines))
+    return {
+        'ESTUDIANTE': str(user_id),
+        'PERIODO': label,
+        'DIAS': str(len(rows)),
+        'HORAS': _format_hours(total),
+        'DETALLE': "\n\n".join(blocks) or "Sin registros en el período.",
+        'GENERADO': datetime.datetime.now(ECUADOR_TZ).strftime("%d-%m-%Y %H:%M"),
+    }
+
+
+def _replace_requests(values):
+    return [{'replaceAllText': {'containsText': {'text': f"{{{{{key}}}}}", 'matchCase': True}, 'replaceText': text}}
+            for key, text in values.items()]
+
+
+def _doc_length(text):
+    # Los índices de Docs cuentan unidades UTF-16
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _template_requests():
+    """insertText de todo el contenido más el estilo de los títulos, en un solo batchUpdate."""
+    requests = [{'insertText': {'location': {'index': 1},
+                                'text': "\n".join(text for text, _ in TEMPLATE_PARAGRAPHS)}}]
+    index = 1
+    for text, style in TEMPLATE_PARAGRAPHS:
+        end = index + _doc_length(text) + 1
+        if style:
+            requests.append({'updateParagraphStyle': {
+                'range': {'startIndex': index, 'endIndex': end},
+                'paragraphStyle': {'namedStyleType': style},
+                'fields': 'namedStyleType'}})
+        index = end
+    return requests
+
+
+async def _get_template(client):
+    """Id de la plantilla: DOC_TEMPLATE_ID, la que está en la carpeta principal o una nueva."""
+    global _template_id
+    if _template_id:
+        return _template_id
+
+    query = f"name='{DOC_TEMPLATE_NAME}' and mimeType='{DOC_MIMETYPE}' and '{PARENT_FOLDER_ID}' in parents and trashed=false"
+    items = (await client.files_list(query)).get('files', [])
+    if items:
+        _template_id = items[0]['id']
+    else:
+        template = await client.files_create(
+            {'name': DOC_TEMPLATE_NAME, 'mimeType': DOC_MIMETYPE, 'parents': [PARENT_FOLDER_ID]})
+        await client.documents_batch_update(template['id'], _template_requests())
+        _template_id = template['id']
+        logging.info(f"Plantilla de reportes creada: {_template_id}")
+    return _template_id
+
+
+async def _user_folder(client, user_id):
+    """Carpeta del estudiante (la misma de sus fotos), como get_or_create_folder."""
+    query = f"mimeType='{FOLDER_MIMETYPE}' and name='{user_id}' and '{PARENT_FOLDER_ID}' in parents and trashed=false"
+    items = (await client.files_list(query)).get('files', [])
+    if items:
+        return items[0]['id']
+    folder = await client.files_create({'name': str(user_id), 'mimeType': FOLDER_MIMETYPE, 'parents': [PARENT_FOLDER_ID]})
+    return folder['id']
+
+
+async def _generate(reports, workers, replace):
+    """reports = [(user_id, nombre del documento, valores)]. Retorna [(user_id, estado, enlace o error)]."""
+    from services.google.async_client import AsyncGoogleClient
+
+    semaphore = asyncio.Semaphore(workers)
+    async with AsyncGoogleClient(max_connections=workers) as client:
+        template_id = await _get_template(client)
+
+        async def generate(user_id, name, values):
+            async with semaphore:
+                try:
+                    with tracing.span('doc_report.generate', user_id=user_id):
+                        folder_id = await _user_folder(client, user_id)
+                        query = f"name='{name}' and mimeType='{DOC_MIMETYPE}' and '{folder_id}' in parents and trashed=false"
+                        existing = (await client.files_list(query, fields='files(id, name, webViewLink)')).get('files', [])
+                        if existing and not replace:
+                            return user_id, 'existente', existing[0].get('webViewLink')
+
+                        doc = await client.files_copy(template_id, {'name': name, 'parents': [folder_id]})
+                        await client.documents_batch_update(doc['id'], _replace_requests(values))
+                        # El anterior se borra recién cuando el nuevo está completo
+                        for old in existing:
+                            await client.files_update(old['id'], {'trashed': True})
+                        return user_id, 'reemplazado' if existing else 'creado', doc.get('webViewLink')
+                except Exception as e:
+                    logging.error(f"Error generando el reporte de {user_id}: {str(e)}")
+                    return user_id, 'error', str(e)
+
+        return await asyncio.gather(*(generate(*report) for report in reports))
+
+
+@tracing.traced('doc_report.generate_reports')
+def generate_reports(period, ref_date=None, user_id=None, workers=DOC_REPORT_WORKERS, replace=False, dry_run=False):
+    """
+    Genera el reporte del período para cada estudiante con registros (o solo para user_id).
+    Con dry_run no escribe nada en Drive: los resultados llevan el resumen en lugar del enlace.
+    No llamar desde un event loop en marcha. Retorna [(user_id, estado, enlace o detalle)].
+    """
+    ref_date = ref_date or datetime.datetime.now(ECUADOR_TZ).date()
+    start, end, label = period_range(period, ref_date)
+
+    rows_by_user = {}
+    for row in drive_service.get_history_rows(start, end, user_id):
+        rows_by_user.setdefault(row[0], []).append(row)
+
+    reports = [(uid, f"Reporte bitácora {uid} - {label}", report_values(uid, rows, label))
+               for uid, rows in sorted(rows_by_user.items())]
+    if dry_run or not reports:
+        return [(uid, 'dry-run', f"{values['DIAS']} días, {values['HORAS']}") for uid, _, values in reports]
+    return asyncio.run(_generate(reports, max(1, workers), replace))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera los reportes de la bitácora en Google Docs")
+    parser.add_argument('--period', choices=PERIODS, default='week')
+    parser.add_argument('--date', help="Fecha dentro del período (DD-MM-YYYY), por defecto hoy")
+    parser.add_argument('--user', help="Solo este estudiante (user_id de Telegram)")
+    parser.add_argument('--workers', type=int, default=DOC_REPORT_WORKERS, help="Reportes a la vez")
+    parser.add_argument('--replace', action='store_true', help="Rehacer los reportes que ya existen")
+    parser.add_argument('--dry-run', action='store_true', help="Solo mostrar días y horas de cada estudiante")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ref_date = None
+    if args.date:
+        try:
+            ref_date = datetime.datetime.strptime(args.date, "%d-%m-%Y").date()
+        except ValueError:
+            print(f"Error: fecha inválida {args.date} (formato DD-MM-YYYY)")
+            return 1
+
+    results = generate_reports(args.period, ref_date, args.user, workers=args.workers,
+                               replace=args.replace, dry_run=args.dry_run)
+    for uid, status, detail in results:
+        print(f"{uid}: {status} {detail}")
+    errors = sum(1 for _, status, _ in results if status == 'error')
+    print(f"Total: {len(results)} reportes" + (f", {errors} con error" if errors else ""))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,24 @@
 import os
-import io
+import re
+import time
+import asyncio
+import hashlib
 import datetime
+import threading
 import logging
 from zoneinfo import ZoneInfo
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
 import pandas as pd
 import tempfile
+from utils import cache, metrics, tracing
+from services import storage_service as storage
+from services.google import sheet_layout as layout
+from services.google import batching, change_watch
 
 # Scopes actualizados para Drive y Sheets
 SCOPES = [
@@ -20,8 +29,33 @@ PARENT_FOLDER_ID = '1sWn78Jmx0QSeOtTgdcyOonovk0jd3kgO'
 SPREADSHEET_ID = '1rXGnD3XQp-ecmdxxgJGf-K-SbxLWYawKXFOqkbl_Dmw'
 ECUADOR_TZ = ZoneInfo("America/Guayaquil")
 
+GOOGLE_API_LATENCY = metrics.histogram(
+    'google_api_request_duration_seconds', 'Latencia de llamadas a Google APIs por endpoint', ('endpoint',))
+GOOGLE_API_REQUESTS = metrics.counter(
+    'google_api_requests_total', 'Llamadas a Google APIs por endpoint y resultado', ('endpoint', 'status'))
+DRIVE_UPLOAD_BYTES = metrics.counter(
+    'drive_upload_bytes_total', 'Bytes subidos a Google Drive')
+
+# Segundos que se recuerda el id de una carpeta (si se borra a mano en Drive, se nota después de esto)
+FOLDER_CACHE_SECONDS = float(os.getenv('FOLDER_CACHE_SECONDS', '600'))
+
+# Credenciales leídas de token.json: se reutilizan mientras el token sea válido
+_credentials_cache = cache.memory('google_credentials', max_entries=1)
+# Carpetas por "padre/nombre" (las del usuario y las del día), en bot_data.db: la comparten
+# los procesos de trabajo y sobrevive a los reinicios de cron_bot
+_folder_cache = cache.sqlite('drive_folders', ttl=FOLDER_CACHE_SECONDS, max_entries=5000)
+# Columna F (resumen de /send) por "user_id:DD-MM-YYYY"
+_ai_response_cache = cache.memory('sheet_ai_responses', ttl=24 * 3600, max_entries=5000)
+
 def get_credentials():
-    """Obtiene las credenciales de usuario válidas."""
+    """Obtiene las credenciales de usuario válidas (una sola lectura de token.json mientras sigan vigentes)."""
+    creds = _credentials_cache.get_or_load('token', _load_credentials)
+    if not creds.valid:
+        _credentials_cache.invalidate('token')
+        creds = _credentials_cache.get_or_load('token', _load_credentials)
+    return creds
+
+def _load_credentials():
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -49,12 +83,86 @@ def get_sheets_service():
     creds = get_credentials()
     return build('sheets', 'v4', credentials=creds)
 
+def _execute(request, batch_service=None):
+    """
+    Ejecuta una petición de la API de Google registrando latencia y resultado por endpoint.
+    Con batch_service (el servicio que creó la petición) puede salir en un mismo batch HTTP
+    con las de otros hilos (ver batching.py): solo para lecturas y creaciones independientes.
+    """
+    # methodId viene del discovery document, ej: 'drive.files.list', 'sheets.spreadsheets.values.get'
+    endpoint = getattr(request, 'methodId', None) or 'unknown'
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        with tracing.span(endpoint):
+            if batch_service is not None:
+                result = batching.batcher.execute(batch_service, request)
+            else:
+                result = request.execute()
+        if endpoint.startswith('sheets.') and endpoint not in SHEET_READ_ENDPOINTS:
+            sheet_changes.record_own_write()
+        return result
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        GOOGLE_API_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+        GOOGLE_API_REQUESTS.inc(endpoint=endpoint, status=status)
+
+# Llamadas a Sheets que no modifican el archivo (las demás cuentan como escrituras del bot)
+SHEET_READ_ENDPOINTS = {
+    'sheets.spreadsheets.get', 'sheets.spreadsheets.values.get',
+    'sheets.spreadsheets.values.batchGet', 'sheets.spreadsheets.developerMetadata.search'
+}
+
+# Versión del Sheet en Drive, para notar ediciones a mano (ver change_watch.py).
+# lambda: get_drive_service se resuelve en cada consulta (los benchmarks la reemplazan)
+sheet_changes = change_watch.ChangeWatcher(SPREADSHEET_ID, lambda: get_drive_service(), _execute)
+
+# Días "user_id:DD-MM-YYYY" cuyo registro local se comparó con sus celdas del Sheet
+# después del último cambio de versión
+_fresh_days = cache.memory('sheet_fresh_days', max_entries=20000)
+# Días buscados en A:B (filas agregadas a mano sin índice) después del último cambio externo
+_fresh_rows = cache.memory('sheet_fresh_rows', max_entries=20000)
+# Filas del índice "user_id:DD-MM-YYYY:fila" cuyo A:B se comprobó en este proceso después
+# del último cambio de versión (o que el bot acaba de escribir e indexar)
+_verified_rows = cache.memory('sheet_verified_rows', max_entries=20000)
+
+def _on_sheet_changed(external):
+    """
+    Cualquier cambio de versión puede esconder una edición a mano (ver change_watch.py): las celdas
+    de cada día y la fila indexada se vuelven a comparar. Si es externo pudieron moverse pestañas o
+    agregarse filas sin índice: también se relee el catálogo y se busca en A:B.
+    """
+    _fresh_days.clear()
+    _verified_rows.clear()
+    _ai_response_cache.clear()
+    if external:
+        layout.catalog.reset()
+        _fresh_rows.clear()
+
+sheet_changes.subscribe(_on_sheet_changed)
+
+def _sheet_changed_since(verified, key, external_only=False):
+    """True si hubo un cambio (externo, con external_only) y key todavía no se verificó después."""
+    epoch = sheet_changes.external_epoch if external_only else sheet_changes.epoch
+    return epoch > 0 and key not in verified
+
 # --- DRIVE FUNCTIONS ---
 
+@tracing.traced('drive_service.get_or_create_folder')
 def get_or_create_folder(service, folder_name, parent_id):
-    """Busca una carpeta por nombre dentro de un padre, si no existe la crea."""
+    """
+    Busca una carpeta por nombre dentro de un padre, si no existe la crea.
+    El resultado queda en caché: los hilos que piden la misma carpeta a la vez esperan
+    una sola búsqueda (y no crean dos carpetas iguales).
+    """
+    return _folder_cache.get_or_load(
+        f"{parent_id}/{folder_name}", lambda: _find_or_create_folder(service, folder_name, parent_id))
+
+def _find_or_create_folder(service, folder_name, parent_id):
     query = f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and '{parent_id}' in parents and trashed=false"
-    results = service.files().list(q=query, spaces='drive', fields='files(id, name, webViewLink)').execute()
+    results = _execute(service.files().list(q=query, spaces='drive', fields='files(id, name, webViewLink)'), batch_service=service)
     items = results.get('files', [])
 
     if not items:
@@ -64,13 +172,14 @@ def get_or_create_folder(service, folder_name, parent_id):
             'mimeType': 'application/vnd.google-apps.folder',
             'parents': [parent_id]
         }
-        folder = service.files().create(body=file_metadata, fields='id, name, webViewLink').execute()
+        folder = _execute(service.files().create(body=file_metadata, fields='id, name, webViewLink'), batch_service=service)
         logging.info(f"Carpeta creada: {folder_name} ({folder.get('id')})")
         return folder
     else:
         # Retornar la primera encontrada
         return items[0]
 
+@tracing.traced('drive_service.get_unique_filename')
 def get_unique_filename(service, filename, parent_id):
     """Verifica si el archivo existe y retorna un nombre único si es necesario."""
     name, ext = os.path.splitext(filename)
@@ -79,7 +188,7 @@ def get_unique_filename(service, filename, parent_id):
     
     while True:
         query = f"name='{new_filename}' and '{parent_id}' in parents and trashed=false"
-        results = service.files().list(q=query, spaces='drive', fields='files(id)').execute()
+        results = _execute(service.files().list(q=query, spaces='drive', fields='files(id)'), batch_service=service)
         items = results.get('files', [])
         
         if not items:
@@ -88,11 +197,54 @@ def get_unique_filename(service, filename, parent_id):
         new_filename = f"{name} ({counter}){ext}"
         counter += 1
 
-def upload_image_from_stream(file_stream, filename, user_id, description=None):
-    """Sube una imagen desde un stream de bytes a Google Drive y retorna la carpeta del día."""
+@tracing.traced('drive_service.find_uploaded_photo')
+def find_uploaded_photo(user_id, file_unique_id=None, content_hash=None, service=None):
+    """
+    Busca la foto entre las ya subidas hoy a la carpeta del día del usuario, por file_unique_id
+    de Telegram (antes de descargarla) o por hash del contenido.
+    Retorna (file, daily_folder) como upload_image_from_stream, con file['duplicate'] = True, o None.
+    Comprueba con un files.get que el archivo siga en Drive (el estudiante pudo borrarlo).
+    """
+    today_str = datetime.datetime.now(ECUADOR_TZ).strftime("%d-%m-%Y")
+    record = storage.find_photo_upload(user_id, today_str, file_unique_id, content_hash)
+    if not record:
+        return None
+
+    service = service or get_drive_service()
+    try:
+        found = _execute(service.files().get(fileId=record['file_id'], fields='id, trashed'), batch_service=service)
+        exists = not found.get('trashed')
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        exists = False
+    if not exists:
+        storage.delete_photo_uploads(user_id, today_str, record['file_id'])
+        return None
+
+    file = {'id': record['file_id'], 'name': record['file_name'], 'webViewLink': record['file_link'],
+            'description': record['description'], 'duplicate': True}
+    daily_folder = {'id': record['folder_id'], 'webViewLink': record['folder_link']}
+    # Misma imagen con otro file_unique_id: la próxima vez se reconoce sin descargarla
+    if file_unique_id and record['file_unique_id'] != file_unique_id:
+        storage.save_photo_upload(user_id, today_str, file_unique_id, content_hash, file, daily_folder, record['description'])
+    logging.info(f"Foto repetida de {user_id}, ya estaba en Drive: {record['file_name']}")
+    return file, daily_folder
+
+@tracing.traced('drive_service.upload_image_from_stream')
+def upload_image_from_stream(file_stream, filename, user_id, description=None, file_unique_id=None):
+    """
+    Sube una imagen desde un stream de bytes a Google Drive y retorna la carpeta del día.
+    Si la misma imagen (mismo contenido) ya está en la carpeta del día, no la sube otra vez.
+    """
     try:
         service = get_drive_service()
 
+        content_hash = hashlib.sha256(file_stream.getbuffer()).hexdigest()
+        duplicate = find_uploaded_photo(user_id, file_unique_id, content_hash, service=service)
+        if duplicate:
+            return duplicate
+
         # 1. Obtener/Crear carpeta del Usuario (ID de Telegram)
         # Nota: user_id debe ser string
         user_folder = get_or_create_folder(service, str(user_id), PARENT_FOLDER_ID)
@@ -106,106 +258,396 @@ def upload_image_from_stream(file_stream, filename, user_id, description=None):
         # 3. Generar nombre de archivo único
         unique_filename = get_unique_filename(service, filename, daily_folder_id)
         
-        # 4. Preparar metadata y subida
-        file_metadata = {
-            'name': unique_filename,
-            'parents': [daily_folder_id]
-        }
-        
-        if description:
-            file_metadata['description'] = description
-            
-        media = MediaIoBaseUpload(file_stream, mimetype='image/jpeg', resumable=True)
-        
-        # 4. Ejecutar subida
-        file = service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, name, webViewLink'
-        ).execute()
-        
-        logging.info(f"Archivo subido: {file.get('name')} ID: {file.get('id')}")
+        # 4. Subir
+        file = _upload_to_folder(service, file_stream, unique_filename, daily_folder_id, description)
+        storage.save_photo_upload(user_id, today_str, file_unique_id, content_hash, file, daily_folder, description)
         return file, daily_folder
         
     except Exception as e:
         logging.error(f"Error subiendo a Drive: {str(e)}")
         raise e
 
+def _upload_to_folder(service, file_stream, filename, folder_id, description=None):
+    """Sube la imagen con ese nombre (ya único) a la carpeta. Retorna el archivo creado."""
+    file_metadata = {
+        'name': filename,
+        'parents': [folder_id]
+    }
+    
+    if description:
+        file_metadata['description'] = description
+        
+    media = MediaIoBaseUpload(file_stream, mimetype='image/jpeg', resumable=True)
+    
+    with tracing.span('drive_service.upload'):
+        file = _execute(service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id, name, webViewLink'
+        ))
+    
+    DRIVE_UPLOAD_BYTES.inc(file_stream.getbuffer().nbytes if hasattr(file_stream, 'getbuffer') else 0)
+    logging.info(f"Archivo subido: {file.get('name')} ID: {file.get('id')}")
+    return file
+
 # --- SHEETS FUNCTIONS ---
 
+# Evita que varios hilos carguen el catálogo o creen la misma pestaña a la vez
+_catalog_lock = threading.Lock()
+
+def _load_catalog(service):
+    """Carga las pestañas del Spreadsheet (título, sheetId y si tienen índice) con una llamada."""
+    result = _execute(service.spreadsheets().get(
+        spreadsheetId=SPREADSHEET_ID,
+        fields='sheets(properties(title,sheetId),developerMetadata(metadataKey))'))
+    layout.catalog.load(
+        (sheet['properties']['title'], sheet['properties']['sheetId'],
+         any(m.get('metadataKey') == layout.INDEXED_SHEET_KEY for m in sheet.get('developerMetadata', [])))
+        for sheet in result.get('sheets', []))
+
+def _shard_exists(service, tab):
+    """True si la pestaña existe (None es la hoja de siempre)."""
+    if layout.catalog.needs_refresh(tab):
+        with _catalog_lock:
+            # Otro hilo pudo haberlo cargado mientras esperábamos
+            if layout.catalog.needs_refresh(tab):
+                _load_catalog(service)
+    return tab in layout.catalog
+
+def _ensure_shards(service, tabs):
+    """Crea en una sola llamada las pestañas que falten, con su fila de encabezado."""
+    if all(_shard_exists(service, tab) for tab in tabs):
+        return
+    with _catalog_lock:
+        missing = sorted({tab for tab in tabs if tab is not None and tab not in layout.catalog})
+        if missing:
+            _create_shards(service, missing)
+
+def _create_shards(service, missing, indexed=True):
+    """
+    Crea las pestañas con un solo batchUpdate. Con indexed=True nacen marcadas como indexadas
+    (todas las filas que se agreguen tendrán índice), así que no se buscan nunca en A:B.
+    """
+    sheet_ids = {tab: layout.new_sheet_id(tab) for tab in missing}
+    requests = [{'addSheet': {'properties': {'title': tab, 'sheetId': sheet_ids[tab]}}} for tab in missing]
+    if indexed:
+        requests += [_indexed_sheet_request(sheet_ids[tab]) for tab in missing]
+    try:
+        _execute(service.spreadsheets().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID, body={'requests': requests}))
+    except Exception:
+        # Otro proceso pudo haberlas creado entre la lectura del catálogo y el addSheet
+        _load_catalog(service)
+        if any(tab not in layout.catalog for tab in missing):
+            raise
+        return
+    for tab in missing:
+        layout.catalog.add(tab, sheet_ids[tab], indexed)
+    _batch_write(service, [{'range': layout.a1(tab, "A1:H1"), 'values': [layout.HEADER_ROW]} for tab in missing])
+    logging.info(f"Pestañas creadas en el Sheet: {', '.join(missing)}")
+
+@tracing.traced('drive_service.find_user_row_by_date')
 def find_user_row_by_date(service, spreadsheet_id, user_id, date_obj):
-    """Busca la fila correspondiente al usuario y la fecha dada. Retorna el índice (1-based) o None."""
+    """
+    Busca la fila correspondiente al usuario y la fecha dada, en la pestaña que le toca
+    según SHEET_LAYOUT. Retorna el índice (1-based) dentro de esa pestaña o None.
+    """
     target_date_str = date_obj.strftime("%d-%m-%Y")
     str_user_id = str(user_id)
+
+    # Como mucho una consulta de versión cada SHEET_CHANGE_CHECK_SECONDS
+    sheet_changes.check()
+    tab = layout.shard_for(user_id, date_obj)
+    if not _shard_exists(service, tab):
+        return None
+
+    # Primero el índice (developer metadata): una búsqueda pequeña en lugar de leer A:B
+    row_idx, metadata_ids = _find_indexed_row(service, tab, str_user_id, target_date_str)
+    key = f"{str_user_id}:{target_date_str}"
+    stale_index = bool(row_idx) and not _indexed_row_matches(service, tab, str_user_id, target_date_str, row_idx, metadata_ids)
+    if stale_index:
+        row_idx = None
+    # Tras una edición a mano puede haber filas agregadas sin índice: se busca en A:B una vez por día
+    if row_idx or (layout.catalog.is_indexed(tab) and not stale_index and not _sheet_changed_since(_fresh_rows, key, external_only=True)):
+        return row_idx
     
-    # Leer Columnas A (User) y B (Fecha)
-    result = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id, range="A:B").execute()
+    # Pestaña con filas sin indexar (anteriores al índice): leer Columnas A (User) y B (Fecha)
+    result = _execute(service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id, range=layout.a1(tab, "A:B")))
     values = result.get('values', [])
+    _fresh_rows.add(key)
     
     for i, row in enumerate(values):
         # Asegurarse que la fila tenga al menos 2 columnas
         if len(row) >= 2 and row[0] == str_user_id and row[1] == target_date_str:
+            # Indexarla para que la próxima búsqueda no tenga que leer A:B
+            try:
+                _index_rows(service, tab, [(str_user_id, target_date_str, i + 1)])
+            except Exception as e:
+                logging.warning(f"No se pudo indexar la fila {i + 1}: {str(e)}")
             return i + 1  # 1-based index
             
     return None
 
+# --- ÍNDICE DE FILAS (developer metadata) ---
+
+def _indexed_sheet_request(sheet_id):
+    return {'createDeveloperMetadata': {'developerMetadata': {
+        'metadataKey': layout.INDEXED_SHEET_KEY, 'metadataValue': '1',
+        'location': {'sheetId': sheet_id}, 'visibility': 'DOCUMENT'}}}
+
+def _row_index_request(sheet_id, user_id, date_str, row_idx):
+    # La metadata va en la fila: si se insertan o borran filas arriba, se mueve con ella
+    return {'createDeveloperMetadata': {'developerMetadata': {
+        'metadataKey': layout.ROW_INDEX_KEY,
+        'metadataValue': layout.row_index_value(user_id, date_str),
+        'location': {'dimensionRange': {
+            'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': row_idx - 1, 'endIndex': row_idx}},
+        'visibility': 'DOCUMENT'}}}
+
+def _find_indexed_row(service, tab, user_id, date_str):
+    """
+    Busca la fila de (usuario, fecha) por su developer metadata.
+    Retorna (índice 1-based o None, metadataId de las entradas de esa pestaña).
+    """
+    body = {'dataFilters': [{'developerMetadataLookup': {
+        'metadataKey': layout.ROW_INDEX_KEY,
+        'metadataValue': layout.row_index_value(user_id, date_str)}}]}
+    result = _execute(service.spreadsheets().developerMetadata().search(
+        spreadsheetId=SPREADSHEET_ID, body=body), batch_service=service)
+
+    sheet_id = layout.catalog.sheet_id(tab)
+    row_idx, metadata_ids = None, []
+    for match in result.get('matchedDeveloperMetadata', []):
+        metadata = match['developerMetadata']
+        dimension_range = metadata.get('location', {}).get('dimensionRange', {})
+        if dimension_range.get('sheetId', 0) == sheet_id:
+            if row_idx is None:
+                row_idx = dimension_range.get('startIndex', 0) + 1
+            metadata_ids.append(metadata.get('metadataId'))
+    return row_idx, metadata_ids
+
+def _indexed_row_matches(service, tab, user_id, date_str, row_idx, metadata_ids):
+    """
+    Confirma que A:B de la fila indexada siga siendo (usuario, fecha). Si alguien cortó y pegó
+    o sobrescribió A/B a mano, la metadata puede haber quedado en la fila de otro estudiante.
+    Se lee una vez por proceso y por cambio externo. Si no coincide, borra esa metadata
+    (la búsqueda en A:B vuelve a indexar la fila correcta) y retorna False.
+    """
+    verified_key = f"{user_id}:{date_str}:{row_idx}"
+    if verified_key in _verified_rows:
+        return True
+    result = _execute(service.spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID, range=layout.a1(tab, f"A{row_idx}:B{row_idx}")), batch_service=service)
+    values = result.get('values', [])
+    found = (values[0] if values else [])[:2]
+    if found == [user_id, date_str]:
+        _verified_rows.add(verified_key)
+        return True
+
+    logging.warning(f"La fila {row_idx} de '{tab}' está indexada como {user_id} {date_str} pero tiene {found}: se busca en A:B")
+    requests = [{'deleteDeveloperMetadata': {'dataFilter': {'developerMetadataLookup': {'metadataId': metadata_id}}}}
+                for metadata_id in metadata_ids if metadata_id is not None]
+    if requests:
+        try:
+            _execute(service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body={'requests': requests}))
+        except Exception as e:
+            logging.warning(f"No se pudo borrar el índice viejo de {user_id} {date_str}: {str(e)}")
+    return False
+
+def _index_rows(service, tab, rows, mark_indexed=False, chunk_size=500):
+    """
+    Agrega al índice las filas [(user_id, DD-MM-YYYY, fila 1-based)] de la pestaña,
+    en batchUpdates de hasta chunk_size. mark_indexed marca la pestaña como indexada al final.
+    """
+    sheet_id = layout.catalog.sheet_id(tab)
+    requests = [_row_index_request(sheet_id, user_id, date_str, row_idx) for user_id, date_str, row_idx in rows]
+    if mark_indexed:
+        requests.append(_indexed_sheet_request(sheet_id))
+    for start in range(0, len(requests), chunk_size):
+        _execute(service.spreadsheets().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID, body={'requests': requests[start:start + chunk_size]}))
+    # A:B de estas filas se acaba de escribir o leer: no hace falta comprobarlas al encontrarlas
+    for user_id, date_str, row_idx in rows:
+        _verified_rows.add(f"{user_id}:{date_str}:{row_idx}")
+    if mark_indexed:
+        layout.catalog.set_indexed(tab)
+
+def _updated_row(append_result):
+    """Fila (1-based) escrita por values.append, a partir de updates.updatedRange (ej: "'Hoja 1'!A12:H12")."""
+    updated_range = append_result.get('updates', {}).get('updatedRange', '')
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
+
+@tracing.traced('drive_service.build_row_index')
+def build_row_index():
+    """
+    Indexa las filas existentes de las pestañas del layout actual que todavía no tienen índice
+    (la hoja de siempre en modo 'single') y las marca como indexadas.
+    Retorna {pestaña: filas indexadas}.
+    """
+    service = get_sheets_service()
+    _load_catalog(service)
+    if layout.is_sharded():
+        tabs = [tab for tab in layout.catalog.tabs() if layout.is_shard_name(tab)]
+    else:
+        tabs = layout.catalog.tabs()[:1]
+
+    summary = {}
+    for tab in tabs:
+        if layout.catalog.is_indexed(tab):
+            continue
+        result = _execute(service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range=layout.a1(tab, "A:B")))
+        rows = [(row[0], row[1], i + 1) for i, row in enumerate(result.get('values', []))
+                if len(row) >= 2 and row[0] and row[0] != layout.HEADER_ROW[0]]
+
+        # No duplicar las filas que ya se indexaron al buscarlas
+        body = {'dataFilters': [{'developerMetadataLookup': {'metadataKey': layout.ROW_INDEX_KEY}}]}
+        found = _execute(service.spreadsheets().developerMetadata().search(
+            spreadsheetId=SPREADSHEET_ID, body=body))
+        sheet_id = layout.catalog.sheet_id(tab)
+        already = set()
+        for match in found.get('matchedDeveloperMetadata', []):
+            dimension_range = match['developerMetadata'].get('location', {}).get('dimensionRange', {})
+            if dimension_range.get('sheetId', 0) == sheet_id:
+                already.add(dimension_range.get('startIndex', 0) + 1)
+
+        pending = [row for row in rows if row[2] not in already]
+        _index_rows(service, tab, pending, mark_indexed=True)
+        summary[tab] = len(pending)
+        logging.info(f"Índice de '{tab}': {len(pending)} filas nuevas")
+    return summary
+
 def find_user_today_row(service, spreadsheet_id, user_id):
     """Busca la fila para hoy (wrapper)."""
     now = datetime.datetime.now(ECUADOR_TZ)
     return find_user_row_by_date(service, spreadsheet_id, user_id, now)
 
-def update_timer_logic(service, spreadsheet_id, row_idx, message_date=None):
-    """Actualiza G (Inicio), H (Fin) y E (Duración) para una fila existente."""
+def _read_day_cells(service, tab, row_idx):
+    """
+    Lee C:H de una fila con una sola llamada. Retorna [C, D, E, F, G, H] (vacíos como "").
+    G/H llegan con el formato de la celda ('8:05:03'); storage las normaliza a HH:MM:SS.
+    """
+    result = _execute(service.spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID, range=layout.a1(tab, f"C{row_idx}:H{row_idx}")), batch_service=service)
+    values = result.get('values', [])
+    row = values[0] if values else []
+    return row + [""] * (6 - len(row))
+
+def _ensure_local_day(service, user_id, date_str, tab, row_idx):
+    """
+    Si el día todavía no está en el registro local (filas creadas antes de tenerlo),
+    lee la fila una sola vez e importa las entradas de C y los tiempos de G/H.
+    Después de un cambio externo en el Sheet la relee una vez más y lo editado a mano reemplaza lo local.
+    """
+    key = f"{user_id}:{date_str}"
+    stale = _sheet_changed_since(_fresh_days, key)
+    has_entries = storage.has_log_entries(user_id, date_str)
+    has_session = storage.get_day_session(user_id, date_str) is not None
+    if has_entries and has_session and not stale:
+        return
+
+    desc, folder_link, _, _, start_time, end_time = _read_day_cells(service, tab, row_idx)
+    lines = desc.split('\n') if desc else []
+    if not has_entries:
+        storage.seed_log_entries(user_id, date_str, lines)
+    elif stale and storage.sync_log_entries(user_id, date_str, lines):
+        logging.info(f"Entradas de {user_id} {date_str} actualizadas desde el Sheet (editado a mano)")
+    if not has_session:
+        storage.seed_day_session(user_id, date_str, start_time or None, end_time or None, folder_link or None)
+    elif stale:
+        storage.sync_day_session(user_id, date_str, start_time, end_time, folder_link)
+    _fresh_days.add(key)
+
+def render_description(entries):
+    """Texto de la columna C a partir de las entradas del día."""
+    return "\n".join(entry['text'] for entry in entries)
+
+def _as_text(value):
+    # Con USER_ENTERED el apóstrofo inicial obliga a guardar el valor como texto
+    # (evita que un mensaje como "=algo" o "12/10" se interprete como fórmula o fecha)
+    return "'" + value if value else ""
+
+def _description_update(user_id, date_str, tab, row_idx):
+    """Actualización de la celda C derivada del registro local (sin leerla antes)."""
+    description = render_description(storage.get_log_entries(user_id, date_str))
+    return {'range': layout.a1(tab, f"C{row_idx}"), 'values': [[_as_text(description)]]}
+
+def _session_time_updates(user_id, date_str, tab, row_idx, time_str):
+    """
+    Actualiza el inicio (mínimo) y fin (máximo) locales de la sesión del día con la hora del mensaje.
+    Retorna solo las celdas G/H que cambiaron.
+    """
+    changed = storage.update_day_session_times(user_id, date_str, time_str)
+    data = []
+    if 'start_time' in changed:
+        data.append({'range': layout.a1(tab, f"G{row_idx}"), 'values': [[changed['start_time']]]})
+    if 'end_time' in changed:
+        data.append({'range': layout.a1(tab, f"H{row_idx}"), 'values': [[changed['end_time']]]})
+    return data
+
+def _batch_write(service, data):
+    """Escribe varias celdas de una fila en una sola llamada (nada si no hay cambios)."""
+    if not data:
+        return
+    body = {
+        'valueInputOption': 'USER_ENTERED',
+        'data': data
+    }
+    _execute(service.spreadsheets().values().batchUpdate(
+        spreadsheetId=SPREADSHEET_ID, body=body))
+
+def _day_row_values(user_id, date_str, description, folder_link, session=None):
+    """Valores A:H de la fila del día, con los tiempos de session o, si no se pasan, del registro local."""
+    # Estructura: [User, Fecha, Descripción, Carpeta, Duración, "Filler", Inicio, Fin]
+    if session is None:
+        session = storage.get_day_session(user_id, date_str) or {}
+    formula = '=INDIRECT("H"&ROW())-INDIRECT("G"&ROW())'
+    return [str(user_id), date_str, _as_text(description), folder_link, formula, "",
+            session.get('start_time') or "", session.get('end_time') or ""]
+
+def _append_day_row(service, user_id, date_str, tab, description, folder_link):
+    """Crea la fila del día (y su pestaña si hace falta) con los tiempos del registro local."""
+    values = [_day_row_values(user_id, date_str, description, folder_link)]
+    body = {'values': values}
+    _ensure_shards(service, [tab])
+    result = _execute(service.spreadsheets().values().append(
+        spreadsheetId=SPREADSHEET_ID, range=layout.a1(tab, "A1"),
+        valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body=body))
+
+    # C se escribió desde el registro local: aunque esté vacía (solo fotos) no hay que volver a leerla
+    storage.mark_log_day(user_id, date_str)
+
+    # Indexar la fila nueva; si falla, la pestaña deja de considerarse indexada en este proceso
+    # (las búsquedas vuelven a leer A:B en lugar de crear una fila duplicada)
+    row_idx = _updated_row(result)
     try:
-        if message_date:
-            time_str = message_date.strftime("%H:%M:%S")
-        else:
-            time_str = datetime.datetime.now(ECUADOR_TZ).strftime("%H:%M:%S")
-        
-        # 1. Chequear si G está vacío
-        range_g = f"G{row_idx}"
-        result = service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id, range=range_g).execute()
-        
-        values = result.get('values', [])
-        current_g = values[0][0] if values and values[0] else None
-        
-        data = []
-        # Si G vacío, actualizarlo
-        # OJO: Si procesamos mensajes en desorden, esto asume que el primero que llega es el 'inicio'.
-        # Pero G debe ser el MINIMO y H el MAXIMO.
-        # Por simplicidad y como el bot procesa en orden (cron o real time), asumimos orden de llegada
-        # Si es cron y procesa batch, Telegram entrega updates en orden.
-        if not current_g:
-            data.append({'range': f"G{row_idx}", 'values': [[time_str]]})
-        # TODO: Idealmente compararíamos tiempos, pero Strings son comparables si formato es HH:MM:SS
-            
-        # Siempre actualizar H con la hora de este mensaje
-        data.append({'range': f"H{row_idx}", 'values': [[time_str]]})
-        
-        # Asegurar fórmula E
-        formula = f"=H{row_idx}-G{row_idx}"
-        data.append({'range': f"E{row_idx}", 'values': [[formula]]})
-        
-        body = {
-            'valueInputOption': 'USER_ENTERED',
-            'data': data
-        }
-        service.spreadsheets().values().batchUpdate(
-            spreadsheetId=spreadsheet_id, body=body).execute()
-            
+        if row_idx is None:
+            raise ValueError(f"Rango inesperado: {result.get('updates', {}).get('updatedRange')}")
+        _index_rows(service, tab, [(str(user_id), date_str, row_idx)])
     except Exception as e:
-        logging.error(f"Error actualizando timers: {str(e)}")
+        logging.error(f"Error indexando la fila nueva de {user_id} {date_str}: {str(e)}")
+        layout.catalog.set_indexed(tab, False)
 
-def append_text_log(text, user_id, message_date=None):
-    """Agrega texto a la columna Descripción (C). Usa message_date si existe."""
+def _entry_source(text, source):
+    # Las indicaciones para la IA empiezan con "IA!"
+    if text.strip().upper().startswith("IA!"):
+        return 'hint'
+    return source
+
+@tracing.traced('drive_service.append_text_log')
+def append_text_log(text, user_id, message_date=None, source='text'):
+    """
+    Agrega un mensaje a la bitácora del día (con id estable en el registro local)
+    y actualiza Descripción (C) e Inicio/Fin (G/H) en una sola escritura. Usa message_date si existe.
+    source: 'text', 'caption' o 'voice' (transcripción de un audio).
+    """
     if not user_id:
         return
 
     try:
         service = get_sheets_service()
-        str_user_id = str(user_id)
         
         # Determinar fecha y hora a usar
         if message_date:
@@ -217,52 +659,35 @@ def append_text_log(text, user_id, message_date=None):
         time_str = date_to_use.strftime("%H:%M:%S")
         
         # Buscar fila por FECHA DEL MENSAJE, no fecha actual
+        tab = layout.shard_for(user_id, date_to_use)
         row_idx = find_user_row_by_date(service, SPREADSHEET_ID, user_id, date_to_use)
         
         if row_idx:
-            # La fila existe, obtener contenido actual de Descripción (Col C)
-            range_name = f"C{row_idx}"
-            result = service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID, range=range_name).execute()
-            current_desc = result.get('values', [[None]])[0][0] or ""
-            
-            # Concatenar
-            if current_desc:
-                new_desc = current_desc + "\n" + text
-            else:
-                new_desc = text
-                
-            # Actualizar celda Descripción
-            body_desc = {'values': [[new_desc]]}
-            service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID, range=range_name,
-                valueInputOption="RAW", body=body_desc).execute()
-            
-            # Actualizar timers con la fecha del mensaje
-            update_timer_logic(service, SPREADSHEET_ID, row_idx, message_date=date_to_use)
+            # La fila existe: C y los tiempos se calculan localmente, sin leer la fila
+            _ensure_local_day(service, user_id, date_str, tab, row_idx)
+            storage.add_log_entry(user_id, date_str, time_str, _entry_source(text, source), text)
+            data = [_description_update(user_id, date_str, tab, row_idx)]
+            data += _session_time_updates(user_id, date_str, tab, row_idx, time_str)
+            _batch_write(service, data)
 
         else:
             # Crear nueva fila
-            # Estructura: [User, Fecha, Descripción, Carpeta, Duración, "Filler", Inicio, Fin]
-            formula = '=INDIRECT("H"&ROW())-INDIRECT("G"&ROW())'
-            
-            values = [[str_user_id, date_str, text, "No se han guardaron fotos", formula, "", time_str, time_str]]
-            body = {'values': values}
-            service.spreadsheets().values().append(
-                spreadsheetId=SPREADSHEET_ID, range="A1",
-                valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body=body).execute()
+            storage.add_log_entry(user_id, date_str, time_str, _entry_source(text, source), text)
+            storage.update_day_session_times(user_id, date_str, time_str)
+            description = render_description(storage.get_log_entries(user_id, date_str))
+            _append_day_row(service, user_id, date_str, tab, description, "No se han guardaron fotos")
                 
     except Exception as e:
         logging.error(f"Error actualizando Sheets (Texto): {str(e)}")
 
+@tracing.traced('drive_service.update_daily_folder_link')
 def update_daily_folder_link(folder_link, user_id, message_date=None):
-    """Actualiza la columna Carpeta (D). Usa message_date si existe."""
+    """Actualiza la columna Carpeta (D) y los tiempos G/H, escribiendo solo lo que cambió. Usa message_date si existe."""
     if not user_id:
         return
 
     try:
         service = get_sheets_service()
-        str_user_id = str(user_id)
         
         if message_date:
             date_to_use = message_date
@@ -271,58 +696,40 @@ def update_daily_folder_link(folder_link, user_id, message_date=None):
         date_str = date_to_use.strftime("%d-%m-%Y")
         time_str = date_to_use.strftime("%H:%M:%S")
             
+        tab = layout.shard_for(user_id, date_to_use)
         row_idx = find_user_row_by_date(service, SPREADSHEET_ID, user_id, date_to_use)
         
         if row_idx:
             # Fila existe
-            range_name = f"D{row_idx}"
-            body = {'values': [[folder_link]]}
-            service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID, range=range_name,
-                valueInputOption="RAW", body=body).execute()
-            
-            # Actualizar timers
-            update_timer_logic(service, SPREADSHEET_ID, row_idx, message_date=date_to_use)
+            _ensure_local_day(service, user_id, date_str, tab, row_idx)
+            data = []
+            if storage.set_day_folder_link(user_id, date_str, folder_link):
+                data.append({'range': layout.a1(tab, f"D{row_idx}"), 'values': [[folder_link]]})
+            data += _session_time_updates(user_id, date_str, tab, row_idx, time_str)
+            _batch_write(service, data)
                 
         else:
             # Fila no existe
-            formula = '=INDIRECT("H"&ROW())-INDIRECT("G"&ROW())'
-            
-            values = [[str_user_id, date_str, "", folder_link, formula, "", time_str, time_str]]
-            body = {'values': values}
-            service.spreadsheets().values().append(
-                spreadsheetId=SPREADSHEET_ID, range="A1",
-                valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body=body).execute()
+            storage.update_day_session_times(user_id, date_str, time_str)
+            storage.set_day_folder_link(user_id, date_str, folder_link)
+            description = render_description(storage.get_log_entries(user_id, date_str))
+            _append_day_row(service, user_id, date_str, tab, description, folder_link)
                 
     except Exception as e:
         logging.error(f"Error actualizando Sheets (Link): {str(e)}")
 
+@tracing.traced('drive_service.get_day_descriptions')
 def get_day_descriptions(user_id):
     """
     Obtiene el contenido de la columna C (Descripción) para el usuario y día actual.
-    Retorna una lista de strings o None si no se encuentra.
+    Retorna el texto o None si no se encuentra.
     """
-    if not user_id:
-        return None
-        
-    try:
-        service = get_sheets_service()
-        row_idx = find_user_today_row(service, SPREADSHEET_ID, user_id)
-        
-        if row_idx:
-            range_name = f"C{row_idx}"
-            result = service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID, range=range_name).execute()
-            values = result.get('values', [])
-            if values and values[0]:
-                return values[0][0]
-                
-        return None
-        
-    except Exception as e:
-        logging.error(f"Error leyendo descripciones: {str(e)}")
-        raise e
+    entries = get_day_entries(user_id)
+    if entries:
+        return render_description(entries)
+    return None
 
+@tracing.traced('drive_service.update_ai_response')
 def update_ai_response(response_text, user_id):
     """Actualiza la columna F (AI Response) con el texto generado."""
     if not user_id:
@@ -330,15 +737,18 @@ def update_ai_response(response_text, user_id):
 
     try:
         service = get_sheets_service()
-        row_idx = find_user_today_row(service, SPREADSHEET_ID, user_id)
+        now = datetime.datetime.now(ECUADOR_TZ)
+        tab = layout.shard_for(user_id, now)
+        row_idx = find_user_row_by_date(service, SPREADSHEET_ID, user_id, now)
         
         if row_idx:
             # Columna F es la 6ta columna
-            range_name = f"F{row_idx}"
+            range_name = layout.a1(tab, f"F{row_idx}")
             body = {'values': [[response_text]]}
-            service.spreadsheets().values().update(
+            _execute(service.spreadsheets().values().update(
                 spreadsheetId=SPREADSHEET_ID, range=range_name,
-                valueInputOption="RAW", body=body).execute()
+                valueInputOption="RAW", body=body))
+            _ai_response_cache.set(f"{user_id}:{now.strftime('%d-%m-%Y')}", response_text)
         else:
             # Si no existe la fila, no podemos guardar la respuesta IA asociada a mensajes inexistentes
             # (Aunque teóricamente se podría crear, el requerimiento es procesar mensajes existentes)
@@ -348,89 +758,154 @@ def update_ai_response(response_text, user_id):
         logging.error(f"Error actualizando Sheets (AI): {str(e)}")
         raise e
 
+@tracing.traced('drive_service.get_day_entries')
+def get_day_entries(user_id, message_date=None):
+    """
+    Obtiene las entradas de la bitácora del día para el usuario.
+    Retorna lista de dicts {id, time, source, text} o lista vacía.
+    """
+    if not user_id:
+        return []
+
+    try:
+        date_to_use = message_date or datetime.datetime.now(ECUADOR_TZ)
+        date_str = date_to_use.strftime("%d-%m-%Y")
+
+        # Si ya hay registro local (y el Sheet no se editó a mano desde que se verificó) no hace falta leerlo
+        sheet_changes.check()
+        if not storage.has_log_entries(user_id, date_str) or _sheet_changed_since(_fresh_days, f"{user_id}:{date_str}"):
+            service = get_sheets_service()
+            row_idx = find_user_row_by_date(service, SPREADSHEET_ID, user_id, date_to_use)
+            if not row_idx:
+                return []
+            _ensure_local_day(service, user_id, date_str, layout.shard_for(user_id, date_to_use), row_idx)
+
+        return storage.get_log_entries(user_id, date_str)
+
+    except Exception as e:
+        logging.error(f"Error leyendo descripciones: {str(e)}")
+        raise e
+
 def get_day_messages(user_id):
     """
-    Obtiene los mensajes individuales (separados por salto de línea) 
-    de la columna descripción para el usuario y día de hoy.
+    Obtiene los mensajes individuales de la bitácora del usuario para el día de hoy.
     Retorna lista de strings o lista vacía.
     """
-    content = get_day_descriptions(user_id)
-    if content:
-        return content.split('\n')
-    return []
+    return [entry['text'] for entry in get_day_entries(user_id)]
 
-def delete_message_line(user_id, line_index):
+@tracing.traced('drive_service.delete_day_entries')
+def delete_day_entries(user_id, entry_ids):
     """
-    Elimina un mensaje específico (por índice 0-based) de la celda de descripción.
+    Elimina entradas de la bitácora por id y reescribe la celda C de cada día afectado
+    con una sola escritura. Es idempotente: repetir ids ya borrados solo vuelve a escribir C.
     """
-    if not user_id:
+    if not user_id or not entry_ids:
         return False
 
     try:
+        dates = storage.delete_log_entries(user_id, entry_ids)
+        if not dates:
+            return False
+
         service = get_sheets_service()
-        row_idx = find_user_today_row(service, SPREADSHEET_ID, user_id)
-        
-        if row_idx:
-            # 1. Obtener contenido actual
-            range_name = f"C{row_idx}"
-            result = service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID, range=range_name).execute()
-            values = result.get('values', [[None]])
-            current_desc = values[0][0] or ""
-            
-            if not current_desc:
-                return False
-                
-            # 2. Procesar lista
-            messages = current_desc.split('\n')
-            
-            if 0 <= line_index < len(messages):
-                removed = messages.pop(line_index)
-                logging.info(f"Eliminando mensaje índice {line_index}: {removed}")
-                
-                # 3. Reconstruir y guardar
-                new_desc = "\n".join(messages)
-                
-                body_desc = {'values': [[new_desc]]}
-                service.spreadsheets().values().update(
-                    spreadsheetId=SPREADSHEET_ID, range=range_name,
-                    valueInputOption="RAW", body=body_desc).execute()
-                return True
-                
-        return False
-            
+        for date_str in dates:
+            date_obj = datetime.datetime.strptime(date_str, "%d-%m-%Y")
+            row_idx = find_user_row_by_date(service, SPREADSHEET_ID, user_id, date_obj)
+            if row_idx:
+                logging.info(f"Eliminando {len(entry_ids)} mensajes de la fila {row_idx}")
+                tab = layout.shard_for(user_id, date_obj)
+                _batch_write(service, [_description_update(user_id, date_str, tab, row_idx)])
+        return True
 
     except Exception as e:
-        logging.error(f"Error eliminando mensaje en Sheets: {str(e)}")
+        logging.error(f"Error eliminando mensajes en Sheets: {str(e)}")
         raise e
 
+@tracing.traced('drive_service.get_ai_response')
 def get_ai_response(user_id):
     """
     Obtiene el contenido de la columna F (AI Response) para el usuario y día actual.
     Retorna el string de la respuesta o None si no existe.
+    Se lee del Sheet una vez por día (después la da la caché, que /send actualiza).
     """
     if not user_id:
         return None
         
     try:
-        service = get_sheets_service()
-        row_idx = find_user_today_row(service, SPREADSHEET_ID, user_id)
-        
-        if row_idx:
-            range_name = f"F{row_idx}"
-            result = service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID, range=range_name).execute()
-            values = result.get('values', [])
-            if values and values[0]:
-                return values[0][0]
-                
-        return None
+        now = datetime.datetime.now(ECUADOR_TZ)
+        # Una edición a mano del Sheet vacía la caché
+        sheet_changes.check()
+        return _ai_response_cache.get_or_load(f"{user_id}:{now.strftime('%d-%m-%Y')}", lambda: _read_ai_response(user_id, now))
         
     except Exception as e:
         logging.error(f"Error leyendo AI response: {str(e)}")
         raise e
 
 
+def _read_user_history(service, user_id=None, periods=None):
+    """
+    Filas A:H donde puede estar el historial del usuario: la hoja completa en modo 'single',
+    o solo las pestañas de su grupo (todas en una llamada) si hay shards.
+    user_id=None lee las de todos; periods (claves de layout.period_key) limita las pestañas por período.
+    """
+    if not layout.is_sharded():
+        result = _execute(service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range="A:H"))
+        return result.get('values', [])
+
+    if layout.catalog.needs_refresh(stale=True):
+        _load_catalog(service)
+    tabs = sorted(tab for tab in layout.catalog.tabs()
+                  if layout.is_shard_name(tab)
+                  and (user_id is None or layout.is_user_shard(tab, user_id))
+                  and (periods is None or layout.period_key_of(tab) in periods))
+    if not tabs:
+        return []
+    result = _execute(service.spreadsheets().values().batchGet(
+        spreadsheetId=SPREADSHEET_ID, ranges=[layout.a1(tab, "A:H") for tab in tabs]))
+    values = []
+    for value_range in result.get('valueRanges', []):
+        values.extend(value_range.get('values', []))
+    return values
+
+def _read_ai_response(user_id, now):
+    service = get_sheets_service()
+    tab = layout.shard_for(user_id, now)
+    row_idx = find_user_row_by_date(service, SPREADSHEET_ID, user_id, now)
+
+    if row_idx:
+        range_name = layout.a1(tab, f"F{row_idx}")
+        result = _execute(service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range=range_name), batch_service=service)
+        values = result.get('values', [])
+        if values and values[0]:
+            return values[0][0]
+
+    return None
+
+@tracing.traced('drive_service.get_history_rows')
+def get_history_rows(start_date, end_date, user_id=None):
+    """
+    Filas A:H de la bitácora con fecha entre start_date y end_date (datetime.date, inclusive),
+    de un usuario o de todos. Se leen solo las pestañas de esos períodos, en una llamada.
+    """
+    service = get_sheets_service()
+    days = (end_date - start_date).days + 1
+    periods = {layout.period_key(start_date + datetime.timedelta(days=i)) for i in range(max(0, days))}
+    rows = []
+    for row in _read_user_history(service, user_id, periods):
+        if len(row) < 2 or (user_id is not None and row[0] != str(user_id)):
+            continue
+        try:
+            row_date = datetime.datetime.strptime(row[1], "%d-%m-%Y").date()
+        except ValueError:
+            # Encabezado u otra fila que no es de un día
+            continue
+        if start_date <= row_date <= end_date:
+            rows.append(row)
+    return rows
+
+@tracing.traced('drive_service.generate_excel_report')
 def generate_excel_report(user_id):
     """
     Genera un archivo Excel con todos los registros del usuario.
@@ -445,10 +920,7 @@ def generate_excel_report(user_id):
         
         # 1. Leer todos los datos
         # Asumiendo que las columnas son A-H. Leeremos todo el rango con datos.
-        result = service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID, range="A:H").execute()
-        
-        values = result.get('values', [])
+        values = _read_user_history(service, user_id)
         
         if not values:
             return None
@@ -490,16 +962,243 @@ def generate_excel_report(user_id):
         df = df[['Fecha', 'duracion', 'Descripcion', 'images', 'tus mensajes']]
         
         # 4. Guardar a Excel temporal
-        # Usar tempfile para crear un archivo temporal seguro
-        temp_dir = tempfile.gettempdir()
+        # mkstemp da un nombre único: con /get en paralelo, dos reportes del mismo segundo
+        # compartían archivo y un estudiante podía recibir el de otro
         timestamp = datetime.datetime.now(ECUADOR_TZ).strftime("%Y%m%d_%H%M%S")
-        filename = f"reporte_{timestamp}.xlsx"
-        filepath = os.path.join(temp_dir, filename)
-        
-        df.to_excel(filepath, index=False)
+        fd, filepath = tempfile.mkstemp(prefix=f"reporte_{timestamp}_", suffix=".xlsx")
+        os.close(fd)
+        try:
+            df.to_excel(filepath, index=False)
+        except Exception:
+            os.remove(filepath)
+            raise
         
         return filepath
 
     except Exception as e:
         logging.error(f"Error generando reporte Excel: {str(e)}")
         raise e
+
+# --- IMPORTACIÓN MASIVA ---
+
+# Subidas simultáneas al importar historiales (cada hilo usa su propio cliente de Drive)
+IMPORT_UPLOAD_WORKERS = int(os.getenv('IMPORT_UPLOAD_WORKERS', '8'))
+def _unique_names(filenames, taken):
+    """Nombres únicos como get_unique_filename ("x (1).jpg"), calculados sin llamar a Drive."""
+    taken = set(taken)
+    result = []
+    for filename in filenames:
+        name, ext = os.path.splitext(filename)
+        new_filename, counter = filename, 1
+        while new_filename in taken:
+            new_filename = f"{name} ({counter}){ext}"
+            counter += 1
+        taken.add(new_filename)
+        result.append(new_filename)
+    return result
+
+@tracing.traced('drive_service.find_existing_days')
+def find_existing_days(day_keys):
+    """
+    De las claves [(user_id, DD-MM-YYYY)], retorna las que ya tienen fila en el Sheet.
+    Lee A:B de todas las pestañas involucradas en una sola llamada.
+    """
+    service = get_sheets_service()
+    tabs = set()
+    for user_id, date_str in day_keys:
+        tab = layout.shard_for(user_id, datetime.datetime.strptime(date_str, "%d-%m-%Y"))
+        if _shard_exists(service, tab):
+            tabs.add(tab)
+    if not tabs:
+        return set()
+
+    tabs = sorted(tabs, key=lambda tab: tab or "")
+    result = _execute(service.spreadsheets().values().batchGet(
+        spreadsheetId=SPREADSHEET_ID, ranges=[layout.a1(tab, "A:B") for tab in tabs]))
+    existing = set()
+    for value_range in result.get('valueRanges', []):
+        for row in value_range.get('values', []):
+            if len(row) >= 2:
+                existing.add((row[0], row[1]))
+    return {(str(user_id), date_str) for user_id, date_str in day_keys} & existing
+
+@tracing.traced('drive_service.upload_day_images')
+def upload_day_images(images, workers=IMPORT_UPLOAD_WORKERS):
+    """
+    Sube las fotos de varios días: images = {(user_id, DD-MM-YYYY): [(ruta, descripción)]}.
+    Las carpetas se crean primero, una por una (en paralelo se duplicarían);
+    después las subidas van en paralelo (hasta `workers` a la vez) con el cliente asyncio,
+    sobre conexiones reutilizadas. No llamar desde un event loop en marcha.
+    Retorna {(user_id, DD-MM-YYYY): webViewLink de la carpeta del día}.
+    """
+    service = get_drive_service()
+    jobs = []
+    links = {}
+    user_folders = {}
+    for (user_id, date_str), photos in images.items():
+        if not photos:
+            continue
+        if user_id not in user_folders:
+            user_folders[user_id] = get_or_create_folder(service, str(user_id), PARENT_FOLDER_ID).get('id')
+        daily_folder = get_or_create_folder(service, date_str, user_folders[user_id])
+        links[(user_id, date_str)] = daily_folder.get('webViewLink')
+
+        # Nombres como los del bot ("DD-MM-YYYY.jpg", "DD-MM-YYYY (1).jpg"...), sin chocar con los existentes
+        query = f"'{daily_folder['id']}' in parents and trashed=false"
+        taken = [f['name'] for f in _execute(service.files().list(q=query, spaces='drive', fields='files(name)')).get('files', [])]
+        names = _unique_names([f"{date_str}.jpg"] * len(photos), taken)
+        for (path, description), name in zip(photos, names):
+            jobs.append((path, name, daily_folder['id'], description))
+
+    if jobs:
+        asyncio.run(_upload_files(jobs, max(1, workers)))
+    logging.info(f"Importación: {len(jobs)} fotos subidas en {len(links)} carpetas")
+    return links
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+async def _upload_files(jobs, workers):
+    """Sube [(ruta, nombre, carpeta, descripción)] con hasta `workers` subidas a la vez."""
+    from services.google.async_client import AsyncGoogleClient
+
+    semaphore = asyncio.Semaphore(workers)
+    async with AsyncGoogleClient(max_connections=workers) as client:
+        async def upload(job):
+            path, name, folder_id, description = job
+            async with semaphore:
+                data = await asyncio.to_thread(_read_file, path)
+                body = {'name': name, 'parents': [folder_id]}
+                if description:
+                    body['description'] = description
+                with tracing.span('drive_service.upload'):
+                    file = await client.files_upload(body, data, 'image/jpeg')
+                DRIVE_UPLOAD_BYTES.inc(len(data))
+                logging.info(f"Archivo subido: {file.get('name')} ID: {file.get('id')}")
+                return file
+
+        return await asyncio.gather(*(upload(job) for job in jobs))
+
+@tracing.traced('drive_service.import_days')
+def import_days(messages, folder_links=None, photo_times=None):
+    """
+    Escribe días completos importados:
+    - messages = {(user_id, DD-MM-YYYY): [(datetime, source, text)]}
+    - folder_links = {(user_id, DD-MM-YYYY): enlace a la carpeta del día}
+    - photo_times = {(user_id, DD-MM-YYYY): [datetime]} (cuentan para Inicio/Fin, como en vivo)
+    Agrega todas las filas con un values.append por pestaña (más el índice, en lotes) y,
+    recién cuando la pestaña quedó escrita, guarda sus entradas y tiempos en el registro local:
+    si una pestaña falla, sus días no quedan como importados y se pueden reintentar.
+    Los días con registro local se omiten. Retorna la cantidad de filas escritas.
+    """
+    folder_links = folder_links or {}
+    photo_times = photo_times or {}
+    service = get_sheets_service()
+    # pestaña -> [(fila A:H, (user_id, fecha, entradas, inicio, fin, carpeta))]
+    rows_by_tab = {}
+    for key in sorted(set(messages) | set(photo_times)):
+        user_id, date_str = key
+        day_messages = sorted(messages.get(key, []), key=lambda m: m[0])
+        if storage.has_log_entries(user_id, date_str) or storage.get_day_session(user_id, date_str):
+            logging.warning(f"{user_id} {date_str} ya tiene registro local, se omite")
+            continue
+        entries = [(moment.strftime("%H:%M:%S"), _entry_source(text, source), text) for moment, source, text in day_messages]
+
+        moments = [m[0] for m in day_messages] + list(photo_times.get(key, []))
+        times = [moment.strftime("%H:%M:%S") for moment in moments]
+        folder_link = folder_links.get(key)
+        session = {'start_time': min(times), 'end_time': max(times)}
+
+        description = render_description([{'text': text} for _, _, text in entries])
+        tab = layout.shard_for(user_id, min(moments))
+        row = _day_row_values(user_id, date_str, description, folder_link or "No se han guardaron fotos", session)
+        rows_by_tab.setdefault(tab, []).append((row, (user_id, date_str, entries, min(times), max(times), folder_link)))
+
+    _ensure_shards(service, list(rows_by_tab))
+    written = 0
+    for tab, items in rows_by_tab.items():
+        values = [row for row, _ in items]
+        try:
+            result = _execute(service.spreadsheets().values().append(
+                spreadsheetId=SPREADSHEET_ID, range=layout.a1(tab, "A1"),
+                valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body={'values': values}))
+        except Exception as e:
+            logging.error(f"No se pudieron escribir {len(values)} días en '{tab}' (quedan para reintentar): {str(e)}")
+            continue
+        written += len(values)
+        for user_id, date_str, entries, start_time, end_time, folder_link in (day for _, day in items):
+            storage.import_log_entries(user_id, date_str, entries)
+            storage.seed_day_session(user_id, date_str, start_time, end_time, folder_link)
+        first_row = _updated_row(result)
+        if first_row is None:
+            logging.error(f"No se pudo indexar lo importado en '{tab}': rango inesperado")
+            layout.catalog.set_indexed(tab, False)
+            continue
+        _index_rows(service, tab, [(row[0], row[1], first_row + i) for i, row in enumerate(values)])
+    return written
+
+# --- MIGRACIÓN DE LAYOUT ---
+
+@tracing.traced('drive_service.migrate_sheet_layout')
+def migrate_sheet_layout(dry_run=False):
+    """
+    Reparte las filas de la hoja original (la primera) en las pestañas del SHEET_LAYOUT actual.
+    La hoja original no se modifica. Las pestañas que ya tienen filas se omiten, así que
+    volver a ejecutarla no duplica datos.
+    Retorna {pestaña: filas copiadas (o a copiar si dry_run)}.
+    """
+    if not layout.is_sharded():
+        raise ValueError("SHEET_LAYOUT es 'single': no hay pestañas a las que migrar")
+
+    service = get_sheets_service()
+    _load_catalog(service)
+    tabs = layout.catalog.tabs()
+    if not tabs:
+        return {}
+    source_tab = tabs[0]
+
+    result = _execute(service.spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID, range=layout.a1(source_tab, "A:H")))
+
+    shards = {}
+    for row in result.get('values', []):
+        if len(row) < 2:
+            continue
+        try:
+            date_obj = datetime.datetime.strptime(row[1], "%d-%m-%Y")
+        except ValueError:
+            # Encabezado o fila sin fecha válida
+            continue
+        row = row + [""] * (8 - len(row))
+        tab = layout.shard_for(row[0], date_obj)
+        # Se reescribe como las escribe el bot: fórmula de duración y texto forzado en C/F
+        formula = '=INDIRECT("H"&ROW())-INDIRECT("G"&ROW())'
+        shards.setdefault(tab, []).append(
+            [row[0], row[1], _as_text(row[2]), row[3], formula, _as_text(row[5]), row[6], row[7]])
+
+    existing = [tab for tab in shards if tab in layout.catalog]
+    if existing:
+        # Solo se escribe en pestañas vacías (recién creadas o con el encabezado)
+        result = _execute(service.spreadsheets().values().batchGet(
+            spreadsheetId=SPREADSHEET_ID, ranges=[layout.a1(tab, "A2:A2") for tab in existing]))
+        for tab, value_range in zip(existing, result.get('valueRanges', [])):
+            if value_range.get('values'):
+                logging.warning(f"Pestaña '{tab}' ya tiene filas, se omite")
+                del shards[tab]
+
+    summary = {tab: len(rows) for tab, rows in sorted(shards.items())}
+    if dry_run or not shards:
+        return summary
+
+    # Las pestañas se marcan como indexadas recién cuando todas sus filas tienen índice
+    missing = [tab for tab in shards if tab not in layout.catalog]
+    if missing:
+        _create_shards(service, sorted(missing), indexed=False)
+    data = [{'range': layout.a1(tab, f"A2:H{len(rows) + 1}"), 'values': rows} for tab, rows in shards.items()]
+    _batch_write(service, data)
+    for tab, rows in shards.items():
+        _index_rows(service, tab, [(row[0], row[1], i + 2) for i, row in enumerate(rows)],
+                    mark_indexed=not layout.catalog.is_indexed(tab))
+    logging.info(f"Migración de '{source_tab}': {sum(summary.values())} filas en {len(summary)} pestañas")
+    return summary
@@ -0,0 +1,51 @@
+"""
+Migra la hoja única de la bitácora a pestañas por período y/o grupo de usuarios.
+
+Uso:
+    SHEET_LAYOUT=month python -m services.google.migrate_sheet --dry-run
+    SHEET_LAYOUT=semester SHEET_USER_GROUPS=4 python -m services.google.migrate_sheet
+    python -m services.google.migrate_sheet --index   # solo indexar las filas existentes
+
+Después de migrar, arrancar el bot con las mismas variables SHEET_LAYOUT / SHEET_USER_GROUPS.
+La hoja original queda intacta como respaldo.
+"""
+import sys
+import logging
+import argparse
+
+from services.google import drive_service, sheet_layout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reparte la hoja de la bitácora en pestañas")
+    parser.add_argument('--layout', choices=sheet_layout.LAYOUTS, help="Por defecto SHEET_LAYOUT")
+    parser.add_argument('--user-groups', type=int, help="Por defecto SHEET_USER_GROUPS")
+    parser.add_argument('--dry-run', action='store_true', help="Solo mostrar cuántas filas irían a cada pestaña")
+    parser.add_argument('--index', action='store_true',
+                        help="No migrar: agregar al índice (developer metadata) las filas que no lo tienen")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sheet_layout.configure(args.layout, args.user_groups)
+
+    if args.index:
+        summary = drive_service.build_row_index()
+        for tab, count in summary.items():
+            print(f"{tab}: {count} filas indexadas")
+        print(f"Total: {sum(summary.values())} filas indexadas")
+        return 0
+
+    try:
+        summary = drive_service.migrate_sheet_layout(dry_run=args.dry_run)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    for tab, count in summary.items():
+        print(f"{tab}: {count} filas")
+    print(f"Total: {sum(summary.values())} filas en {len(summary)} pestañas" + (" (dry-run)" if args.dry_run else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Distribución de las filas de la bitácora en pestañas (shards) del Spreadsheet.
+
+SHEET_LAYOUT:
+- 'single'   (por defecto): todo en la primera hoja, como siempre.
+- 'month':    una pestaña por mes, ej: '2026-10'.
+- 'semester': una pestaña por semestre, ej: '2026-S2' (S1 = enero-junio, S2 = julio-diciembre).
+
+SHEET_USER_GROUPS > 1 además reparte a los usuarios en grupos (user_id % N), ej: '2026-10 G3' o 'G3'.
+
+Así buscar la fila del día lee solo la pestaña del período (y grupo) actual y el costo
+no crece con el historial. Para pasar de 'single' a otro modo, primero migrar la hoja:
+    python -m services.google.migrate_sheet --dry-run
+"""
+import os
+import time
+import zlib
+import threading
+
+SHEET_LAYOUT = os.getenv('SHEET_LAYOUT', 'single').lower()
+SHEET_USER_GROUPS = int(os.getenv('SHEET_USER_GROUPS', '1'))
+# Cada cuánto se puede volver a pedir la lista de pestañas cuando se busca una que no se conoce
+CATALOG_REFRESH_SECONDS = 60
+
+LAYOUTS = ('single', 'month', 'semester')
+HEADER_ROW = ["Usuario", "Fecha", "Descripción", "Carpeta", "Duración", "Respuesta IA", "Inicio", "Fin"]
+
+# Developer metadata del índice de filas:
+# - ROW_INDEX_KEY en cada fila, con valor 'user_id|DD-MM-YYYY'
+# - INDEXED_SHEET_KEY en la pestaña, cuando todas sus filas tienen índice
+ROW_INDEX_KEY = 'bitacora_fila'
+INDEXED_SHEET_KEY = 'bitacora_indexada'
+
+
+def configure(layout=None, user_groups=None):
+    """Cambia el modo en tiempo de ejecución (migración, benchmarks). Vacía el catálogo."""
+    global SHEET_LAYOUT, SHEET_USER_GROUPS
+    if layout is not None:
+        if layout not in LAYOUTS:
+            raise ValueError(f"SHEET_LAYOUT desconocido: {layout}")
+        SHEET_LAYOUT = layout
+    if user_groups is not None:
+        SHEET_USER_GROUPS = max(1, int(user_groups))
+    catalog.reset()
+
+
+def is_sharded():
+    return SHEET_LAYOUT != 'single' or SHEET_USER_GROUPS > 1
+
+
+def user_group(user_id):
+    """Grupo del usuario (0..SHEET_USER_GROUPS-1) o None si no se agrupa."""
+    if SHEET_USER_GROUPS <= 1:
+        return None
+    try:
+        return int(user_id) % SHEET_USER_GROUPS
+    except (TypeError, ValueError):
+        return zlib.crc32(str(user_id).encode()) % SHEET_USER_GROUPS
+
+
+def period_key(date_obj):
+    """Parte del nombre de la pestaña que depende de la fecha ('2026-10', '2026-S2') o None."""
+    if SHEET_LAYOUT == 'month':
+        return date_obj.strftime("%Y-%m")
+    if SHEET_LAYOUT == 'semester':
+        return f"{date_obj.year}-S{1 if date_obj.month <= 6 else 2}"
+    return None
+
+
+def shard_for(user_id, date_obj):
+    """Pestaña donde va la fila de (usuario, fecha). None = la hoja de siempre (rangos sin prefijo)."""
+    parts = []
+    period = period_key(date_obj)
+    if period:
+        parts.append(period)
+    group = user_group(user_id)
+    if group is not None:
+        parts.append(f"G{group}")
+    return " ".join(parts) or None
+
+
+def is_user_shard(tab, user_id):
+    """True si la pestaña puede contener filas del usuario (mismo grupo, cualquier período)."""
+    group = user_group(user_id)
+    if group is None:
+        return True
+    return tab.split(" ")[-1] == f"G{group}"
+
+
+def period_key_of(tab):
+    """Período de una pestaña del modo actual ('2026-10', '2026-S2'), o None si no se reparte por período."""
+    if SHEET_LAYOUT == 'single':
+        return None
+    return tab.split(" ")[0]
+
+
+def is_shard_name(tab):
+    """True si el título corresponde a una pestaña del modo actual (descarta la hoja original u otras)."""
+    parts = tab.split(" ")
+    if SHEET_USER_GROUPS > 1:
+        group = parts.pop()
+        if not (group.startswith("G") and group[1:].isdigit()):
+            return False
+    if SHEET_LAYOUT == 'single':
+        return not parts
+    if len(parts) != 1:
+        return False
+    year, _, rest = parts[0].partition("-")
+    if not year.isdigit():
+        return False
+    if SHEET_LAYOUT == 'month':
+        return rest.isdigit() and len(rest) == 2
+    return rest in ('S1', 'S2')
+
+
+def row_index_value(user_id, date_str):
+    return f"{user_id}|{date_str}"
+
+
+def new_sheet_id(tab):
+    """sheetId para una pestaña nueva: fijado por nosotros para poder referenciarla en el mismo batchUpdate."""
+    return zlib.crc32(tab.encode()) & 0x7fffffff
+
+
+def a1(tab, range_name):
+    """Rango A1 dentro de la pestaña (sin prefijo si tab es None)."""
+    if not tab:
+        return range_name
+    return "'" + tab.replace("'", "''") + "'!" + range_name
+
+
+class ShardCatalog:
+    """
+    Pestañas que existen en el Spreadsheet, con su sheetId y si tienen índice de filas completo.
+    Se carga con una sola llamada y se actualiza al crear pestañas; una pestaña desconocida
+    provoca como mucho un refresco cada CATALOG_REFRESH_SECONDS.
+    tab None es la primera hoja (la de siempre).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # title -> {'sheet_id': int, 'indexed': bool}, en el orden del Spreadsheet
+            self._sheets = {}
+            self._loaded_at = None
+
+    def _resolve(self, tab):
+        if tab is None:
+            return next(iter(self._sheets), None)
+        return tab
+
+    def needs_refresh(self, tab=None, stale=False):
+        """
+        True si hay que volver a cargar: nunca se cargó, se busca una pestaña desconocida
+        o (stale=True) la lista puede estar desactualizada. Ambos casos, a lo sumo cada CATALOG_REFRESH_SECONDS.
+        """
+        with self._lock:
+            if self._loaded_at is None:
+                return True
+            if not stale and self._resolve(tab) in self._sheets:
+                return False
+            return time.monotonic() - self._loaded_at > CATALOG_REFRESH_SECONDS
+
+    def load(self, sheets):
+        """sheets: iterable de (title, sheet_id, indexed)."""
+        with self._lock:
+            self._sheets = {title: {'sheet_id': sheet_id, 'indexed': indexed} for title, sheet_id, indexed in sheets}
+            self._loaded_at = time.monotonic()
+
+    def add(self, tab, sheet_id, indexed=False):
+        with self._lock:
+            self._sheets.setdefault(tab, {'sheet_id': sheet_id, 'indexed': indexed})
+
+    def set_indexed(self, tab, indexed=True):
+        with self._lock:
+            info = self._sheets.get(self._resolve(tab))
+            if info:
+                info['indexed'] = indexed
+
+    def sheet_id(self, tab):
+        with self._lock:
+            info = self._sheets.get(self._resolve(tab))
+            return info['sheet_id'] if info else None
+
+    def is_indexed(self, tab):
+        with self._lock:
+            info = self._sheets.get(self._resolve(tab))
+            return bool(info and info['indexed'])
+
+    def __contains__(self, tab):
+        with self._lock:
+            return self._resolve(tab) in self._sheets
+
+    def tabs(self):
+        with self._lock:
+            return list(self._sheets)
+
+
+catalog = ShardCatalog()
@@ -1,47 +1,174 @@
 
+import re
 import sqlite3
 import datetime
 import logging
 import os
+import time
 from zoneinfo import ZoneInfo
+from utils import metrics
 
 ECUADOR_TZ = ZoneInfo("America/Guayaquil")
 
 DB_PATH = 'bot_data.db'
+# Segundos que una conexión espera a que otro proceso libere el lock de escritura
+SQLITE_BUSY_TIMEOUT = 30
+
+SQLITE_QUERY_LATENCY = metrics.histogram(
+    'sqlite_query_duration_seconds', 'Latencia de consultas SQLite por consulta', ('query',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
+    # Con WAL, NORMAL solo sincroniza en los checkpoints: seguro ante caídas del proceso
+    conn.execute('PRAGMA synchronous=NORMAL')
     return conn
 
+def _begin_write(conn):
+    """
+    Abre la transacción tomando el lock de escritura desde el inicio (BEGIN IMMEDIATE),
+    para que un leer-y-luego-escribir no choque con otro proceso que hace lo mismo.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+
+def _execute(cursor, query_name, sql, params=()):
+    """Ejecuta una consulta registrando su latencia."""
+    start = time.perf_counter()
+    try:
+        return cursor.execute(sql, params)
+    finally:
+        SQLITE_QUERY_LATENCY.observe(time.perf_counter() - start, query=query_name)
+
 def init_db():
-    if not os.path.exists(DB_PATH):
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS usage_limits (
-                    user_id TEXT,
-                    command TEXT,
-                    date TEXT,
-                    count INTEGER,
-                    PRIMARY KEY (user_id, command, date)
-                )
-            ''')
-            conn.commit()
-            
-            # Tabla para configuración de usuarios (límites)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_configs (
-                    user_id TEXT PRIMARY KEY,
-                    max_uses INTEGER
-                )
-            ''')
-            conn.commit()
-            conn.close()
-            logging.info("Base de datos de límites inicializada.")
-        except Exception as e:
-            logging.error(f"Error inicializando DB: {e}")
+    # CREATE TABLE IF NOT EXISTS es idempotente: se ejecuta siempre para que
+    # las tablas nuevas también se creen en bases de datos existentes
+    try:
+        conn = get_db_connection()
+        # WAL: lectores y un escritor a la vez, compartido entre procesos (queda guardado en el archivo)
+        conn.execute('PRAGMA journal_mode=WAL')
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS usage_limits (
+                user_id TEXT,
+                command TEXT,
+                date TEXT,
+                count INTEGER,
+                PRIMARY KEY (user_id, command, date)
+            )
+        ''')
+        conn.commit()
+        
+        # Tabla para configuración de usuarios (límites)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_configs (
+                user_id TEXT PRIMARY KEY,
+                max_uses INTEGER
+            )
+        ''')
+        conn.commit()
+
+        # Entradas de la bitácora: una fila por mensaje, con id estable.
+        # La columna C (Descripción) del Sheet se deriva de aquí.
+        # source: text | caption | voice (transcripción de audio) | hint (mensajes "IA!") | legacy (importado desde la celda C)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                date TEXT,
+                time TEXT,
+                source TEXT,
+                text TEXT,
+                deleted INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_log_entries_user_date ON log_entries (user_id, date)')
+        # Días cuya celda C ya se importó al registro local, aunque estuviera vacía (ej: solo fotos):
+        # sin esta marca un día sin entradas se volvería a leer del Sheet en cada mensaje
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_days (
+                user_id TEXT,
+                date TEXT,
+                PRIMARY KEY (user_id, date)
+            )
+        ''')
+        conn.commit()
+
+        # Sesión del día: hora del primer y último mensaje (columnas G/H) y enlace a la carpeta (D).
+        # Se mantiene aquí para no tener que leer el Sheet antes de cada escritura.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS day_sessions (
+                user_id TEXT,
+                date TEXT,
+                start_time TEXT,
+                end_time TEXT,
+                folder_link TEXT,
+                PRIMARY KEY (user_id, date)
+            )
+        ''')
+        conn.commit()
+
+        # Estado de autenticación (compartido por todos los procesos del bot)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS auth_state (
+                user_id TEXT PRIMARY KEY,
+                attempts INTEGER DEFAULT 0,
+                authenticated INTEGER DEFAULT 0,
+                updated_at REAL
+            )
+        ''')
+        conn.commit()
+
+        # Fotos subidas a la carpeta del día (DD-MM-YYYY de procesamiento), para no descargar
+        # ni subir otra vez una foto reenviada. Se busca por file_unique_id de Telegram o,
+        # si ya se descargó, por el hash SHA-256 del contenido.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS photo_uploads (
+                user_id TEXT,
+                date TEXT,
+                file_unique_id TEXT,
+                content_hash TEXT,
+                file_id TEXT,
+                file_name TEXT,
+                file_link TEXT,
+                folder_id TEXT,
+                folder_link TEXT,
+                description TEXT
+            )
+        ''')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_photo_uploads_unique_id ON photo_uploads (user_id, date, file_unique_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_photo_uploads_hash ON photo_uploads (user_id, date, content_hash)')
+        conn.commit()
+
+        # Caché persistente de utils/cache.py (tier 'sqlite'): valores JSON por caché y clave
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                cache TEXT,
+                key TEXT,
+                value TEXT,
+                size INTEGER,
+                expires_at REAL,
+                accessed_at REAL,
+                PRIMARY KEY (cache, key)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (cache, accessed_at)')
+        conn.commit()
+
+        # Último estado conocido de archivos externos (ej: versión del Sheet), para detectar
+        # cambios hechos a mano también entre reinicios y entre procesos
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at REAL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+        logging.info("Base de datos inicializada.")
+    except Exception as e:
+        logging.error(f"Error inicializando DB: {e}")
 
 def get_today_str():
     return datetime.datetime.now(ECUADOR_TZ).strftime("%Y-%m-%d")
@@ -51,7 +178,7 @@ def get_usage(user_id, command):
         conn = get_db_connection()
         cursor = conn.cursor()
         today = get_today_str()
-        cursor.execute('SELECT count FROM usage_limits WHERE user_id = ? AND command = ? AND date = ?', (str(user_id), command, today))
+        _execute(cursor, 'select_usage', 'SELECT count FROM usage_limits WHERE user_id = ? AND command = ? AND date = ?', (str(user_id), command, today))
         row = cursor.fetchone()
         conn.close()
         if row:
@@ -67,15 +194,11 @@ def increment_usage(user_id, command):
         cursor = conn.cursor()
         today = get_today_str()
         
-        # Check current usage
-        cursor.execute('SELECT count FROM usage_limits WHERE user_id = ? AND command = ? AND date = ?', (str(user_id), command, today))
-        row = cursor.fetchone()
-        
-        if row:
-            new_count = row['count'] + 1
-            cursor.execute('UPDATE usage_limits SET count = ? WHERE user_id = ? AND command = ? AND date = ?', (new_count, str(user_id), command, today))
-        else:
-            cursor.execute('INSERT INTO usage_limits (user_id, command, date, count) VALUES (?, ?, ?, 1)', (str(user_id), command, today))
+        # Un solo UPSERT: atómico aunque otro proceso incremente al mismo tiempo
+        _execute(cursor, 'upsert_usage', '''
+            INSERT INTO usage_limits (user_id, command, date, count) VALUES (?, ?, ?, 1)
+            ON CONFLICT(user_id, command, date) DO UPDATE SET count = count + 1
+        ''', (str(user_id), command, today))
             
         conn.commit()
         conn.close()
@@ -90,7 +213,7 @@ def get_user_limit(user_id, default_limit=1):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT max_uses FROM user_configs WHERE user_id = ?', (str(user_id),))
+        _execute(cursor, 'select_user_limit', 'SELECT max_uses FROM user_configs WHERE user_id = ?', (str(user_id),))
         row = cursor.fetchone()
         conn.close()
         if row:
@@ -106,7 +229,7 @@ def set_user_limit(user_id, limit):
         cursor = conn.cursor()
         # Upsert (SQLite >= 3.24 supports ON CONFLICT)
         # Using classic approach for broader compatibility:
-        cursor.execute('INSERT OR REPLACE INTO user_configs (user_id, max_uses) VALUES (?, ?)', (str(user_id), limit))
+        _execute(cursor, 'upsert_user_limit', 'INSERT OR REPLACE INTO user_configs (user_id, max_uses) VALUES (?, ?)', (str(user_id), limit))
         conn.commit()
         conn.close()
         logging.info(f"Límite actualizado para {user_id}: {limit}")
@@ -114,3 +237,496 @@ def set_user_limit(user_id, limit):
     except Exception as e:
         logging.error(f"Error estableciendo límite: {e}")
         return False
+
+# --- ENTRADAS DE LA BITÁCORA ---
+
+# Hay entradas (incluso borradas) o el día se importó vacío
+_HAS_LOG_DAY_SQL = '''
+    SELECT 1 FROM log_entries WHERE user_id = ? AND date = ?
+    UNION ALL SELECT 1 FROM log_days WHERE user_id = ? AND date = ? LIMIT 1
+'''
+
+def _has_log_day(cursor, user_id, date_str):
+    _execute(cursor, 'has_log_entries', _HAS_LOG_DAY_SQL, (str(user_id), date_str) * 2)
+    return cursor.fetchone() is not None
+
+def _mark_log_day(cursor, user_id, date_str):
+    _execute(cursor, 'mark_log_day', 'INSERT OR IGNORE INTO log_days (user_id, date) VALUES (?, ?)', (str(user_id), date_str))
+
+def mark_log_day(user_id, date_str):
+    """Marca el día como presente en el registro local (fila creada por el bot, aunque sin texto)."""
+    conn = get_db_connection()
+    try:
+        _mark_log_day(conn.cursor(), user_id, date_str)
+        conn.commit()
+    finally:
+        conn.close()
+
+def has_log_entries(user_id, date_str):
+    """
+    Indica si el día (DD-MM-YYYY) ya está en el registro local: tiene entradas (incluso borradas)
+    o su celda C se importó vacía.
+    """
+    conn = get_db_connection()
+    try:
+        return _has_log_day(conn.cursor(), user_id, date_str)
+    finally:
+        conn.close()
+
+def add_log_entry(user_id, date_str, time_str, source, text):
+    """Agrega una entrada y retorna su id."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'insert_log_entry', 'INSERT INTO log_entries (user_id, date, time, source, text) VALUES (?, ?, ?, ?, ?)',
+                 (str(user_id), date_str, time_str, source, text))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def seed_log_entries(user_id, date_str, lines, source='legacy'):
+    """
+    Importa las líneas existentes de la celda C (antes de tener ids) si el día aún no tiene entradas.
+    El día queda marcado como importado aunque C esté vacía.
+    """
+    conn = get_db_connection()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        if _has_log_day(cursor, user_id, date_str):
+            return False
+        cursor.executemany('INSERT INTO log_entries (user_id, date, time, source, text) VALUES (?, ?, ?, ?, ?)',
+                           [(str(user_id), date_str, None, source, line) for line in lines])
+        _mark_log_day(cursor, user_id, date_str)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def sync_log_entries(user_id, date_str, lines, source='sheet'):
+    """
+    Deja las entradas del día iguales a las líneas de la celda C (editada a mano en el Sheet).
+    Las líneas que ya existían conservan su hora y origen; las nuevas quedan con source.
+    Retorna True si hubo cambios.
+    """
+    conn = get_db_connection()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        _execute(cursor, 'select_log_entries', 'SELECT id, time, source, text FROM log_entries WHERE user_id = ? AND date = ? AND deleted = 0 ORDER BY id',
+                 (str(user_id), date_str))
+        current = [dict(row) for row in cursor.fetchall()]
+        if [entry['text'] for entry in current] == list(lines):
+            return False
+
+        # Se reescribe el día completo para respetar el orden de la celda
+        unused = list(current)
+        rows = []
+        for line in lines:
+            match = next((entry for entry in unused if entry['text'] == line), None)
+            if match:
+                unused.remove(match)
+                rows.append((str(user_id), date_str, match['time'], match['source'], line))
+            else:
+                rows.append((str(user_id), date_str, None, source, line))
+        _execute(cursor, 'delete_day_log_entries', 'UPDATE log_entries SET deleted = 1 WHERE user_id = ? AND date = ? AND deleted = 0',
+                 (str(user_id), date_str))
+        cursor.executemany('INSERT INTO log_entries (user_id, date, time, source, text) VALUES (?, ?, ?, ?, ?)', rows)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def import_log_entries(user_id, date_str, entries):
+    """
+    Carga de una vez las entradas [(time, source, text)] de un día importado.
+    No hace nada si el día ya tiene entradas. Retorna True si se importaron.
+    """
+    conn = get_db_connection()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        if _has_log_day(cursor, user_id, date_str):
+            return False
+        cursor.executemany('INSERT INTO log_entries (user_id, date, time, source, text) VALUES (?, ?, ?, ?, ?)',
+                           [(str(user_id), date_str, time_str, source, text) for time_str, source, text in entries])
+        _mark_log_day(cursor, user_id, date_str)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def get_log_entries(user_id, date_str):
+    """Retorna las entradas vigentes del día en orden de llegada: lista de dicts {id, time, source, text}."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'select_log_entries', 'SELECT id, time, source, text FROM log_entries WHERE user_id = ? AND date = ? AND deleted = 0 ORDER BY id',
+                 (str(user_id), date_str))
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def delete_log_entries(user_id, entry_ids):
+    """
+    Marca como borradas las entradas indicadas (solo si pertenecen al usuario).
+    Retorna el conjunto de fechas afectadas (también si ya estaban borradas, para poder reintentar la escritura).
+    """
+    if not entry_ids:
+        return set()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        placeholders = ",".join("?" for _ in entry_ids)
+        params = [str(user_id)] + [int(i) for i in entry_ids]
+        _execute(cursor, 'select_log_entry_dates', f'SELECT DISTINCT date FROM log_entries WHERE user_id = ? AND id IN ({placeholders})', params)
+        dates = {row['date'] for row in cursor.fetchall()}
+        _execute(cursor, 'delete_log_entries', f'UPDATE log_entries SET deleted = 1 WHERE user_id = ? AND deleted = 0 AND id IN ({placeholders})', params)
+        conn.commit()
+        return dates
+    finally:
+        conn.close()
+
+
+# --- SESIONES DEL DÍA ---
+
+_CLOCK_RE = re.compile(r'^(\d{1,2}):(\d{2})(?::(\d{2}))?(?:[.,]\d+)?\s*(?:([ap])\.?\s*m\.?)?$', re.IGNORECASE)
+
+def normalize_clock(value):
+    """
+    Hora de G/H como HH:MM:SS, el formato que day_sessions compara como string.
+    El Sheet devuelve '8:05:03', '08:05' o '8:05:03 p. m.' según el formato de la celda,
+    o una fracción del día si se lee sin formato. Retorna None si no es una hora.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        seconds = round(value * 86400) % 86400
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    match = _CLOCK_RE.match(str(value).strip())
+    if not match:
+        return None
+    hours, minutes, seconds = int(match.group(1)), int(match.group(2)), int(match.group(3) or 0)
+    meridiem = (match.group(4) or "").lower()
+    if meridiem == 'p' and hours < 12:
+        hours += 12
+    elif meridiem == 'a' and hours == 12:
+        hours = 0
+    if hours > 23 or minutes > 59 or seconds > 59:
+        return None
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+def get_day_session(user_id, date_str):
+    """Retorna {'start_time', 'end_time', 'folder_link'} del día o None si no hay registro local."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'select_day_session', 'SELECT start_time, end_time, folder_link FROM day_sessions WHERE user_id = ? AND date = ?', (str(user_id), date_str))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def seed_day_session(user_id, date_str, start_time, end_time, folder_link):
+    """Crea la sesión del día con los valores leídos del Sheet. No sobreescribe una sesión existente."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'seed_day_session', 'INSERT OR IGNORE INTO day_sessions (user_id, date, start_time, end_time, folder_link) VALUES (?, ?, ?, ?, ?)',
+                 (str(user_id), date_str, normalize_clock(start_time), normalize_clock(end_time), folder_link or None))
+        conn.commit()
+    finally:
+        conn.close()
+
+def sync_day_session(user_id, date_str, start_time, end_time, folder_link):
+    """Reemplaza la sesión del día con los valores del Sheet (editado a mano). Retorna True si cambió."""
+    values = (normalize_clock(start_time), normalize_clock(end_time), folder_link or None)
+    conn = get_db_connection()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        _execute(cursor, 'select_day_session', 'SELECT start_time, end_time, folder_link FROM day_sessions WHERE user_id = ? AND date = ?', (str(user_id), date_str))
+        row = cursor.fetchone()
+        if row and (row['start_time'], row['end_time'], row['folder_link']) == values:
+            return False
+        _execute(cursor, 'sync_day_session', '''
+            INSERT INTO day_sessions (user_id, date, start_time, end_time, folder_link) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, date) DO UPDATE SET start_time = excluded.start_time,
+                end_time = excluded.end_time, folder_link = excluded.folder_link
+        ''', (str(user_id), date_str) + values)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def update_day_session_times(user_id, date_str, time_str):
+    """
+    Registra un mensaje a la hora time_str (HH:MM:SS): el inicio es el mínimo y el fin el máximo,
+    aunque los mensajes lleguen desordenados.
+    Retorna solo los campos que cambiaron ({'start_time': ..., 'end_time': ...}).
+    """
+    conn = get_db_connection()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        _execute(cursor, 'select_day_session', 'SELECT start_time, end_time FROM day_sessions WHERE user_id = ? AND date = ?', (str(user_id), date_str))
+        row = cursor.fetchone()
+        # Sesiones guardadas antes de normalizar pueden tener '8:05:03'
+        start_time = normalize_clock(row['start_time']) if row else None
+        end_time = normalize_clock(row['end_time']) if row else None
+        time_str = normalize_clock(time_str) or time_str
+
+        changes = {}
+        # HH:MM:SS con ceros a la izquierda: el orden de strings es el orden cronológico
+        if not start_time or time_str < start_time:
+            changes['start_time'] = time_str
+        if not end_time or time_str > end_time:
+            changes['end_time'] = time_str
+        if not changes:
+            if row and (row['start_time'], row['end_time']) != (start_time, end_time):
+                _execute(cursor, 'normalize_day_session_times',
+                         'UPDATE day_sessions SET start_time = ?, end_time = ? WHERE user_id = ? AND date = ?',
+                         (start_time, end_time, str(user_id), date_str))
+                conn.commit()
+            return changes
+
+        _execute(cursor, 'upsert_day_session_times', '''
+            INSERT INTO day_sessions (user_id, date, start_time, end_time) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, date) DO UPDATE SET start_time = excluded.start_time, end_time = excluded.end_time
+        ''', (str(user_id), date_str, changes.get('start_time', start_time), changes.get('end_time', end_time)))
+        conn.commit()
+        return changes
+    finally:
+        conn.close()
+
+def set_day_folder_link(user_id, date_str, link):
+    """Guarda el enlace a la carpeta del día. Retorna True si cambió (hay que escribirlo en el Sheet)."""
+    conn = get_db_connection()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        _execute(cursor, 'select_day_folder_link', 'SELECT folder_link FROM day_sessions WHERE user_id = ? AND date = ?', (str(user_id), date_str))
+        row = cursor.fetchone()
+        if row and row['folder_link'] == link:
+            return False
+        _execute(cursor, 'upsert_day_folder_link', '''
+            INSERT INTO day_sessions (user_id, date, folder_link) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, date) DO UPDATE SET folder_link = excluded.folder_link
+        ''', (str(user_id), date_str, link))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+# --- AUTENTICACIÓN ---
+
+def get_auth_state(user_id):
+    """Retorna {'attempts', 'authenticated', 'updated_at'} del usuario o None."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'select_auth_state', 'SELECT attempts, authenticated, updated_at FROM auth_state WHERE user_id = ?', (str(user_id),))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {'attempts': row['attempts'], 'authenticated': bool(row['authenticated']), 'updated_at': row['updated_at']}
+    finally:
+        conn.close()
+
+def save_auth_states(states):
+    """Guarda en una sola transacción varios estados: [(user_id, attempts, authenticated, updated_at)]."""
+    if not states:
+        return
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO auth_state (user_id, attempts, authenticated, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET attempts = excluded.attempts,
+                authenticated = excluded.authenticated, updated_at = excluded.updated_at
+        ''', [(str(user_id), attempts, int(authenticated), updated_at) for user_id, attempts, authenticated, updated_at in states])
+        conn.commit()
+    finally:
+        conn.close()
+
+def reset_expired_auth_attempts(cutoff):
+    """Pone en 0 los intentos fallidos registrados antes de cutoff (timestamp). Retorna cuántos."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'reset_auth_attempts', 'UPDATE auth_state SET attempts = 0 WHERE attempts > 0 AND authenticated = 0 AND updated_at < ?', (cutoff,))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+# --- FOTOS SUBIDAS ---
+
+def find_photo_upload(user_id, date_str, file_unique_id=None, content_hash=None):
+    """
+    Foto ya subida a la carpeta del día, por file_unique_id o por hash del contenido.
+    Retorna dict {file_unique_id, content_hash, file_id, file_name, file_link, folder_id, folder_link, description} o None.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        columns = 'file_unique_id, content_hash, file_id, file_name, file_link, folder_id, folder_link, description'
+        if file_unique_id:
+            _execute(cursor, 'select_photo_by_unique_id', f'SELECT {columns} FROM photo_uploads WHERE user_id = ? AND date = ? AND file_unique_id = ?',
+                     (str(user_id), date_str, file_unique_id))
+            row = cursor.fetchone()
+            if row:
+                return dict(row)
+        if content_hash:
+            _execute(cursor, 'select_photo_by_hash', f'SELECT {columns} FROM photo_uploads WHERE user_id = ? AND date = ? AND content_hash = ? LIMIT 1',
+                     (str(user_id), date_str, content_hash))
+            row = cursor.fetchone()
+            if row:
+                return dict(row)
+        return None
+    finally:
+        conn.close()
+
+def save_photo_upload(user_id, date_str, file_unique_id, content_hash, file, folder, description=None):
+    """
+    Registra una foto subida (file y folder como los retorna Drive: id, name, webViewLink).
+    Si el file_unique_id ya estaba registrado no hace nada (file_unique_id None = solo por hash).
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'insert_photo_upload', '''
+            INSERT OR IGNORE INTO photo_uploads
+                (user_id, date, file_unique_id, content_hash, file_id, file_name, file_link, folder_id, folder_link, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (str(user_id), date_str, file_unique_id, content_hash, file.get('id'), file.get('name'), file.get('webViewLink'),
+              folder.get('id'), folder.get('webViewLink'), description))
+        conn.commit()
+    finally:
+        conn.close()
+
+def delete_photo_uploads(user_id, date_str, file_id):
+    """Olvida un archivo de Drive que ya no existe (todas sus entradas: file_unique_id y hash)."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'delete_photo_uploads', 'DELETE FROM photo_uploads WHERE user_id = ? AND date = ? AND file_id = ?',
+                 (str(user_id), date_str, file_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# --- ESTADO DE SINCRONIZACIÓN ---
+
+def get_sync_state(key):
+    """Valor guardado con set_sync_state o None."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'select_sync_state', 'SELECT value FROM sync_state WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        return row['value'] if row else None
+    finally:
+        conn.close()
+
+def set_sync_state(key, value):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'save_sync_state', '''
+            INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        ''', (key, value, time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# --- CACHÉ PERSISTENTE ---
+
+def cache_get(cache, key, now):
+    """Retorna (value, expires_at) vigente o None; marca el acceso para el orden LRU."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'select_cache_entry', 'SELECT value, expires_at FROM cache_entries WHERE cache = ? AND key = ?', (cache, key))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        if row['expires_at'] is not None and row['expires_at'] <= now:
+            _execute(cursor, 'delete_cache_entry', 'DELETE FROM cache_entries WHERE cache = ? AND key = ?', (cache, key))
+            conn.commit()
+            return None
+        _execute(cursor, 'touch_cache_entry', 'UPDATE cache_entries SET accessed_at = ? WHERE cache = ? AND key = ?', (now, cache, key))
+        conn.commit()
+        return row['value'], row['expires_at']
+    finally:
+        conn.close()
+
+def cache_set(cache, key, value, size, expires_at, now, max_entries=None, max_bytes=None):
+    """
+    Guarda el valor y, si la caché supera max_entries o max_bytes, borra los menos usados.
+    Retorna {'expired': n, 'lru': n} con las entradas borradas.
+    """
+    conn = get_db_connection()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        _execute(cursor, 'save_cache_entry', '''
+            INSERT INTO cache_entries (cache, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cache, key) DO UPDATE SET value = excluded.value, size = excluded.size,
+                expires_at = excluded.expires_at, accessed_at = excluded.accessed_at
+        ''', (cache, key, value, size, expires_at, now))
+        _execute(cursor, 'delete_expired_cache', 'DELETE FROM cache_entries WHERE cache = ? AND expires_at <= ?', (cache, now))
+        evicted = {'expired': cursor.rowcount, 'lru': 0}
+
+        _execute(cursor, 'cache_totals', 'SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM cache_entries WHERE cache = ?', (cache,))
+        totals = cursor.fetchone()
+        entries, total_bytes = totals['entries'], totals['bytes']
+        if (max_entries and entries > max_entries) or (max_bytes and total_bytes > max_bytes):
+            _execute(cursor, 'select_cache_lru', 'SELECT key, size FROM cache_entries WHERE cache = ? AND key != ? ORDER BY accessed_at',
+                     (cache, key))
+            victims = []
+            for row in cursor.fetchall():
+                if not ((max_entries and entries > max_entries) or (max_bytes and total_bytes > max_bytes)):
+                    break
+                victims.append((cache, row['key']))
+                entries -= 1
+                total_bytes -= row['size'] or 0
+            cursor.executemany('DELETE FROM cache_entries WHERE cache = ? AND key = ?', victims)
+            evicted['lru'] = len(victims)
+        conn.commit()
+        return evicted
+    finally:
+        conn.close()
+
+def cache_delete(cache, key=None, prefix=None):
+    """Borra una clave, las que empiezan con prefix, o toda la caché si no se indica ninguna. Retorna cuántas."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if key is not None:
+            _execute(cursor, 'delete_cache_entry', 'DELETE FROM cache_entries WHERE cache = ? AND key = ?', (cache, key))
+        elif prefix:
+            _execute(cursor, 'delete_cache_prefix', 'DELETE FROM cache_entries WHERE cache = ? AND substr(key, 1, ?) = ?',
+                     (cache, len(prefix), prefix))
+        else:
+            _execute(cursor, 'clear_cache', 'DELETE FROM cache_entries WHERE cache = ?', (cache,))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def cache_totals(cache):
+    """Retorna {'entries', 'bytes'} de la caché."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        _execute(cursor, 'cache_totals', 'SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM cache_entries WHERE cache = ?', (cache,))
+        row = cursor.fetchone()
+        return {'entries': row['entries'], 'bytes': row['bytes']}
+    finally:
+        conn.close()
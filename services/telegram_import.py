@@ -0,0 +1,150 @@
+"""
+Importa historiales exportados desde Telegram Desktop (JSON) a la bitácora.
+
+Sirve para estudiantes que se suman a mitad de semestre: en lugar de reenviar cada mensaje al bot,
+se exporta el chat (Exportar historial -> formato JSON, con fotos) y se carga de una vez.
+Los mensajes se agrupan por usuario y día, descripciones y tiempos se calculan en memoria,
+las fotos se suben en paralelo y el Sheet se escribe con un append por pestaña.
+
+Uso:
+    python -m services.telegram_import ruta/result.json --dry-run
+    python -m services.telegram_import ruta/result.json [--user 123456] [--workers 8]
+
+Se omiten los días que ya tienen fila en el Sheet o registro local, así que se puede repetir.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import datetime
+from zoneinfo import ZoneInfo
+
+from services import storage_service as storage
+from services.google import drive_service
+from utils import auth
+
+ECUADOR_TZ = ZoneInfo("America/Guayaquil")
+
+
+def _message_text(message):
+    """El campo text puede ser un string o una lista de fragmentos (strings o dicts con 'text')."""
+    text = message.get('text', '')
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part.get('text', '') for part in text)
+    return text.strip()
+
+
+def _message_user_id(message):
+    """from_id viene como 'user123456' (los canales usan 'channel...')."""
+    from_id = str(message.get('from_id', ''))
+    if from_id.startswith('user') and from_id[4:].isdigit():
+        return from_id[4:]
+    return None
+
+
+def _message_datetime(message):
+    # date_unixtime existe en exportaciones recientes; 'date' es hora local sin zona
+    if message.get('date_unixtime'):
+        return datetime.datetime.fromtimestamp(int(message['date_unixtime']), ECUADOR_TZ)
+    return datetime.datetime.fromisoformat(message['date']).replace(tzinfo=ECUADOR_TZ)
+
+
+def _iter_messages(export):
+    # Exportación de un chat o de la cuenta completa (chats.list)
+    if 'chats' in export:
+        for chat in export['chats'].get('list', []):
+            yield from chat.get('messages', [])
+    else:
+        yield from export.get('messages', [])
+
+
+def collect_days(export_path, bot_id=None, only_user=None):
+    """
+    Lee la exportación y agrupa por (user_id, DD-MM-YYYY).
+    Retorna (messages, photos):
+    - messages: {(user_id, fecha): [(datetime, 'text' | 'caption', texto)]}
+    - photos: {(user_id, fecha): [(ruta absoluta, caption, datetime)]}
+    Se omiten los mensajes del bot, los comandos y la contraseña de acceso.
+    """
+    base_dir = os.path.dirname(os.path.abspath(export_path))
+    with open(export_path, encoding='utf-8') as f:
+        export = json.load(f)
+
+    messages = {}
+    photos = {}
+    for message in _iter_messages(export):
+        if message.get('type') != 'message':
+            continue
+        user_id = _message_user_id(message)
+        if not user_id or user_id == bot_id or (only_user and user_id != only_user):
+            continue
+
+        text = _message_text(message)
+        if text.startswith('/') or text == auth.PASSWORD:
+            continue
+
+        moment = _message_datetime(message)
+        key = (user_id, moment.strftime("%d-%m-%Y"))
+        photo = message.get('photo')
+        if photo:
+            path = os.path.join(base_dir, photo)
+            # Exportaciones sin medios: "(File not included. Change data exporting settings to download.)"
+            if os.path.isfile(path):
+                photos.setdefault(key, []).append((path, text or None, moment))
+            else:
+                logging.warning(f"Foto no incluida en la exportación: {photo}")
+        if text:
+            messages.setdefault(key, []).append((moment, 'caption' if photo else 'text', text))
+
+    return messages, photos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa un historial JSON de Telegram a la bitácora")
+    parser.add_argument('export', help="result.json de la exportación")
+    parser.add_argument('--user', help="Importar solo este user_id")
+    parser.add_argument('--bot-id', help="Id del bot (por defecto, el de TELEGRAM_TOKEN) para omitir sus mensajes")
+    parser.add_argument('--workers', type=int, default=drive_service.IMPORT_UPLOAD_WORKERS, help="Subidas de fotos simultáneas")
+    parser.add_argument('--dry-run', action='store_true', help="Solo mostrar qué se importaría")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    bot_id = args.bot_id or (os.getenv('TELEGRAM_TOKEN') or '').split(':')[0] or None
+
+    messages, photos = collect_days(args.export, bot_id=bot_id, only_user=args.user)
+    keys = set(messages) | set(photos)
+    if not keys:
+        print("No hay mensajes para importar")
+        return 0
+
+    storage.init_db()
+    existing = drive_service.find_existing_days(list(keys))
+    skipped = sorted(existing | {key for key in keys
+                                  if storage.has_log_entries(*key) or storage.get_day_session(*key)})
+    for user_id, date_str in skipped:
+        print(f"Omitido {user_id} {date_str}: el día ya está en la bitácora")
+    keys = sorted(keys - set(skipped))
+
+    for user_id, date_str in keys:
+        print(f"{user_id} {date_str}: {len(messages.get((user_id, date_str), []))} mensajes, "
+              f"{len(photos.get((user_id, date_str), []))} fotos")
+    if args.dry_run or not keys:
+        print(f"Total: {len(keys)} días" + (" (dry-run)" if args.dry_run else ""))
+        return 0
+
+    day_photos = {key: photos[key] for key in keys if key in photos}
+    links = drive_service.upload_day_images(
+        {key: [(path, caption) for path, caption, _ in items] for key, items in day_photos.items()}, workers=args.workers)
+    written = drive_service.import_days(
+        {key: messages[key] for key in keys if key in messages}, links,
+        {key: [moment for _, _, moment in items] for key, items in day_photos.items()})
+    print(f"Importados {written} días ({sum(len(photos.get(key, [])) for key in keys)} fotos)")
+    if written < len(keys):
+        print(f"Error: {len(keys) - written} días no se pudieron escribir en el Sheet, vuelve a ejecutar la importación")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
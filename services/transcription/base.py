@@ -0,0 +1,7 @@
+from abc import ABC, abstractmethod
+
+class TranscriptionEngine(ABC):
+    @abstractmethod
+    def transcribe(self, audio_path: str, language: str = 'es') -> str:
+        """Retorna el texto del audio (ogg/opus, mp3, m4a...) en audio_path."""
+        pass
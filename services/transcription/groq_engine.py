@@ -0,0 +1,29 @@
+import os
+import requests
+from .base import TranscriptionEngine
+from utils.bot_proxy import APIKeyMissingError, AIServiceError
+
+class GroqWhisperEngine(TranscriptionEngine):
+    """Whisper en la API de Groq: no usa CPU local, pero necesita conexión y GROQ_API_KEY."""
+
+    def transcribe(self, audio_path: str, language: str = 'es') -> str:
+        api_key = os.getenv('GROQ_API_KEY')
+        if not api_key:
+            raise APIKeyMissingError("GROQ_API_KEY no encontrada")
+
+        url = "https://api.groq.com/openai/v1/audio/transcriptions"
+        headers = {"Authorization": f"Bearer {api_key}"}
+        data = {"model": "whisper-large-v3-turbo", "language": language}
+
+        try:
+            with open(audio_path, 'rb') as f:
+                response = requests.post(url, headers=headers, data=data,
+                                         files={"file": (os.path.basename(audio_path), f)}, timeout=120)
+            if response.status_code == 200:
+                return response.json()['text'].strip()
+            else:
+                raise AIServiceError(f"Error Groq API: {response.text}")
+        except Exception as e:
+            if isinstance(e, AIServiceError):
+                raise
+            raise AIServiceError(f"Error conectando con Groq: {str(e)}")
@@ -0,0 +1,250 @@
+"""
+Cola de transcripciones de notas de voz y audios.
+
+Los handlers descargan el audio y lo encolan con submit(); el motor corre en un
+pool de procesos (TRANSCRIPTION_WORKERS a la vez), así un audio largo no ocupa
+el event loop ni el GIL del proceso del bot. Si hay más de TRANSCRIPTION_MAX_PENDING
+esperando, submit() rechaza el audio en lugar de acumular trabajo sin límite.
+
+Los audios de un mismo usuario se transcriben y registran de a uno y en orden de
+llegada (on_done termina antes de empezar el siguiente), así la bitácora conserva
+el orden. Mientras un usuario tiene un audio en proceso, se atiende a los demás.
+
+TRANSCRIPTION_ENGINE:
+- 'whisper' (por defecto): faster-whisper local en CPU, funciona sin conexión.
+- 'groq': Whisper en la API de Groq.
+"""
+import os
+import time
+import asyncio
+import logging
+import itertools
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .base import TranscriptionEngine
+from utils import metrics
+
+TRANSCRIPTION_ENGINE = os.getenv('TRANSCRIPTION_ENGINE', 'whisper').lower()
+# Transcripciones simultáneas (= procesos del pool; cada uno carga su propio modelo)
+TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', '1'))
+# Audios que pueden esperar turno antes de rechazar nuevos
+TRANSCRIPTION_MAX_PENDING = int(os.getenv('TRANSCRIPTION_MAX_PENDING', '50'))
+TRANSCRIPTION_LANGUAGE = os.getenv('TRANSCRIPTION_LANGUAGE', 'es')
+
+TRANSCRIPTION_LATENCY = metrics.histogram(
+    'transcription_duration_seconds', 'Tiempo de transcripción de un audio por motor', ('engine',),
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+TRANSCRIPTION_QUEUE_WAIT = metrics.histogram(
+    'transcription_queue_wait_seconds', 'Tiempo entre que se encola un audio y empieza a transcribirse',
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+TRANSCRIPTION_JOBS = metrics.counter(
+    'transcription_jobs_total', 'Audios encolados por resultado', ('status',))
+
+
+class TranscriptionQueueFull(Exception):
+    """Excepción para cuando hay demasiados audios esperando."""
+    pass
+
+
+class TranscriptionCancelled(Exception):
+    """El bot se detuvo antes de terminar el audio (on_done la recibe como error)."""
+    pass
+
+
+def build_engine(name=TRANSCRIPTION_ENGINE) -> TranscriptionEngine:
+    if name == 'groq':
+        from .groq_engine import GroqWhisperEngine
+        return GroqWhisperEngine()
+    else:
+        from .whisper_engine import FasterWhisperEngine
+        return FasterWhisperEngine()
+
+
+# Motor de cada proceso del pool (se crea una vez, al arrancar el proceso)
+_engine = None
+
+def _init_worker(engine_name):
+    global _engine
+    _engine = build_engine(engine_name)
+
+def _transcribe(audio_path, language):
+    """Corre en el proceso del pool. Retorna (texto, segundos)."""
+    start = time.perf_counter()
+    text = _engine.transcribe(audio_path, language=language)
+    return text, time.perf_counter() - start
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class _Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id, audio_path, on_done, language):
+        self.id = next(self._ids)
+        self.user_id = user_id
+        self.audio_path = audio_path
+        self.on_done = on_done
+        self.language = language
+        self.queued_at = time.perf_counter()
+        # Ya se transcribió y on_done lo está registrando
+        self.recording = False
+
+
+class TranscriptionQueue:
+    """
+    Cola en el event loop del bot delante de un ProcessPoolExecutor.
+    submit() retorna cuántos audios hay delante (None = empieza ahora);
+    el resultado llega a on_done(text, error) cuando termina.
+    """
+
+    def __init__(self, workers=TRANSCRIPTION_WORKERS, max_pending=TRANSCRIPTION_MAX_PENDING, engine=TRANSCRIPTION_ENGINE):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.engine = engine
+        self._pool = None
+        self._waiting = collections.deque()
+        self._busy_users = set()
+        self._running = 0
+        # task -> job en curso
+        self._tasks = {}
+
+    def _get_pool(self):
+        # El pool (y el modelo en cada proceso) se crea con el primer audio
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(self.engine,))
+        return self._pool
+
+    @property
+    def pending(self):
+        return len(self._waiting)
+
+    @property
+    def running(self):
+        return self._running
+
+    def position(self, job_id):
+        """Audios delante del indicado (None si ya empezó o terminó)."""
+        for index, job in enumerate(self._waiting):
+            if job.id == job_id:
+                return index
+        return None
+
+    def submit(self, user_id, audio_path, on_done, language=TRANSCRIPTION_LANGUAGE):
+        """
+        Encola el audio. on_done: corrutina on_done(text, error) que recibe el texto
+        (o la excepción) y registra el resultado. Lanza TranscriptionQueueFull si no hay lugar.
+        La cola se encarga del archivo: lo borra al terminar.
+        """
+        if len(self._waiting) >= self.max_pending:
+            TRANSCRIPTION_JOBS.inc(status='rejected')
+            raise TranscriptionQueueFull(f"{len(self._waiting)} audios en espera")
+
+        job = _Job(user_id, audio_path, on_done, language)
+        self._waiting.append(job)
+        TRANSCRIPTION_JOBS.inc(status='queued')
+        self._dispatch()
+        return self.position(job.id)
+
+    def _dispatch(self):
+        """Arranca audios mientras haya procesos libres, saltando a los usuarios que ya tienen uno en curso."""
+        while self._running < self.workers:
+            job = next((job for job in self._waiting if job.user_id not in self._busy_users), None)
+            if job is None:
+                return
+            self._waiting.remove(job)
+            self._busy_users.add(job.user_id)
+            self._running += 1
+            task = asyncio.get_running_loop().create_task(self._run(job))
+            self._tasks[task] = job
+            task.add_done_callback(lambda done: self._tasks.pop(done, None))
+
+    async def _run(self, job):
+        TRANSCRIPTION_QUEUE_WAIT.observe(time.perf_counter() - job.queued_at)
+        text, error = None, None
+        try:
+            try:
+                text, elapsed = await asyncio.get_running_loop().run_in_executor(
+                    self._get_pool(), _transcribe, job.audio_path, job.language)
+                TRANSCRIPTION_LATENCY.observe(elapsed, engine=self.engine)
+                TRANSCRIPTION_JOBS.inc(status='ok')
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # Un proceso murió (o el motor no pudo cargarse): el próximo audio crea un pool nuevo
+                    self._pool = None
+                logging.error(f"Error transcribiendo audio de {job.user_id}: {e}")
+                TRANSCRIPTION_JOBS.inc(status='error')
+                error = e
+            finally:
+                # El proceso queda libre apenas termina la transcripción
+                self._running -= 1
+                self._dispatch()
+
+            job.recording = True
+            try:
+                await job.on_done(text, error)
+            except Exception as e:
+                logging.error(f"Error registrando la transcripción de {job.user_id}: {e}")
+        finally:
+            _remove_file(job.audio_path)
+            # El siguiente audio del usuario empieza cuando este ya está en la bitácora
+            self._busy_users.discard(job.user_id)
+            self._dispatch()
+
+    async def stop(self, timeout=None):
+        """
+        Termina los audios en curso y los que esperan turno, hasta timeout segundos en total,
+        y cierra el pool. A los que no alcanzan a transcribirse se les llama on_done(None, TranscriptionCancelled)
+        para que el usuario sepa que tiene que reenviarlos (Telegram ya no los vuelve a mandar).
+        Los que ya están en on_done se esperan sin cancelar: su escritura al Sheet sigue en su
+        hilo aunque se cancele la tarea, y avisar que lo reenvíe duplicaría la entrada.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._waiting or self._tasks:
+            if not self._tasks:
+                self._dispatch()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            await asyncio.wait(list(self._tasks), timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+        # Primero vaciar la espera: al cancelar, _run no debe arrancar otro audio
+        unfinished = list(self._waiting)
+        self._waiting.clear()
+        running = dict(self._tasks)
+        transcribing = {task: job for task, job in running.items() if not job.recording}
+        for task in transcribing:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        unfinished += transcribing.values()
+
+        for job in unfinished:
+            TRANSCRIPTION_JOBS.inc(status='dropped')
+            try:
+                await job.on_done(None, TranscriptionCancelled("el bot se reinició antes de terminarlo, vuelve a enviarlo"))
+            except Exception as e:
+                logging.error(f"Error avisando el audio no transcrito de {job.user_id}: {e}")
+            finally:
+                _remove_file(job.audio_path)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_queue = None
+
+def get_queue() -> TranscriptionQueue:
+    global _queue
+    if _queue is None:
+        _queue = TranscriptionQueue()
+    return _queue
@@ -0,0 +1,28 @@
+import os
+from .base import TranscriptionEngine
+from utils.bot_proxy import AIServiceError
+
+# tiny | base | small | medium | large-v3 (más grande = más preciso y más lento)
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'small')
+# int8 es lo más rápido en CPU sin perder mucha precisión
+WHISPER_COMPUTE_TYPE = os.getenv('WHISPER_COMPUTE_TYPE', 'int8')
+# Hilos por transcripción; 0 = los que decida CTranslate2
+WHISPER_CPU_THREADS = int(os.getenv('WHISPER_CPU_THREADS', '0'))
+
+class FasterWhisperEngine(TranscriptionEngine):
+    """
+    Whisper local en CPU (faster-whisper). El modelo se descarga la primera vez
+    y después funciona sin conexión. Cargarlo toma unos segundos: crear uno por proceso.
+    """
+
+    def __init__(self, model_size=WHISPER_MODEL, compute_type=WHISPER_COMPUTE_TYPE, cpu_threads=WHISPER_CPU_THREADS):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise AIServiceError("faster-whisper no está instalado (pip install faster-whisper)")
+        self._model = WhisperModel(model_size, device='cpu', compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, audio_path: str, language: str = 'es') -> str:
+        # beam_size=1 (greedy) es bastante más rápido en CPU; el filtro VAD salta los silencios
+        segments, _ = self._model.transcribe(audio_path, language=language, beam_size=1, vad_filter=True)
+        return " ".join(segment.text.strip() for segment in segments).strip()
@@ -1,20 +1,123 @@
+import os
+import time
+import atexit
+import logging
+import threading
 
-# State in memory to track authentication
-# Structure: { user_id: {'attempts': 0, 'authenticated': False} }
+from services import storage_service as storage
+
+# Authentication state is persisted in SQLite (auth_state table) so it survives restarts
+# (e.g. every cron_bot.py run). Reads go through an in-process cache, so after the first
+# lookup of a user is_authenticated / is_blocked are plain dict lookups. Updates are
+# collected and written in batches, by a background thread, at most AUTH_FLUSH_INTERVAL
+# seconds after they happen (or sooner when AUTH_FLUSH_BATCH are pending).
+# With several worker processes each user is always routed to the same one,
+# so the per-process cache never goes stale.
+# Structure: { user_id: {'attempts': 0, 'authenticated': False, 'updated_at': 0.0} }
+# Every read-modify-write of _auth_state and _dirty happens under _lock.
 _auth_state = {}
+_dirty = set()
+_lock = threading.Lock()
+_last_purge = 0.0
+# Background thread that writes pending updates every AUTH_FLUSH_INTERVAL
+_flusher = None
+_flush_now = threading.Event()
 
 PASSWORD = "ValorP"
 MAX_ATTEMPTS = 10
 
+# Pending updates are written when there are this many, or when the oldest one is this old
+AUTH_FLUSH_BATCH = int(os.getenv('AUTH_FLUSH_BATCH', '20'))
+AUTH_FLUSH_INTERVAL = float(os.getenv('AUTH_FLUSH_INTERVAL', '5'))
+# Failed attempts are forgotten after this many seconds without a new attempt
+AUTH_ATTEMPTS_TTL = int(os.getenv('AUTH_ATTEMPTS_TTL', str(24 * 3600)))
+# How often expired counters are also reset on disk
+AUTH_PURGE_INTERVAL = 3600
+
+def _ensure_flusher():
+    """Starts the flush thread on first use (once per process; worker processes start their own)."""
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='auth-flush', daemon=True)
+            _flusher.start()
+
+def _flush_loop():
+    # Wakes up every AUTH_FLUSH_INTERVAL, or earlier when a batch is full
+    while True:
+        _flush_now.wait(AUTH_FLUSH_INTERVAL)
+        _flush_now.clear()
+        flush()
+
+def _expired(state):
+    return state['attempts'] and not state['authenticated'] and time.time() - state['updated_at'] > AUTH_ATTEMPTS_TTL
+
+def _get_state(user_id):
+    """Cached state for the user, loaded from disk on first use."""
+    _ensure_flusher()
+    with _lock:
+        state = _auth_state.get(user_id)
+    if state is None:
+        stored = storage.get_auth_state(user_id)
+        loaded = {
+            'attempts': stored['attempts'] if stored else 0,
+            'authenticated': stored['authenticated'] if stored else False,
+            'updated_at': (stored['updated_at'] or 0.0) if stored else 0.0
+        }
+        with _lock:
+            # Another thread may have loaded (and changed) it meanwhile: keep that one
+            state = _auth_state.setdefault(user_id, loaded)
+
+    # Expired counters are reset on read; the purge fixes them on disk later
+    with _lock:
+        if _expired(state):
+            state['attempts'] = 0
+    return state
+
+def _mark_dirty(user_id):
+    """Must be called with _lock held. Returns True when the batch is full."""
+    _auth_state[user_id]['updated_at'] = time.time()
+    _dirty.add(user_id)
+    return len(_dirty) >= AUTH_FLUSH_BATCH
+
+def flush():
+    """Writes pending updates to disk in one transaction (and purges expired counters when due)."""
+    global _last_purge
+    with _lock:
+        pending = [(user_id, _auth_state[user_id]['attempts'], _auth_state[user_id]['authenticated'],
+                    _auth_state[user_id]['updated_at']) for user_id in _dirty]
+        _dirty.clear()
+        purge = time.monotonic() - _last_purge >= AUTH_PURGE_INTERVAL
+        if purge:
+            _last_purge = time.monotonic()
+            for state in _auth_state.values():
+                if _expired(state):
+                    state['attempts'] = 0
+    if not pending and not purge:
+        return
+
+    try:
+        if pending:
+            storage.save_auth_states(pending)
+        if purge:
+            storage.reset_expired_auth_attempts(time.time() - AUTH_ATTEMPTS_TTL)
+    except Exception as e:
+        # Keep them pending for the next flush
+        logging.error(f"Error saving auth state: {e}")
+        with _lock:
+            _dirty.update(user_id for user_id, _, _, _ in pending)
+
+atexit.register(flush)
+
 def is_authenticated(user_id: int) -> bool:
     """Checks if a user is authenticated."""
-    state = _auth_state.get(user_id)
-    return state is not None and state.get('authenticated', False)
+    return _get_state(user_id)['authenticated']
 
 def get_attempts(user_id: int) -> int:
     """Gets the number of failed attempts for a user."""
-    state = _auth_state.get(user_id, {})
-    return state.get('attempts', 0)
+    return _get_state(user_id)['attempts']
 
 def register_attempt(user_id: int, text: str) -> bool:
     """
@@ -22,21 +125,23 @@ def register_attempt(user_id: int, text: str) -> bool:
     Returns True if authentication was successful (password matches).
     Returns False otherwise (increments attempt counter).
     """
-    if user_id not in _auth_state:
-        _auth_state[user_id] = {'attempts': 0, 'authenticated': False}
-    
-    state = _auth_state[user_id]
-    
-    # If already authenticated, nothing to do (shouldn't be reached ideally)
-    if state['authenticated']:
-        return True
-
-    if text and text.strip() == PASSWORD:
-        state['authenticated'] = True
-        return True
-    
-    state['attempts'] += 1
-    return False
+    state = _get_state(user_id)
+
+    with _lock:
+        # If already authenticated, nothing to do (shouldn't be reached ideally)
+        if state['authenticated']:
+            return True
+
+        success = bool(text and text.strip() == PASSWORD)
+        if success:
+            state['authenticated'] = True
+        else:
+            state['attempts'] += 1
+        batch_full = _mark_dirty(user_id)
+
+    if batch_full:
+        _flush_now.set()
+    return success
 
 def is_blocked(user_id: int) -> bool:
     """Checks if the user has exceeded the max attempts."""
@@ -1,9 +1,13 @@
 import logging
 import functools
+import time
+import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from services.storage_service import get_usage, increment_usage, init_db, get_user_limit, set_user_limit
+from utils import metrics, tracing
+from utils.memory_profile import profiler
 
 # Inicializar DB al importar
 init_db()
@@ -20,9 +24,19 @@ class AIServiceError(Exception):
     """Excepción para cuando falla el servicio de IA."""
     pass
 
+HANDLER_LATENCY = metrics.histogram(
+    'telegram_handler_duration_seconds', 'Latencia de cada handler del bot', ('handler',))
+HANDLER_ERRORS = metrics.counter(
+    'telegram_handler_errors_total', 'Excepciones no controladas por handler', ('handler', 'error'))
+UPDATE_LAG = metrics.histogram(
+    'telegram_update_lag_seconds', 'Tiempo entre el envío del mensaje y el inicio de su procesamiento', ('handler',),
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 21600, 86400))
+
 # Constantes para "Paywall"
 MAGIC_WORD = "YuriCalvo"
 MAX_FREE_USES_PER_COMMAND = 1
+# Un comando limitado que retorna esto no gasta cupo (ej: /send que devuelve el resumen ya generado)
+QUOTA_NOT_USED = "quota_not_used"
 
 def check_quota(user_id: int, command: str) -> bool:
     """Verifica si el usuario tiene cupo para el comando específico."""
@@ -69,7 +83,7 @@ class BotOperationProxy:
             result = await func(update, context, *args, **kwargs)
             
             # Si tuvo éxito y era un comando limitado, incrementar uso
-            if command_name in LIMITED_COMMANDS:
+            if command_name in LIMITED_COMMANDS and result != QUOTA_NOT_USED:
                 increment_usage(user_id, command_name)
                 
             return result
@@ -99,3 +113,33 @@ def safe_command(func):
              pass
         return await BotOperationProxy.execute(update, context, func, *args, **kwargs)
     return wrapper
+
+def track_handler(func):
+    """
+    Decorador que mide la latencia de un handler y el retraso de la update en la cola, y abre su traza.
+    Con MEMORY_PROFILE activo también registra su pico de memoria.
+    """
+    handler_name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        message = update.effective_message if update else None
+        # En callbacks la fecha es la del mensaje original, no la del click
+        if message and message.date and not update.callback_query:
+            lag = (datetime.datetime.now(datetime.timezone.utc) - message.date).total_seconds()
+            UPDATE_LAG.observe(max(lag, 0), handler=handler_name)
+
+        user_id = update.effective_user.id if update and update.effective_user else None
+        start = time.perf_counter()
+        start_bytes = profiler.handler_started()
+        try:
+            # Cada update inicia su propia traza; los spans de Drive/Sheets/IA cuelgan de ella
+            with tracing.span(handler_name, new_trace=True, user_id=user_id, update_id=getattr(update, 'update_id', None)):
+                return await func(update, context, *args, **kwargs)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=handler_name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=handler_name)
+            profiler.handler_finished(handler_name, start_bytes)
+    return wrapper
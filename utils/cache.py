@@ -0,0 +1,363 @@
+"""
+Cachés del proceso con límite de tamaño, vencimiento y estadísticas.
+
+- memory(name, ...): en memoria (LRU). Sirve para cualquier valor (credenciales, ids, objetos).
+- sqlite(name, ...): en bot_data.db, compartida entre procesos y reinicios. Valores JSON.
+
+Ambas aceptan ttl (segundos), max_entries y max_bytes (tamaño estimado de los valores):
+al pasarse del límite se descartan las menos usadas. get_or_load(key, loader) hace una sola
+carga por clave aunque la pidan varios hilos a la vez (aget_or_load, lo mismo para corrutinas);
+si la clave se invalida mientras se carga, el resultado se entrega pero no se guarda.
+
+Las claves son strings; invalidate_prefix(f"{user_id}:") borra todas las de un usuario si
+las claves empiezan así. Cada caché cuenta aciertos, fallos y descartes en las métricas
+cache_requests_total / cache_evictions_total, y stats() los resume con el hit rate.
+
+Uso:
+    _folders = cache.memory('drive_folders', ttl=600, max_entries=5000)
+    folder = _folders.get_or_load(f"{parent_id}/{name}", lambda: buscar_o_crear(...))
+"""
+import sys
+import json
+import time
+import pickle
+import asyncio
+import logging
+import threading
+import collections
+from abc import ABC, abstractmethod
+
+from utils import metrics
+
+CACHE_REQUESTS = metrics.counter(
+    'cache_requests_total', 'Consultas a cada caché por resultado (hit/miss)', ('cache', 'result'))
+CACHE_EVICTIONS = metrics.counter(
+    'cache_evictions_total', 'Entradas descartadas por caché y motivo (lru, expired, invalidated)', ('cache', 'reason'))
+
+_MISSING = object()
+
+_lock = threading.Lock()
+_registry = {}
+
+
+def _estimate_size(value):
+    """Tamaño aproximado en bytes (solo se calcula si la caché tiene max_bytes)."""
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class _Flight:
+    """Una carga en curso: los demás hilos esperan su resultado."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class BaseCache(ABC):
+    def __init__(self, name, ttl=None, max_entries=None, max_bytes=None, sizeof=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or _estimate_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._flights = {}
+        self._async_flights = {}
+        self._flights_lock = threading.Lock()
+        # Sube con cada invalidación: una carga que empezó antes no guarda su resultado
+        self._generation = 0
+
+    # --- A implementar por cada tier ---
+
+    @abstractmethod
+    def _get(self, key):
+        """Valor vigente o _MISSING."""
+        pass
+
+    @abstractmethod
+    def _set(self, key, value, ttl):
+        pass
+
+    @abstractmethod
+    def _delete(self, key=None, prefix=None):
+        """Borra key, las que empiezan con prefix, o todo. Retorna cuántas."""
+        pass
+
+    @abstractmethod
+    def _totals(self):
+        pass
+
+    # --- Interfaz común ---
+
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result='hit' if hit else 'miss')
+
+    def _evicted(self, reason, count=1):
+        if count:
+            self.evictions += count
+            CACHE_EVICTIONS.inc(count, cache=self.name, reason=reason)
+
+    def _expires_at(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def get(self, key, default=None):
+        value = self._get(key)
+        self._record(value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        # Sin contar como consulta: para cachés usadas como conjuntos de claves verificadas
+        return self._get(key) is not _MISSING
+
+    def set(self, key, value, ttl=None):
+        """ttl (segundos) reemplaza al de la caché para esta entrada."""
+        self._set(key, value, ttl)
+
+    def add(self, key):
+        """Marca la clave como presente (cachés usadas como conjuntos)."""
+        self._set(key, True, None)
+
+    def invalidate(self, key):
+        self._generation += 1
+        self._evicted('invalidated', self._delete(key=key))
+
+    def invalidate_prefix(self, prefix):
+        """Borra todas las claves que empiezan con prefix (ej: f"{user_id}:")."""
+        self._generation += 1
+        self._evicted('invalidated', self._delete(prefix=prefix))
+
+    def clear(self):
+        self._generation += 1
+        self._evicted('invalidated', self._delete())
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Valor cacheado o el que retorna loader() (y se guarda). Si otro hilo ya está
+        cargando la misma clave, espera su resultado en lugar de llamar a loader otra vez.
+        Las excepciones de loader llegan a todos los que esperaban y no se guardan.
+        """
+        value = self._get(key)
+        if value is not _MISSING:
+            self._record(True)
+            return value
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._record(True)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        self._record(False)
+        generation = self._generation
+        try:
+            flight.value = loader()
+            if generation == self._generation:
+                self._set(key, flight.value, ttl)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    async def aget_or_load(self, key, loader, ttl=None):
+        """Como get_or_load, con loader una función que retorna una corrutina (para el event loop)."""
+        value = self._get(key)
+        if value is not _MISSING:
+            self._record(True)
+            return value
+
+        future = self._async_flights.get(key)
+        if future is not None:
+            self._record(True)
+            return await asyncio.shield(future)
+
+        self._record(False)
+        future = asyncio.get_running_loop().create_future()
+        self._async_flights[key] = future
+        generation = self._generation
+        try:
+            value = await loader()
+            if generation == self._generation:
+                self._set(key, value, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Que no quede "exception was never retrieved" si nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            self._async_flights.pop(key, None)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return dict(self._totals(), cache=self.name, hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, hit_rate=round(self.hits / requests, 4) if requests else None)
+
+
+class MemoryCache(BaseCache):
+    """LRU en memoria del proceso, thread-safe."""
+
+    def __init__(self, name, ttl=None, max_entries=1000, max_bytes=None, sizeof=None):
+        super().__init__(name, ttl, max_entries, max_bytes, sizeof)
+        # key -> (value, expires_at, size), del menos al más usado
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at, size = entry
+            if expires_at is None or expires_at > time.time():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+            self._bytes -= size
+        self._evicted('expired')
+        return _MISSING
+
+    def _set(self, key, value, ttl):
+        size = self.sizeof(value) if self.max_bytes else 0
+        lru = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (value, self._expires_at(ttl), size)
+            self._bytes += size
+            while len(self._entries) > 1 and (
+                    (self.max_entries and len(self._entries) > self.max_entries)
+                    or (self.max_bytes and self._bytes > self.max_bytes)):
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                lru += 1
+        self._evicted('lru', lru)
+
+    def _delete(self, key=None, prefix=None):
+        with self._lock:
+            if key is not None:
+                keys = [key] if key in self._entries else []
+            elif prefix:
+                keys = [k for k in self._entries if isinstance(k, str) and k.startswith(prefix)]
+            else:
+                keys = list(self._entries)
+            for k in keys:
+                self._bytes -= self._entries.pop(k)[2]
+            return len(keys)
+
+    def _totals(self):
+        with self._lock:
+            return {'tier': 'memory', 'entries': len(self._entries), 'bytes': self._bytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Caché en bot_data.db (tabla cache_entries), compartida por los procesos del bot.
+    Los valores se guardan como JSON: deben ser str, números, listas o dicts.
+    Los errores de la base de datos no se propagan: la caché se comporta como vacía.
+    """
+
+    def __init__(self, name, ttl=None, max_entries=10000, max_bytes=None):
+        super().__init__(name, ttl, max_entries, max_bytes, sizeof=len)
+
+    def _get(self, key):
+        from services import storage_service as storage
+        try:
+            row = storage.cache_get(self.name, key, time.time())
+        except Exception as e:
+            logging.warning(f"Caché {self.name}: error leyendo {key}: {e}")
+            return _MISSING
+        return _MISSING if row is None else json.loads(row[0])
+
+    def _set(self, key, value, ttl):
+        from services import storage_service as storage
+        data = json.dumps(value, ensure_ascii=False)
+        try:
+            evicted = storage.cache_set(self.name, key, data, len(data), self._expires_at(ttl), time.time(),
+                                        self.max_entries, self.max_bytes)
+        except Exception as e:
+            logging.warning(f"Caché {self.name}: error guardando {key}: {e}")
+            return
+        self._evicted('expired', evicted['expired'])
+        self._evicted('lru', evicted['lru'])
+
+    def _delete(self, key=None, prefix=None):
+        from services import storage_service as storage
+        try:
+            return storage.cache_delete(self.name, key=key, prefix=prefix)
+        except Exception as e:
+            logging.warning(f"Caché {self.name}: error invalidando: {e}")
+            return 0
+
+    def _totals(self):
+        from services import storage_service as storage
+        try:
+            return dict(storage.cache_totals(self.name), tier='sqlite')
+        except Exception:
+            return {'tier': 'sqlite', 'entries': None, 'bytes': None}
+
+
+def _get_or_create(cls, name, **kwargs):
+    with _lock:
+        instance = _registry.get(name)
+        if instance is None:
+            instance = cls(name, **kwargs)
+            _registry[name] = instance
+        return instance
+
+
+def memory(name, ttl=None, max_entries=1000, max_bytes=None, sizeof=None):
+    """Obtiene (o registra) una caché en memoria."""
+    return _get_or_create(MemoryCache, name, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes, sizeof=sizeof)
+
+
+def sqlite(name, ttl=None, max_entries=10000, max_bytes=None):
+    """Obtiene (o registra) una caché en bot_data.db."""
+    return _get_or_create(SQLiteCache, name, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes)
+
+
+def stats():
+    """Estadísticas de todas las cachés registradas: {nombre: stats()}."""
+    with _lock:
+        caches = list(_registry.values())
+    return {c.name: c.stats() for c in caches}
+
+
+def reset():
+    """Vacía todas las cachés y sus contadores (usado por los benchmarks entre escenarios)."""
+    with _lock:
+        caches = list(_registry.values())
+    for c in caches:
+        c.clear()
+        c.hits = c.misses = c.evictions = 0
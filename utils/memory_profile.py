@@ -0,0 +1,210 @@
+"""
+Diagnóstico de memoria para procesos que corren por días (webhook, procesos de trabajo).
+
+Se activa con MEMORY_PROFILE=1 (tiene costo: tracemalloc registra cada asignación):
+- Cada MEMORY_PROFILE_INTERVAL segundos toma un snapshot de tracemalloc y registra en el
+  log las líneas que más crecieron desde el anterior.
+- track_handler mide el pico de memoria de cada handler (handler_memory_peak_bytes).
+  Es el pico del proceso mientras corría el handler, así que si hay otros en paralelo
+  es una cota superior.
+- report() arma el resumen: memoria trazada y RSS, las líneas que más memoria ocupan,
+  las que más crecieron desde el snapshot anterior y desde el arranque, y el pico por handler.
+  webhook_server lo expone en GET /admin/memory (ver ADMIN_TOKEN).
+
+MEMORY_PROFILE_FRAMES > 1 agrupa por traceback en lugar de por línea (más memoria y CPU).
+Con WORKER_PROCESSES > 1 cada proceso de trabajo perfila por su cuenta y deja su resumen
+en el log; el endpoint muestra el proceso del webhook.
+"""
+import os
+import time
+import logging
+import threading
+import tracemalloc
+
+from utils import metrics
+
+MEMORY_PROFILE = os.getenv('MEMORY_PROFILE', '0').lower() in ('1', 'true', 'yes')
+MEMORY_PROFILE_INTERVAL = float(os.getenv('MEMORY_PROFILE_INTERVAL', '300'))
+MEMORY_PROFILE_FRAMES = int(os.getenv('MEMORY_PROFILE_FRAMES', '1'))
+# Líneas que se muestran en cada lista del reporte
+MEMORY_PROFILE_TOP = int(os.getenv('MEMORY_PROFILE_TOP', '15'))
+
+HANDLER_MEMORY_PEAK = metrics.histogram(
+    'handler_memory_peak_bytes', 'Pico de memoria trazada (sobre la del inicio) mientras corre cada handler', ('handler',),
+    buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6, 1e9))
+MEMORY_TRACED = metrics.histogram(
+    'memory_traced_bytes', 'Memoria trazada por tracemalloc en cada snapshot periódico',
+    buckets=(16e6, 32e6, 64e6, 128e6, 256e6, 512e6, 1e9, 2e9, 4e9))
+
+# Asignaciones del propio perfilado que no interesan en el reporte
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _rss_bytes():
+    """RSS actual del proceso (Linux) o None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _stat_dict(stat):
+    frame = stat.traceback[0]
+    item = {'location': f"{frame.filename}:{frame.lineno}", 'size_bytes': stat.size, 'count': stat.count}
+    if len(stat.traceback) > 1:
+        item['traceback'] = [f"{f.filename}:{f.lineno}" for f in stat.traceback]
+    return item
+
+
+def _diff_dict(stat):
+    item = _stat_dict(stat)
+    item['size_diff_bytes'] = stat.size_diff
+    item['count_diff'] = stat.count_diff
+    return item
+
+
+class MemoryProfiler:
+    def __init__(self, interval=MEMORY_PROFILE_INTERVAL, frames=MEMORY_PROFILE_FRAMES, top=MEMORY_PROFILE_TOP):
+        self.interval = interval
+        self.frames = max(1, frames)
+        self.top = top
+        self.key_type = 'traceback' if self.frames > 1 else 'lineno'
+        self.started_at = None
+        self.snapshots = 0
+        self._baseline = None
+        self._previous = None
+        self._last = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # handler -> {'calls', 'max_peak_bytes', 'last_peak_bytes'}
+        self._handlers = {}
+        self._active = 0
+
+    @property
+    def running(self):
+        return self.started_at is not None
+
+    def start(self):
+        if self.running:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.started_at = time.time()
+        self._baseline = self._take()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='memory-profile', daemon=True)
+        self._thread.start()
+        logging.info(f"Perfil de memoria activo (snapshot cada {self.interval:.0f}s, {self.frames} frame(s))")
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.log_summary()
+        tracemalloc.stop()
+        self.started_at = None
+
+    def _take(self):
+        return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.snapshot()
+                self.log_summary()
+            except Exception as e:
+                logging.error(f"Error tomando snapshot de memoria: {e}")
+
+    def snapshot(self):
+        """Toma un snapshot ahora; el anterior queda para comparar."""
+        snapshot = self._take()
+        with self._lock:
+            self._previous, self._last = self._last or self._baseline, snapshot
+            self.snapshots += 1
+        MEMORY_TRACED.observe(tracemalloc.get_traced_memory()[0])
+        return snapshot
+
+    def log_summary(self, limit=5):
+        with self._lock:
+            previous, last = self._previous, self._last
+        if previous is None or last is None:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"  {d['location']}: {d['size_diff_bytes'] / 1e6:+.2f} MB ({d['size_bytes'] / 1e6:.2f} MB, {d['count']} bloques)"
+                 for d in map(_diff_dict, last.compare_to(previous, self.key_type)[:limit])]
+        logging.info(f"Memoria trazada {current / 1e6:.1f} MB (pico {peak / 1e6:.1f} MB), mayor crecimiento:\n" + "\n".join(lines))
+
+    # --- Pico por handler ---
+
+    def handler_started(self):
+        """Retorna la memoria trazada al empezar (o None si no se perfila)."""
+        if not self.running:
+            return None
+        with self._lock:
+            # El pico se reinicia solo si no hay otro handler en curso, para no perder el suyo
+            if self._active == 0:
+                tracemalloc.reset_peak()
+            self._active += 1
+        return tracemalloc.get_traced_memory()[0]
+
+    def handler_finished(self, handler, start_bytes):
+        if start_bytes is None or not self.running:
+            return
+        peak = max(0, tracemalloc.get_traced_memory()[1] - start_bytes)
+        HANDLER_MEMORY_PEAK.observe(peak, handler=handler)
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            stats = self._handlers.setdefault(handler, {'calls': 0, 'max_peak_bytes': 0, 'last_peak_bytes': 0})
+            stats['calls'] += 1
+            stats['last_peak_bytes'] = peak
+            stats['max_peak_bytes'] = max(stats['max_peak_bytes'], peak)
+
+    # --- Reporte ---
+
+    def report(self, refresh=False, top=None):
+        """Resumen para el endpoint de administración. refresh toma un snapshot antes."""
+        if not self.running:
+            return {'enabled': False, 'hint': "Activar con MEMORY_PROFILE=1"}
+        top = top or self.top
+        if refresh or self._last is None:
+            self.snapshot()
+        with self._lock:
+            baseline, previous, last = self._baseline, self._previous, self._last
+            handlers = {name: dict(stats) for name, stats in sorted(self._handlers.items())}
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'enabled': True,
+            'started_at': self.started_at,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'interval_seconds': self.interval,
+            'snapshots': self.snapshots,
+            'traced_bytes': current,
+            'traced_peak_bytes': peak,
+            'rss_bytes': _rss_bytes(),
+            'top_sizes': [_stat_dict(s) for s in last.statistics(self.key_type)[:top]],
+            'top_growth_since_previous': [_diff_dict(s) for s in last.compare_to(previous, self.key_type)[:top]],
+            'top_growth_since_start': [_diff_dict(s) for s in last.compare_to(baseline, self.key_type)[:top]],
+            'handlers': handlers,
+        }
+
+
+profiler = MemoryProfiler()
+
+
+def start():
+    """Arranca el perfilado si MEMORY_PROFILE está activo (si no, no hace nada)."""
+    if MEMORY_PROFILE:
+        profiler.start()
+
+
+def stop():
+    profiler.stop()
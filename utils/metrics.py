@@ -0,0 +1,233 @@
+"""
+Métricas en memoria del proceso (contadores e histogramas con etiquetas).
+Se exponen en formato de texto Prometheus desde /metrics y se pueden volcar
+a un archivo JSON para revisarlas con:
+
+    python -m utils.metrics [ruta_snapshot | url_metrics]
+"""
+import os
+import sys
+import json
+import threading
+
+METRICS_SNAPSHOT_PATH = os.getenv('METRICS_SNAPSHOT_PATH', 'metrics_snapshot.json')
+
+# Buckets de latencia en segundos (APIs externas: desde decenas de ms hasta un minuto)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_registry = {}
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, key, extra=None):
+    pairs = list(zip(label_names, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    """Contador monotónico con etiquetas."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def _items(self):
+        with _lock:
+            return sorted((key, dict(value) if isinstance(value, dict) else value) for key, value in self._values.items())
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(_label_key(self.label_names, labels), 0)
+
+    def render(self):
+        lines = []
+        for key, value in self._items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        return [{'labels': dict(zip(self.label_names, key)), 'value': value} for key, value in self._items()]
+
+
+class Histogram:
+    """Histograma acumulativo (buckets fijos) con etiquetas."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> {'buckets': [int], 'sum': float, 'count': int}
+        self._values = {}
+
+    def _items(self):
+        with _lock:
+            return sorted((key, dict(value) if isinstance(value, dict) else value) for key, value in self._values.items())
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def render(self):
+        lines = []
+        for key, state in self._items():
+            for bound, count in zip(self.buckets, state['buckets']):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', bound))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {state['count']}")
+        return lines
+
+    def snapshot(self):
+        return [{
+            'labels': dict(zip(self.label_names, key)),
+            'buckets': list(self.buckets),
+            'bucket_counts': list(state['buckets']),
+            'sum': state['sum'],
+            'count': state['count']
+        } for key, state in self._items()]
+
+
+def _get_or_create(cls, name, help_text, labels, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, help_text, labels, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name, help_text, labels=()):
+    """Obtiene (o registra) un contador."""
+    return _get_or_create(Counter, name, help_text, labels)
+
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    """Obtiene (o registra) un histograma."""
+    return _get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+
+def reset():
+    """Reinicia los valores de todas las métricas (usado por los benchmarks entre escenarios)."""
+    with _lock:
+        for metric in _registry.values():
+            metric._values.clear()
+
+
+def render_prometheus():
+    """Retorna todas las métricas en formato de texto Prometheus."""
+    lines = []
+    for name in sorted(_registry):
+        metric = _registry[name]
+        lines.append(f"# HELP {name} {metric.help_text}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Retorna todas las métricas como diccionario serializable a JSON."""
+    return {
+        name: {'type': metric.kind, 'help': metric.help_text, 'series': metric.snapshot()}
+        for name, metric in sorted(_registry.items())
+    }
+
+
+def dump_snapshot(path=METRICS_SNAPSHOT_PATH):
+    """Guarda las métricas actuales en un archivo JSON."""
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+    return path
+
+
+def estimate_quantile(buckets, bucket_counts, count, q):
+    """Estima un percentil a partir de los buckets acumulativos (interpolación lineal)."""
+    if not count:
+        return None
+    target = q * count
+    prev_bound = 0.0
+    prev_count = 0
+    for bound, cumulative in zip(buckets, bucket_counts):
+        if cumulative >= target:
+            in_bucket = cumulative - prev_count
+            if in_bucket <= 0:
+                return bound
+            return prev_bound + (bound - prev_bound) * (target - prev_count) / in_bucket
+        prev_bound, prev_count = bound, cumulative
+    # Por encima del último bucket
+    return buckets[-1] if buckets else None
+
+
+def format_report(data):
+    """Texto legible con contadores y percentiles de cada histograma."""
+    lines = []
+    for name, metric in data.items():
+        lines.append(f"== {name} ({metric['type']})")
+        for series in metric['series']:
+            labels = ", ".join(f"{k}={v}" for k, v in series['labels'].items()) or "-"
+            if metric['type'] == 'histogram':
+                pct = []
+                for q in (0.5, 0.95, 0.99):
+                    value = estimate_quantile(series['buckets'], series['bucket_counts'], series['count'], q)
+                    pct.append(f"p{int(q * 100)}={value:.3f}" if value is not None else f"p{int(q * 100)}=-")
+                avg = series['sum'] / series['count'] if series['count'] else 0
+                lines.append(f"  [{labels}] n={series['count']} avg={avg:.3f} " + " ".join(pct))
+            else:
+                lines.append(f"  [{labels}] {series['value']}")
+    return "\n".join(lines)
+
+
+def _load(source):
+    if source.startswith('http://') or source.startswith('https://'):
+        import requests
+        response = requests.get(source, params={'format': 'json'}, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    with open(source) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    source = argv[0] if argv else METRICS_SNAPSHOT_PATH
+    try:
+        data = _load(source)
+    except Exception as e:
+        print(f"❌ No se pudieron leer las métricas de {source}: {e}")
+        return 1
+    print(format_report(data))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Envíos del bot a Telegram.
+
+- OutboundRateLimiter: rate_limiter de la aplicación (ApplicationBuilder.rate_limiter), así
+  todo lo que el bot envía pasa por él. Los mensajes a un chat esperan turno en dos token
+  buckets: uno global (TELEGRAM_GLOBAL_RATE por segundo, repartido entre los procesos de
+  trabajo) y uno por chat (TELEGRAM_CHAT_RATE). Si Telegram responde RetryAfter (429),
+  se pausa ese chat (o todo, si la llamada no es a un chat) y se reintenta.
+- outbox: envíos en segundo plano, para que el handler no espere a Telegram. ack() junta
+  las confirmaciones seguidas de un chat en un solo mensaje que se va editando
+  ("📝 3 entradas guardadas en bitácora.") en lugar de mandar una por mensaje.
+"""
+import os
+import time
+import asyncio
+import logging
+import datetime
+import warnings
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from telegram.warnings import PTBDeprecationWarning
+
+from utils import metrics
+
+# Límites de Telegram: ~30 mensajes/s en total y ~1/s por chat privado (20/min en grupos)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE = 20 / 60
+# Mensajes seguidos que se permiten a un chat antes de espaciarlos
+TELEGRAM_CHAT_BURST = 3
+# Reintentos tras RetryAfter antes de dar el envío por fallido
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+# Confirmaciones a un chat con menos de esta separación se juntan en un mismo mensaje
+ACK_COALESCE_SECONDS = float(os.getenv('ACK_COALESCE_SECONDS', '10'))
+# Espera mínima entre ediciones de una misma confirmación (lo que llega mientras tanto va en la siguiente)
+ACK_EDIT_INTERVAL = float(os.getenv('ACK_EDIT_INTERVAL', '2'))
+# Buckets de chats sin actividad que se conservan antes de limpiar
+MAX_IDLE_BUCKETS = 1000
+
+OUTBOUND_WAIT = metrics.histogram(
+    'telegram_outbound_wait_seconds', 'Espera por el límite de envíos antes de llamar a Telegram',
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+OUTBOUND_RETRY_AFTER = metrics.counter(
+    'telegram_retry_after_total', 'Respuestas RetryAfter (429) de Telegram por endpoint', ('endpoint',))
+OUTBOUND_ACKS = metrics.counter(
+    'telegram_acks_total', 'Confirmaciones por resultado (sent = mensaje nuevo, coalesced = sumada a uno existente)', ('status',))
+OUTBOUND_ERRORS = metrics.counter(
+    'telegram_outbound_errors_total', 'Envíos en segundo plano fallidos por tipo de excepción', ('error',))
+
+
+def _retry_seconds(error):
+    # PTB 22 avisa que retry_after pasará de int a timedelta
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', PTBDeprecationWarning)
+        retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """rate fichas por segundo, hasta capacity acumuladas. acquire() espera por una ficha en orden de llegada."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """No entrega fichas durante seconds (RetryAfter)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def is_idle(self):
+        """True si está lleno y nadie espera: se puede descartar sin cambiar el comportamiento."""
+        now = time.monotonic()
+        return (not self._lock.locked() and now >= self.paused_until
+                and self.tokens + (now - self.updated) * self.rate >= self.capacity)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """
+    Token buckets global y por chat para las llamadas con chat_id (sendMessage, editMessageText,
+    sendDocument...). Las demás (getFile, answerCallbackQuery, setWebhook) no esperan, pero
+    también se reintentan tras RetryAfter.
+    """
+
+    def __init__(self, global_rate=None, chat_rate=TELEGRAM_CHAT_RATE, max_retries=TELEGRAM_MAX_RETRIES):
+        if global_rate is None:
+            # Cada proceso de trabajo tiene su propio limitador y el límite es por bot
+            global_rate = TELEGRAM_GLOBAL_RATE / max(1, int(os.getenv('WORKER_PROCESSES', '1')))
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._chats = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_IDLE_BUCKETS:
+                self._chats = {key: b for key, b in self._chats.items() if not b.is_idle()}
+            # Los grupos tienen id negativo y un límite bastante menor
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            bucket = TokenBucket(TELEGRAM_GROUP_RATE if is_group else self.chat_rate, capacity=TELEGRAM_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        attempt = 0
+        while True:
+            if chat_bucket:
+                start = time.perf_counter()
+                await chat_bucket.acquire()
+                await self.global_bucket.acquire()
+                OUTBOUND_WAIT.observe(time.perf_counter() - start)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                OUTBOUND_RETRY_AFTER.inc(endpoint=endpoint)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                seconds = _retry_seconds(e)
+                logging.warning(f"Telegram RetryAfter {seconds}s en {endpoint} (chat {chat_id}), reintento {attempt}")
+                if chat_bucket:
+                    chat_bucket.pause(seconds)
+                else:
+                    await asyncio.sleep(seconds)
+
+
+def _ack_text(counts):
+    lines = []
+    entries = counts.get('text', 0)
+    if entries == 1:
+        lines.append("📝 Texto guardado en bitácora.")
+    elif entries:
+        lines.append(f"📝 {entries} entradas guardadas en bitácora.")
+    photos = counts.get('photo', 0)
+    if photos == 1:
+        lines.append("✅ Foto guardada en Drive.")
+    elif photos:
+        lines.append(f"✅ {photos} fotos guardadas en Drive.")
+    duplicates = counts.get('duplicate', 0)
+    if duplicates == 1:
+        lines.append("♻️ Foto repetida, ya estaba en Drive.")
+    elif duplicates:
+        lines.append(f"♻️ {duplicates} fotos repetidas, ya estaban en Drive.")
+    return "\n".join(lines)
+
+
+class Outbox:
+    """Envíos que el handler no espera. Los errores se registran en el log, no llegan al handler."""
+
+    def __init__(self, coalesce_seconds=ACK_COALESCE_SECONDS):
+        self.coalesce_seconds = coalesce_seconds
+        # chat_id -> {'counts': {kind: n}, 'message_id': int | None, 'sent': str | None, 'last': float, 'task': Task | None}
+        self._acks = {}
+        self._tasks = set()
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _guarded(self, coro):
+        try:
+            await coro
+        except Exception as e:
+            OUTBOUND_ERRORS.inc(error=type(e).__name__)
+            logging.error(f"Error enviando mensaje a Telegram: {e}")
+
+    def send(self, bot, chat_id, text, **kwargs):
+        """bot.send_message en segundo plano."""
+        self._spawn(self._guarded(bot.send_message(chat_id=chat_id, text=text, **kwargs)))
+
+    def ack(self, bot, chat_id, kind='text'):
+        """
+        Confirma algo guardado (kind: 'text' | 'photo' | 'duplicate'). Si el chat recibió una confirmación
+        hace menos de coalesce_seconds, se edita ese mensaje con el total en lugar de mandar otro.
+        """
+        now = time.monotonic()
+        state = self._acks.get(chat_id)
+        if state is None or now - state['last'] > self.coalesce_seconds:
+            if len(self._acks) >= MAX_IDLE_BUCKETS:
+                self._acks = {key: s for key, s in self._acks.items()
+                              if now - s['last'] <= self.coalesce_seconds or (s['task'] and not s['task'].done())}
+            state = {'counts': {}, 'message_id': None, 'sent': None, 'last': now, 'task': None}
+            self._acks[chat_id] = state
+            OUTBOUND_ACKS.inc(status='sent')
+        else:
+            OUTBOUND_ACKS.inc(status='coalesced')
+        state['counts'][kind] = state['counts'].get(kind, 0) + 1
+        state['last'] = now
+
+        # Si ya hay un envío en curso para el chat, al terminar verá el nuevo total
+        if state['task'] is None or state['task'].done():
+            state['task'] = self._spawn(self._guarded(self._flush_ack(bot, chat_id, state)))
+
+    async def _flush_ack(self, bot, chat_id, state):
+        # La primera confirmación sale enseguida; las que llegan mientras se envía
+        # o durante ACK_EDIT_INTERVAL se suman en una sola edición
+        while True:
+            text = _ack_text(state['counts'])
+            if text == state['sent']:
+                return
+            if state['message_id'] is None:
+                message = await bot.send_message(chat_id=chat_id, text=text)
+                state['message_id'] = message.message_id
+            else:
+                await bot.edit_message_text(text, chat_id=chat_id, message_id=state['message_id'])
+            state['sent'] = text
+            await asyncio.sleep(ACK_EDIT_INTERVAL)
+
+    async def drain(self, timeout=None):
+        """Espera los envíos pendientes (al apagar)."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+outbox = Outbox()
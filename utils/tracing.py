@@ -0,0 +1,160 @@
+"""
+Trazas livianas por update: cada update recibe un trace_id y cada etapa
+(descarga de Telegram, Drive, Sheets, IA) registra un span con su duración.
+Los spans se escriben como líneas JSON en TRACE_FILE (desactivado si no se define).
+
+Resumen por etapa con percentiles:
+
+    python -m utils.tracing [traces.jsonl]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv('TRACE_FILE')
+
+_write_lock = threading.Lock()
+# (trace_id, span_id) del span activo en el contexto actual
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    current = _current.get()
+    return current[0] if current else None
+
+
+def _write(record):
+    if not TRACE_FILE:
+        return
+    try:
+        line = json.dumps(record, ensure_ascii=False)
+        with _write_lock:
+            with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+    except Exception as e:
+        logging.error(f"Error escribiendo traza: {e}")
+
+
+@contextmanager
+def span(name, new_trace=False, **attrs):
+    """
+    Registra un span con la duración del bloque.
+    Con new_trace=True inicia una traza nueva (raíz); si no hay traza activa, el span se ignora.
+    """
+    parent = _current.get()
+    if parent is None and not new_trace:
+        yield None
+        return
+
+    trace_id = _new_id() if new_trace or parent is None else parent[0]
+    span_id = _new_id()
+    token = _current.set((trace_id, span_id))
+    start_wall = time.time()
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield trace_id
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        record = {
+            'trace_id': trace_id,
+            'span_id': span_id,
+            'parent_id': parent[1] if parent and not new_trace else None,
+            'name': name,
+            'start': round(start_wall, 6),
+            'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            'status': status
+        }
+        if attrs:
+            record['attrs'] = attrs
+        _write(record)
+
+
+def traced(name):
+    """Decorador para registrar una función síncrona como span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- CLI ---
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def summarize(path):
+    """Agrupa los spans por etapa y calcula n, p50, p95, p99 y máximo (ms)."""
+    stages = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            stage = stages.setdefault(record['name'], {'durations': [], 'errors': 0, 'root': record.get('parent_id') is None})
+            stage['durations'].append(record['duration_ms'])
+            if record.get('status') != 'ok':
+                stage['errors'] += 1
+
+    summary = []
+    for name, stage in stages.items():
+        values = sorted(stage['durations'])
+        summary.append({
+            'name': name,
+            'root': stage['root'],
+            'count': len(values),
+            'errors': stage['errors'],
+            'p50': _percentile(values, 0.50),
+            'p95': _percentile(values, 0.95),
+            'p99': _percentile(values, 0.99),
+            'max': values[-1],
+            'total': sum(values)
+        })
+    # Etapas más costosas primero
+    summary.sort(key=lambda s: s['total'], reverse=True)
+    return summary
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else (TRACE_FILE or 'traces.jsonl')
+    if not os.path.exists(path):
+        print(f"❌ No existe el archivo de trazas: {path}")
+        return 1
+
+    summary = summarize(path)
+    print(f"{'etapa':<45} {'n':>6} {'err':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for s in summary:
+        name = s['name'] + (" *" if s['root'] else "")
+        print(f"{name:<45} {s['count']:>6} {s['errors']:>4} {s['p50']:>9.1f} {s['p95']:>9.1f} {s['p99']:>9.1f} {s['max']:>9.1f}")
+    print("* = span raíz (handler completo)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
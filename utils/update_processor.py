@@ -0,0 +1,195 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from telegram.ext import BaseUpdateProcessor
+
+from utils import metrics
+
+# Updates que pueden estar en vuelo (procesándose o esperando turno) antes de frenar al fetcher
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '1000'))
+# Workers que solo pueden usar los comandos y botones: un /get no espera a que termine una subida
+INTERACTIVE_RESERVED_WORKERS = int(os.getenv('INTERACTIVE_RESERVED_WORKERS', '1'))
+# Cada tantos segundos de espera una update sube un nivel de prioridad (evita que las fotos esperen para siempre)
+PRIORITY_AGING_SECONDS = float(os.getenv('PRIORITY_AGING_SECONDS', '10'))
+
+# Prioridades: menor número, antes se ejecuta
+PRIORITY_INTERACTIVE = 0
+PRIORITY_TEXT = 1
+PRIORITY_MEDIA = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_TEXT: 'text', PRIORITY_MEDIA: 'media'}
+
+UPDATE_QUEUE_WAIT = metrics.histogram(
+    'update_queue_wait_seconds', 'Espera de cada update por un worker (ya con el turno de su usuario), por prioridad',
+    ('priority',), buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+
+
+def get_update_user_key(update):
+    """Clave de serialización de una update: el usuario, o el chat si no hay usuario."""
+    user = getattr(update, 'effective_user', None)
+    if user:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat:
+        return chat.id
+    return None
+
+
+def get_update_priority(update):
+    """Comandos y botones primero, luego texto, al final fotos, documentos y audios."""
+    if getattr(update, 'callback_query', None):
+        return PRIORITY_INTERACTIVE
+    message = getattr(update, 'effective_message', None)
+    if message is None:
+        return PRIORITY_TEXT
+    if message.text and message.text.startswith('/'):
+        return PRIORITY_INTERACTIVE
+    if message.photo or message.document or message.audio or message.voice or message.video:
+        return PRIORITY_MEDIA
+    return PRIORITY_TEXT
+
+
+class _Waiter:
+    __slots__ = ('future', 'priority', 'enqueued', 'seq')
+
+    def __init__(self, future, priority, seq):
+        self.future = future
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.seq = seq
+
+
+class PrioritySlots:
+    """
+    Semáforo de workers que, al liberarse uno, se lo da a la update que espera con mejor
+    prioridad (a igual prioridad, a la que llegó antes).
+
+    - reserved: workers que solo pueden tomar las updates interactivas.
+    - aging: segundos de espera que valen un nivel de prioridad, así una foto que lleva
+      2 * aging esperando pasa antes que un comando recién llegado.
+
+    Como cada usuario tiene a lo sumo una update esperando aquí (la de su turno), al volver
+    a la cola queda detrás de los otros usuarios de su prioridad: se turnan.
+    """
+
+    def __init__(self, slots, reserved=0, aging=PRIORITY_AGING_SECONDS):
+        self.slots = slots
+        self.free = slots
+        # Con un solo worker no se puede reservar nada
+        self.reserved = max(0, min(reserved, slots - 1))
+        self.aging = aging
+        self._waiters = []
+        self._seq = 0
+
+    def _can_take(self, priority):
+        return self.free > (0 if priority == PRIORITY_INTERACTIVE else self.reserved)
+
+    def _rank(self, waiter, now):
+        if self.aging <= 0:
+            return waiter.priority, waiter.seq
+        return waiter.priority - (now - waiter.enqueued) / self.aging, waiter.seq
+
+    def _wake(self):
+        now = time.monotonic()
+        while self._waiters:
+            candidates = [w for w in self._waiters if self._can_take(w.priority)]
+            if not candidates:
+                return
+            best = min(candidates, key=lambda w: self._rank(w, now))
+            self._waiters.remove(best)
+            self.free -= 1
+            best.future.set_result(None)
+
+    async def acquire(self, priority):
+        self._seq += 1
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), priority, self._seq)
+        self._waiters.append(waiter)
+        self._wake()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif not waiter.future.cancelled():
+                # Se le dio el worker justo antes de cancelarse: devolverlo
+                self.release()
+            raise
+        finally:
+            UPDATE_QUEUE_WAIT.observe(time.monotonic() - waiter.enqueued, priority=PRIORITY_NAMES[priority])
+
+    def release(self):
+        self.free += 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa updates de distintos usuarios en paralelo (hasta `workers` a la vez)
+    y las de un mismo usuario una por una, en el orden en que llegaron.
+
+    Así dos mensajes del mismo estudiante nunca hacen read-modify-write sobre
+    su fila del Sheet al mismo tiempo.
+
+    Entre usuarios, los workers se reparten por prioridad (ver PrioritySlots): con la cola
+    llena de fotos (ej: cron_bot al ponerse al día) un /get o /send de otro estudiante pasa
+    adelante. Dentro de un mismo usuario se mantiene el orden de llegada, así su /send ve
+    todo lo que mandó antes.
+    """
+
+    def __init__(self, workers: int, max_pending: int = MAX_PENDING_UPDATES,
+                 reserved: int = INTERACTIVE_RESERVED_WORKERS, aging: float = PRIORITY_AGING_SECONDS):
+        # El semáforo de PTB limita las updates en vuelo; el de workers, las que se ejecutan
+        super().__init__(max(max_pending, workers))
+        self.workers = workers
+        self._worker_slots = PrioritySlots(workers, reserved, aging)
+        # user_key -> [asyncio.Lock, cantidad de updates esperando o ejecutándose]
+        self._user_locks = {}
+
+    @asynccontextmanager
+    async def user_lock(self, user_key):
+        """Turno exclusivo para un usuario (FIFO, los locks de asyncio son justos)."""
+        entry = self._user_locks.get(user_key)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self._user_locks[user_key] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[user_key]
+
+    async def do_process_update(self, update, coroutine):
+        user_key = get_update_user_key(update)
+        priority = get_update_priority(update)
+        if user_key is None:
+            async with self._worker_slots.slot(priority):
+                await coroutine
+            return
+
+        # Primero el turno del usuario, luego un worker: un usuario con cola larga
+        # no ocupa workers mientras espera
+        async with self.user_lock(user_key):
+            async with self._worker_slots.slot(priority):
+                await coroutine
+
+    async def initialize(self):
+        # Los handlers llaman a Google con asyncio.to_thread, que usa el executor por defecto
+        # (min(32, CPUs + 4) hilos). Con menos hilos que workers, un /get que ya tiene worker
+        # esperaría un hilo detrás de las subidas de fotos: la prioridad se decide solo aquí
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.workers + 4, thread_name_prefix='update'))
+
+    async def shutdown(self):
+        pass
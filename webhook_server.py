@@ -0,0 +1,234 @@
+"""
+Modo webhook de producción: una sola app ASGI (Starlette + uvicorn) que sirve
+el webhook de Telegram, el health check, las métricas y los endpoints de administración.
+
+El webhook solo valida y encola la update y responde 200 enseguida; las updates se
+procesan en segundo plano a través del update_processor de la aplicación
+(PerUserUpdateProcessor: usuarios en paralelo, cada usuario en orden).
+Si la cola está llena responde 503 y Telegram reintenta más tarde (backpressure),
+en lugar de acumular trabajo sin límite.
+
+Con WORKER_PROCESSES > 1 las updates se reparten por usuario entre varios procesos
+(ver worker_pool.py) en lugar de procesarse en este.
+
+Se usa desde app.py cuando WEBHOOK_URL está definido.
+"""
+import os
+import time
+import asyncio
+import logging
+import secrets
+import contextlib
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+
+from utils import memory_profile, metrics
+import worker_pool
+
+# Updates aceptadas que esperan turno para empezar a procesarse
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '500'))
+# Updates procesándose (o esperando el turno de su usuario) a la vez; 0 = el límite del update_processor
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '0'))
+# Si se define, Telegram lo manda en X-Telegram-Bot-Api-Secret-Token y se rechaza lo que no lo traiga
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Segundos para terminar lo pendiente al apagar (en total: cola, transcripciones y envíos)
+SHUTDOWN_GRACE_SECONDS = 25
+# Token para los endpoints /admin/* (Authorization: Bearer ...). Sin definir, no hay endpoints de administración
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+WEBHOOK_UPDATES = metrics.counter(
+    'webhook_updates_total', 'Updates recibidas por el webhook por resultado', ('status',))
+WEBHOOK_QUEUE_WAIT = metrics.histogram(
+    'webhook_queue_wait_seconds', 'Tiempo entre que el webhook acepta una update y empieza a procesarse')
+
+_shutdown_deadline = None
+
+
+def begin_shutdown(timeout=SHUTDOWN_GRACE_SECONDS):
+    """Fija el plazo que comparten todas las etapas del apagado de este proceso."""
+    global _shutdown_deadline
+    _shutdown_deadline = time.monotonic() + max(0.0, timeout)
+
+
+def shutdown_remaining():
+    """Segundos que le quedan al apagado (si nadie lo empezó, arranca con SHUTDOWN_GRACE_SECONDS)."""
+    if _shutdown_deadline is None:
+        begin_shutdown()
+    return max(0.0, _shutdown_deadline - time.monotonic())
+
+
+class UpdateDispatcher:
+    """
+    Cola acotada entre el webhook y la aplicación. Un solo consumidor saca updates en orden
+    de llegada y lanza una tarea por update mientras haya lugar (max_in_flight).
+    """
+
+    def __init__(self, application, queue_size=WEBHOOK_QUEUE_SIZE, max_in_flight=WEBHOOK_MAX_IN_FLIGHT):
+        self.application = application
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_in_flight = max_in_flight or application.update_processor.max_concurrent_updates
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._tasks = set()
+        self._consumer = None
+
+    def offer(self, update):
+        """Encola sin esperar. Retorna False si la cola está llena."""
+        try:
+            self.queue.put_nowait((update, time.perf_counter()))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def put(self, update):
+        """Encola esperando lugar (para quien puede esperar en lugar de responder 503)."""
+        await self.queue.put((update, time.perf_counter()))
+
+    @property
+    def queued(self):
+        return self.queue.qsize()
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    def start(self):
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def _consume(self):
+        while True:
+            update, queued_at = await self.queue.get()
+            await self._slots.acquire()
+            WEBHOOK_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+            task = asyncio.create_task(self._process(update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, update):
+        try:
+            # Igual que el fetcher de PTB: pasa por el update_processor de la aplicación
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update))
+        except Exception as e:
+            logging.error(f"Error procesando update {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+            self.queue.task_done()
+
+    async def stop(self, timeout=None):
+        """Espera (hasta timeout o lo que quede del apagado) a que se procese lo ya aceptado y detiene el consumidor."""
+        if timeout is None:
+            timeout = shutdown_remaining()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Apagado con {self.queue.qsize()} updates en cola y {self.in_flight} en proceso")
+        if self._consumer:
+            self._consumer.cancel()
+
+
+def create_asgi_app(application, webhook_url, url_path, secret_token=WEBHOOK_SECRET, dispatcher=None):
+    """
+    App ASGI con:
+    - POST /{url_path}: webhook de Telegram (responde 200 apenas encola)
+    - GET /: health check
+    - GET /metrics: métricas Prometheus (o JSON con ?format=json)
+    - GET /admin/memory: perfil de memoria (MEMORY_PROFILE=1 y ADMIN_TOKEN); ?refresh=1 toma un snapshot, ?top=N
+    Al arrancar inicializa la aplicación y registra el webhook; al apagar drena la cola.
+    dispatcher reemplaza al UpdateDispatcher local (ej: worker_pool.ProcessPartitioner).
+    """
+    dispatcher = dispatcher or UpdateDispatcher(application)
+
+    async def telegram_webhook(request):
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            WEBHOOK_UPDATES.inc(status='forbidden')
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            # Un 200 evita que Telegram reintente algo que nunca se va a poder leer
+            logging.warning(f"Update inválida en el webhook: {e}")
+            WEBHOOK_UPDATES.inc(status='invalid')
+            return Response(status_code=200)
+
+        if not dispatcher.offer(update):
+            WEBHOOK_UPDATES.inc(status='rejected')
+            return Response(status_code=503, headers={'Retry-After': '5'})
+        WEBHOOK_UPDATES.inc(status='accepted')
+        return Response(status_code=200)
+
+    async def home(request):
+        return JSONResponse({
+            'status': "VinculacionBot is running!",
+            'queued': dispatcher.queued,
+            'in_flight': dispatcher.in_flight
+        })
+
+    async def metrics_endpoint(request):
+        if request.query_params.get('format') == 'json':
+            return JSONResponse(metrics.snapshot())
+        return PlainTextResponse(metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+    async def admin_memory(request):
+        if not ADMIN_TOKEN:
+            return Response(status_code=404)
+        if not secrets.compare_digest(request.headers.get('Authorization', ''), f"Bearer {ADMIN_TOKEN}"):
+            return Response(status_code=403)
+        try:
+            top = int(request.query_params.get('top', 0)) or None
+        except ValueError:
+            return JSONResponse({'error': "top debe ser un número"}, status_code=400)
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        # Comparar snapshots recorre todas las asignaciones: fuera del event loop
+        report = await asyncio.to_thread(memory_profile.profiler.report, refresh, top)
+        return JSONResponse(report)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        memory_profile.start()
+        await application.initialize()
+        await application.start()
+        dispatcher.start()
+        await application.bot.set_webhook(
+            url=f"{webhook_url}/{url_path}",
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=40
+        )
+        logging.info(f"Webhook registrado en {webhook_url}")
+        try:
+            yield
+        finally:
+            begin_shutdown()
+            await dispatcher.stop(shutdown_remaining())
+            await application.stop()
+            # Igual que run_polling/run_webhook de PTB (ej: esperar transcripciones en curso)
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+            metrics.dump_snapshot()
+            memory_profile.stop()
+
+    asgi_app = Starlette(routes=[
+        Route('/', home),
+        Route('/metrics', metrics_endpoint),
+        Route('/admin/memory', admin_memory),
+        Route(f'/{url_path}', telegram_webhook, methods=['POST'])
+    ], lifespan=lifespan)
+    asgi_app.state.dispatcher = dispatcher
+    return asgi_app
+
+
+def run(application, webhook_url, url_path, port, processes=1):
+    """
+    Sirve la app ASGI con uvicorn (bloquea hasta que el proceso recibe SIGINT/SIGTERM).
+    processes > 1 reparte las updates entre esa cantidad de procesos de trabajo.
+    """
+    dispatcher = None
+    if processes > 1:
+        dispatcher = worker_pool.ProcessPartitioner(processes)
+    asgi_app = create_asgi_app(application, webhook_url, url_path, dispatcher=dispatcher)
+    uvicorn.run(asgi_app, host="0.0.0.0", port=port, log_level="info")
@@ -0,0 +1,142 @@
+"""
+Varios procesos de trabajo detrás de un solo webhook.
+
+El proceso del webhook (webhook_server.py) reparte cada update según su usuario
+(user_id % WORKER_PROCESSES), así las updates de un estudiante siempre van al mismo
+proceso y se procesan en orden. Cada proceso tiene su propia aplicación de PTB con
+el mismo UpdateDispatcher que el modo de un proceso.
+
+El estado compartido (cupos, autenticación, bitácora local, sesiones del día) está en
+bot_data.db en modo WAL, así que cualquier proceso puede leerlo.
+
+Se activa con WORKER_PROCESSES > 1 en modo webhook.
+"""
+import os
+import time
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from telegram import Update
+
+from utils import auth, memory_profile, metrics
+from utils.update_processor import get_update_user_key
+
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+# Updates que pueden esperar en la cola de cada proceso antes de responder 503 a Telegram
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '200'))
+# Segundos que se le dan a cada proceso, pasado el plazo del apagado, para cerrar
+# (shutdown de PTB, auth.flush, snapshot de métricas) antes de matarlo
+WORKER_EXIT_SECONDS = 10
+
+# Mensaje de fin: (_STOP, plazo en time.time()) para que el proceso reparta lo que le queda
+_STOP = 'stop'
+
+
+def _worker_main(index, updates):
+    """Punto de entrada de cada proceso: crea su aplicación y procesa lo que le llega por la cola."""
+    # Ctrl+C llega a todo el grupo de procesos: el apagado lo ordena el proceso del webhook
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Importar aquí: el proceso hijo arranca limpio (spawn)
+    import app
+    import webhook_server
+
+    async def run():
+        memory_profile.start()
+        application = app.create_application()
+        await application.initialize()
+        await application.start()
+        dispatcher = webhook_server.UpdateDispatcher(application)
+        dispatcher.start()
+        loop = asyncio.get_running_loop()
+        logging.info(f"Worker {index} listo (pid {os.getpid()})")
+        try:
+            while True:
+                data = await loop.run_in_executor(None, updates.get)
+                if isinstance(data, tuple) and data[0] == _STOP:
+                    # Cola, transcripciones y envíos comparten el plazo que fijó el proceso del webhook
+                    webhook_server.begin_shutdown(data[1] - time.time())
+                    break
+                await dispatcher.put(Update.de_json(data, application.bot))
+        finally:
+            await dispatcher.stop()
+            await application.stop()
+            # Igual que run_polling/run_webhook de PTB (ej: esperar transcripciones en curso)
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+            # Los procesos hijos no ejecutan atexit: guardar aquí la autenticación pendiente
+            auth.flush()
+            # Cada proceso deja sus métricas en su propio archivo
+            root, ext = os.path.splitext(metrics.METRICS_SNAPSHOT_PATH)
+            metrics.dump_snapshot(f"{root}.{index}{ext}")
+            memory_profile.stop()
+
+    asyncio.run(run())
+
+
+class ProcessPartitioner:
+    """
+    Mismo interfaz que webhook_server.UpdateDispatcher (offer/start/stop/queued/in_flight),
+    pero reparte las updates entre procesos por usuario.
+    """
+
+    def __init__(self, processes=WORKER_PROCESSES, queue_size=WORKER_QUEUE_SIZE):
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue(maxsize=queue_size) for _ in range(processes)]
+        self.processes = [
+            context.Process(target=_worker_main, args=(i, q), name=f"bot-worker-{i}")
+            for i, q in enumerate(self.queues)
+        ]
+
+    def partition(self, update):
+        key = get_update_user_key(update)
+        return (key or 0) % len(self.queues)
+
+    def offer(self, update):
+        """Encola en el proceso del usuario sin esperar. Retorna False si su cola está llena."""
+        try:
+            self.queues[self.partition(update)].put_nowait(update.to_dict())
+            return True
+        except queue.Full:
+            return False
+
+    @property
+    def queued(self):
+        try:
+            return sum(q.qsize() for q in self.queues)
+        except NotImplementedError:
+            # macOS no implementa qsize() en multiprocessing.Queue
+            return None
+
+    @property
+    def in_flight(self):
+        return None
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    async def stop(self, timeout):
+        """
+        Pide a cada proceso que termine lo pendiente en timeout segundos (en total, para todas sus
+        etapas) y espera a que salga, con WORKER_EXIT_SECONDS más para su cierre.
+        """
+        stop_message = (_STOP, time.time() + timeout)
+        deadline = time.monotonic() + timeout + WORKER_EXIT_SECONDS
+        for process, q in zip(self.processes, self.queues):
+            try:
+                # Con la cola llena (proceso colgado o muy atrasado) put() sin timeout no volvería nunca
+                await asyncio.to_thread(q.put, stop_message, True, max(0.1, deadline - time.monotonic()))
+            except queue.Full:
+                logging.warning(f"La cola de {process.name} sigue llena, se detiene sin esperar")
+                process.terminate()
+        for process in self.processes:
+            await asyncio.to_thread(process.join, max(0.1, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.warning(f"{process.name} no terminó a tiempo, se detiene")
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)